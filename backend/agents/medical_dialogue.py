@@ -35,3 +35,21 @@ def medical_dialogue(response_queue, query_data, carrier, tracker):
     finally:
         coroutine.close()
         return result
+
+
+async def medical_dialogue_async(response_queue, query_data, carrier, tracker):
+    # 在服务自身的事件循环中运行，不再需要线程池和新的事件循环
+    result = None
+    try:
+        service_logger.info(f"medical_dialogue_async query_data: {query_data}")
+        result = await http_request(
+            url=ai_doctor_dialogue_url,
+            response_queue=response_queue,
+            model_query=query_data,
+            tracker=tracker
+        )
+    except Exception as search_ex:
+        response_queue.put(StreamSearchData.build_from_error("", carrier))
+        response_queue.put(None)
+        service_logger.error(traceback.format_exc())
+    return result
@@ -0,0 +1,67 @@
+"""
+回答 token 合并输出基准测试：逐 token 输出 vs 按窗口合并输出
+
+模拟算法服务以固定间隔推送回答增量，统计每个回答输出的 SSE 帧数、字节数和每个流的 CPU 耗时
+
+运行方式::
+
+    python -m benchmarks.bench_coalescing [--tokens 1000] [--interval-ms 2] [--window-ms 30] [--max-bytes 1024]
+"""
+import argparse
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+from benchmarks.rag_chat_stream import build_events
+from util.stream.response_queue import ResponseQueue
+from util.stream.stream_search_model import StreamSearchData
+from util.tracker.stream_search_tracker import StreamingSearchTracker
+
+
+async def produce(response_queue: ResponseQueue, tokens: list[str], interval: float):
+    for token in tokens:
+        response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, token))
+        await asyncio.sleep(interval)
+    response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Finished).build())
+    response_queue.put(None)
+
+
+async def run_stream(tokens: list[str], interval: float, window_ms: float, max_bytes: int):
+    response_queue = ResponseQueue(next_action=lambda item: item,
+                                   error_action=lambda error: StreamSearchData.build_from_error("", {}),
+                                   complete_action=lambda: None,
+                                   tracker=StreamingSearchTracker(MagicMock()),
+                                   coalesce_window_ms=window_ms,
+                                   coalesce_max_bytes=max_bytes)
+    frames = 0
+    size = 0
+    cpu_start = time.process_time()
+    producer = asyncio.create_task(produce(response_queue, tokens, interval))
+    async for packet in response_queue.subscribe():
+        if packet.startswith(b'data: {"event": "answering"'):
+            frames += 1
+        size += len(packet)
+    await producer
+    return frames, size, time.process_time() - cpu_start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--interval-ms", type=float, default=2)
+    parser.add_argument("--window-ms", type=float, default=30)
+    parser.add_argument("--max-bytes", type=int, default=1024)
+    args = parser.parse_args()
+
+    tokens = [event["answer"] for event in build_events(args.tokens, cumulative=False) if event["event"] == "answer"]
+    interval = args.interval_ms / 1000
+    print(f"answer tokens: {len(tokens)}, token interval: {args.interval_ms} ms")
+    baseline = None
+    for name, window_ms in [("per-token", 0), (f"window {args.window_ms:g}ms", args.window_ms)]:
+        frames, size, cpu = asyncio.run(run_stream(tokens, interval, window_ms, args.max_bytes))
+        baseline = baseline or frames
+        print(f"{name:<14} frames/answer: {frames:>6}  reduction: {baseline / frames:>6.1f}x  bytes: {size / 1024:>8.1f} KiB  cpu/stream: {cpu * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+SSE 解析基准测试：旧的逐行正则解析 vs 字节流增量解析
+
+运行方式::
+
+    python -m benchmarks.bench_sse_parser [录制的 rag_chat 响应文件]
+
+- 传入录制文件时只测该文件；否则分别测累计回答流（每个事件携带完整回答）与逐 token 流
+- 每项输出：吞吐（events/sec）、解析期间的峰值内存/事件、解析结果留存的内存块数与字节数/事件
+  （tracemalloc 快照对比，统计的是解析代码留下的对象，两种实现都保留全部 Event）
+"""
+import json
+import re
+import sys
+import timeit
+import tracemalloc
+
+from benchmarks.rag_chat_stream import build_stream, load_stream, split_chunks
+from util.aiohttp_sse_client import Event, SSEParser
+
+_SSE_LINE_PATTERN = re.compile('(?P<name>[^:]*):?( ?(?P<value>.*))?')
+
+
+def legacy_event(raw_lines: list[str]) -> Event:
+    """旧的 Event.parse：逐行正则，f-string 拼接 data"""
+    msg = Event()
+    for line in raw_lines:
+        m = _SSE_LINE_PATTERN.match(line)
+        name = m.group("name")
+        if name == "":
+            continue
+        value = m.group("value")
+        if name == "data":
+            msg.data = f"{msg.data}\n{value}" if msg.data else value
+        elif name == "event":
+            msg.event = value
+        elif name == "id":
+            msg.id = value
+    msg.data_json = json.loads(msg.data)
+    return msg
+
+
+def legacy_parse(chunks: list[bytes]) -> list[Event]:
+    """旧实现：aiohttp 按行读取，逐行 decode，空行处组装事件"""
+    events = []
+    lines = []
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        *raw_lines, pending = pending.split(b"\n")
+        for raw_line in raw_lines:
+            line = (raw_line + b"\n").decode("utf8")
+            if line == "\n":
+                events.append(legacy_event(lines))
+                lines = []
+            else:
+                lines.append(line)
+    return events
+
+
+def incremental_parse(chunks: list[bytes]) -> list[Event]:
+    parser = SSEParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+
+def measure(name: str, func, chunks: list[bytes], rounds: int = 10):
+    # timeit 计时期间关闭 gc，避免大量留存对象触发的回收干扰对比
+    events = len(func(chunks))
+    best = min(timeit.repeat(lambda: func(chunks), number=1, repeat=rounds))
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = func(chunks)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del result
+    print(f"  {name:<12} events: {events:>6}  events/sec: {events / best:>10.0f}  "
+          f"peak bytes/event: {peak / events:>9.1f}  "
+          f"retained blocks/event: {blocks / events:>6.2f}  retained bytes/event: {size / events:>9.1f}")
+
+
+def run(title: str, stream: bytes):
+    chunks = split_chunks(stream)
+    print(f"{title}: {len(stream) / 1024:.1f} KiB, chunks: {len(chunks)}")
+    measure("legacy", legacy_parse, chunks)
+    measure("incremental", incremental_parse, chunks)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(sys.argv[1], load_stream(sys.argv[1]))
+    else:
+        run("cumulative answer stream", build_stream(cumulative=True))
+        run("per-token answer stream", build_stream(cumulative=False))
@@ -0,0 +1,59 @@
+"""
+回答帧序列化基准测试：Builder + dict + json.dumps vs build_answer + to_packet
+
+运行方式::
+
+    python -m benchmarks.bench_stream_packet [--tokens 30000] [--rounds 5]
+"""
+import argparse
+import json
+import timeit
+
+from util.stream.stream_search_model import StreamSearchData
+
+META = {"trace_id": "0x5f0c1a2b3c4d5e6f", "dialog_id": "6650a1b2c3d4e5f607182930"}
+
+
+def legacy_packet(data: StreamSearchData):
+    # 优化前的序列化方式：构建 dict 后 json.dumps，再拼接字符串
+    packet_dict = {}
+    for field_name in StreamSearchData.__slots__:
+        field_value = getattr(data, field_name)
+        if field_value is not None:
+            if isinstance(field_value, StreamSearchData.SearchEvent):
+                packet_dict.update({field_name: field_value.name.lower()})
+            else:
+                packet_dict.update({field_name: field_value})
+    return ("data: " + json.dumps(packet_dict, ensure_ascii=False) + "\n\n").encode('utf-8')
+
+
+def legacy_frames(tokens: list[str]):
+    for token in tokens:
+        data = StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Answering).answer(token).build()
+        data.meta = META
+        legacy_packet(data)
+
+
+def packet_frames(tokens: list[str]):
+    for token in tokens:
+        data = StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, token)
+        data.meta = META
+        data.to_packet()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=30000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    base = ["指南", "建议", "，", "多", "喝水", "。\n"]
+    tokens = (base * (args.tokens // len(base) + 1))[:args.tokens]
+    legacy = min(timeit.repeat(lambda: legacy_frames(tokens), number=1, repeat=args.rounds))
+    current = min(timeit.repeat(lambda: packet_frames(tokens), number=1, repeat=args.rounds))
+    print(f"answering frames/sec: legacy {len(tokens) / legacy:.0f}, "
+          f"to_packet {len(tokens) / current:.0f}, speedup {legacy / current:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+任务获取竞争基准测试：N 个 worker 并发从同一个任务集合获取任务
+
+- legacy: 原来的方式，find_pending_tasks 取 10 个候选任务，再逐个 acquire_lock，所有 worker 争抢同一批候选
+- claim: claim_next_task，一次 find_one_and_update 按 (priority, check_time) 原子获取
+
+统计获取全部任务的耗时、吞吐、Mongo 操作次数和失败的加锁次数，以及高优先级任务（upload_report）的平均获取顺序
+
+运行方式（需要本地 MongoDB，会创建并删除临时集合）::
+
+    python -m benchmarks.bench_task_claim [--mongo-url mongodb://localhost:27017] [--workers 8] [--tasks 2000]
+
+--mongo-url mongomock 使用进程内的 mongomock，只用于检查脚本本身
+"""
+import argparse
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from pymongo import MongoClient
+
+from service.repository.mongo_task_manager import MongoTaskManager, TaskStatus
+from util.model_types import TaskCollectionModel
+
+PRIORITIES = {"upload_report": 0, "generate_treatment": 2, "summarize_history_data": 5}
+
+
+def legacy_claim(manager: MongoTaskManager, worker_id: str, stats: dict):
+    """原来的获取方式：按不存在的 time 字段排序取 10 个候选任务，再逐个加锁"""
+    query = {
+        TaskCollectionModel.status: TaskStatus.PENDING.value,
+        TaskCollectionModel.check_time: {"$lte": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+    }
+    tasks = []
+    for task in manager.collection.find(query).limit(10).sort("time", -1):
+        task["task_id"] = str(task["_id"])
+        tasks.append(task)
+    stats["ops"] += 1
+    claimed = []
+    for task in tasks:
+        stats["ops"] += 1
+        if manager.acquire_lock(task["task_id"], worker_id):
+            claimed.append(task)
+        else:
+            stats["lock_failures"] += 1
+    return claimed
+
+
+def atomic_claim(manager: MongoTaskManager, worker_id: str, stats: dict):
+    stats["ops"] += 1
+    task = manager.claim_next_task(worker_id)
+    return [task] if task is not None else []
+
+
+def run(mode: str, client, db: str, workers: int, tasks: int, serialize: bool = False) -> dict:
+    collection_name = f"bench_tasks_{uuid.uuid4().hex[:8]}"
+    manager = MongoTaskManager(mongo_client=client, db=db, collection_name=collection_name, priorities=PRIORITIES)
+    types = list(PRIORITIES)
+    for i in range(tasks):
+        manager.add_task(types[i % len(types)], {"index": i})
+
+    claim = legacy_claim if mode == "legacy" else atomic_claim
+    order = []
+    order_lock = threading.Lock()
+    stats = {"ops": 0, "lock_failures": 0}
+    stats_lock = threading.Lock()
+    # mongomock 不是线程安全的，只能串行访问
+    mongo_lock = threading.Lock() if serialize else None
+
+    def worker(worker_id: str):
+        local = {"ops": 0, "lock_failures": 0}
+        while True:
+            if mongo_lock:
+                mongo_lock.acquire()
+            try:
+                claimed = claim(manager, worker_id, local)
+                for task in claimed:
+                    manager.release_lock(task["task_id"], worker_id, TaskStatus.COMPLETED)
+                    local["ops"] += 1
+            finally:
+                if mongo_lock:
+                    mongo_lock.release()
+            if not claimed:
+                break
+            with order_lock:
+                order.extend(task["task_type"] for task in claimed)
+        with stats_lock:
+            for key in stats:
+                stats[key] += local[key]
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(f"worker_{i}",)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    client[db].drop_collection(collection_name)
+
+    positions = [i for i, task_type in enumerate(order) if task_type == "upload_report"]
+    return {
+        "claimed": len(order),
+        "duration": duration,
+        "ops": stats["ops"],
+        "lock_failures": stats["lock_failures"],
+        "upload_report_rank": sum(positions) / len(positions) / len(order) if positions else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="bench")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--tasks", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.mongo_url == "mongomock":
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(args.mongo_url)
+    print(f"workers: {args.workers}, tasks: {args.tasks}")
+    for mode in ("legacy", "claim"):
+        result = run(mode, client, args.db, args.workers, args.tasks, serialize=args.mongo_url == "mongomock")
+        print(f"{mode:<7} claimed: {result['claimed']:>6}  {result['claimed'] / result['duration']:>8.0f} tasks/s  "
+              f"mongo ops: {result['ops']:>7}  lock failures: {result['lock_failures']:>6}  "
+              f"upload_report mean rank: {result['upload_report_rank']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
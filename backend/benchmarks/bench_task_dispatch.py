@@ -0,0 +1,106 @@
+"""
+任务分发延迟基准测试：轮询 vs Redis Streams 唤醒
+
+按随机间隔写入任务（mongomock），统计从 add_task 到任务开始执行的延迟
+- poll: 与原来一样，定时器每 poll_interval 秒调用 process_pending_tasks
+- push: add_task 发送唤醒通知，监听线程收到后立即执行；默认使用进程内的 stream 模拟，--redis 使用真实的 Redis
+
+运行方式::
+
+    python -m benchmarks.bench_task_dispatch [--tasks 20] [--poll-interval 2] [--redis]
+"""
+import argparse
+import queue
+import random
+import statistics
+import threading
+import time
+import uuid
+from unittest.mock import patch
+
+from mongomock import MongoClient
+
+from service.package.redis_client import MessageClient
+from service.package.task_wakeup import TaskWakeup
+from service.repository.mongo_task_manager import MongoTaskManager, TaskStatus
+from util.model_types import TaskCollectionModel
+import worker.process_task as process_task
+
+
+class InProcessStream:
+    """进程内模拟 Redis Streams 消费组，接口与 MessageClient 一致"""
+    messages = queue.Queue()
+
+    def __init__(self, in_channel: str = None, consumer_id: str = None, read_pending: bool = False):
+        pass
+
+    def send(self, msg: dict, maxlen: int = None):
+        message_id = str(uuid.uuid4())
+        InProcessStream.messages.put((message_id, {key: str(value) for key, value in msg.items()}))
+        return message_id
+
+    def receive(self, block: int = 10):
+        try:
+            return InProcessStream.messages.get(timeout=block / 1000)
+        except queue.Empty:
+            return None
+
+    def ack(self, id):
+        pass
+
+    def close(self):
+        pass
+
+
+def run(mode: str, tasks: int, poll_interval: float, client_factory) -> list[float]:
+    manager = MongoTaskManager(mongo_client=MongoClient(), db="bench", collection_name=f"tasks_{mode}")
+    latencies = []
+    done = threading.Semaphore(0)
+
+    def job(task_id, params):
+        task = manager.get_by_task_id(task_id)
+        latencies.append(time.time() - task[TaskCollectionModel.ready_at])
+        done.release()
+        return TaskStatus.COMPLETED
+
+    stopped = threading.Event()
+    wakeup = TaskWakeup(stream=f"bench_task_dispatch_{uuid.uuid4().hex[:8]}", client_factory=client_factory)
+    with patch.object(process_task, "task_manager", manager), patch.dict(process_task.job_map, {"bench": job}):
+        if mode == "push":
+            manager.notifier = wakeup
+            wakeup.listen(process_task.process_task_by_id, process_task.worker_id)
+        else:
+            def poll():
+                while not stopped.wait(poll_interval):
+                    process_task.process_pending_tasks()
+            threading.Thread(target=poll, daemon=True).start()
+
+        for _ in range(tasks):
+            manager.add_task("bench", {})
+            time.sleep(random.uniform(0, poll_interval))
+        for _ in range(tasks):
+            done.acquire(timeout=poll_interval * 2)
+        stopped.set()
+        wakeup.stop()
+        process_task.task_executor.join(poll_interval * 2)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--poll-interval", type=float, default=2)
+    parser.add_argument("--redis", action="store_true", help="使用真实的 Redis Streams")
+    args = parser.parse_args()
+
+    client_factory = MessageClient if args.redis else InProcessStream
+    print(f"tasks: {args.tasks}, poll interval: {args.poll_interval}s, stream: {'redis' if args.redis else 'in-process'}")
+    for mode in ("poll", "push"):
+        latencies = sorted(run(mode, args.tasks, args.poll_interval, client_factory))
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{mode:<5} enqueue-to-start  mean: {statistics.mean(latencies) * 1000:>8.1f} ms  "
+              f"p95: {p95 * 1000:>8.1f} ms  max: {latencies[-1] * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
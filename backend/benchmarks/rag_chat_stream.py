@@ -0,0 +1,49 @@
+"""
+基准测试使用的 rag_chat SSE 流
+- 传入录制文件路径时（/assistant/rag_chat 的原始响应字节），直接读取
+- 否则按 rag_chat 的事件结构生成一份：参考资料、累计回答、溯源、结束
+"""
+import json
+import random
+
+ANSWER_TOKENS = ["感冒", "退热", "颗粒", "适用于", "儿童", "，", "但", "需要", "遵医嘱", "。", "\n"]
+
+
+def build_events(answer_tokens: int = 2000, cumulative: bool = True) -> list[dict]:
+    rng = random.Random(0)
+    events = [{"event": "query_understood", "query_fixed_list": ["感冒退热颗粒适合小孩子使用吗？"]}]
+    events.append({
+        "event": "doc_reranked",
+        "doc_reranked": [
+            [0.9, {"fields": {"doc_id": str(i), "title": f"指南{i}", "content": "内容" * 200}}, 0, 0, 0, "health-guideline"]
+            for i in range(8)
+        ],
+    })
+    answer = ""
+    for i in range(answer_tokens):
+        token = rng.choice(ANSWER_TOKENS)
+        answer += token
+        event = {"event": "answer", "answer": answer if cumulative else token}
+        if i % 200 == 199:
+            event["trace"] = {"cite_idx": [i % 8]}
+        events.append(event)
+    events.append({"event": "finished"})
+    return events
+
+
+def build_stream(answer_tokens: int = 2000, cumulative: bool = True) -> bytes:
+    parts = []
+    for event in build_events(answer_tokens, cumulative):
+        parts.append(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+    return b"".join(parts)
+
+
+def load_stream(path: str = None, answer_tokens: int = 2000) -> bytes:
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    return build_stream(answer_tokens)
+
+
+def split_chunks(stream: bytes, chunk_size: int = 1024) -> list[bytes]:
+    return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
@@ -8,9 +8,8 @@ from prometheus_client import start_http_server, make_asgi_app, CollectorRegistr
 from starlette.requests import Request
 from starlette.responses import Response, JSONResponse
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 from contextlib import asynccontextmanager
-from worker.process_task import process_pending_tasks
+from worker.process_task import add_task_jobs, process_task_by_id, worker_id, task_executor
 from metrics.meter_key import MeterKey
 from metrics.meters import record_latency, record_count
 from metrics.metrics import REQUEST_LATENCY, REQUEST_ERROR_COUNT
@@ -18,8 +17,14 @@ from service import health
 from service.api import dialog, user_file, stream_search, view, question_recommend, report, message
 from service.api.ai_doctor import patient_chat, doctor_console
 from service.exceptions.auth_exception import AuthFailedException
-from service.config.config import config
+from service.config.config import config, TASK_DISPATCH_ENABLED, TASK_SHUTDOWN_TIMEOUT, TASK_SCHEDULER_ENABLED
+from service.package.task_wakeup import task_wakeup
+from service.package.task_events import task_events
 from util.execution_context import ExecutionContext
+from util.http_pool import http_pool
+from util.stream.stop_signal import stop_signal
+from util.stream.resumable_stream import replay_store
+from util.stream.answer_cache import answer_cache
 from util.logger import service_logger, custom_logging_config, access_logger
 from util.timer import Timer
 
@@ -33,16 +38,39 @@ scheduler = BackgroundScheduler()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动定时任务调度器
-    # 使用 max_instances=1 来限制任务的并发数，TODO：等资源充足后，去掉 max_instances 限制
-    scheduler.add_job(process_pending_tasks, IntervalTrigger(seconds=2), max_instances=1)
-    scheduler.start()
-    service_logger.info("Scheduler started.")
+    # 启动定时任务调度器；任务由独立的任务进程（python -m worker）处理时不启动
+    # 轮询只负责获取任务，任务在 task_executor 中按类型并发执行，max_instances=1 避免重复轮询
+    # 开启任务唤醒时，轮询只作为兜底（通知丢失、延迟任务、进程重启）；另外定时续约执行中的任务、回收过期任务
+    if TASK_SCHEDULER_ENABLED:
+        add_task_jobs(scheduler)
+        scheduler.start()
+        service_logger.info("Scheduler started.")
+        if TASK_DISPATCH_ENABLED:
+            task_wakeup.listen(process_task_by_id, worker_id)
+    # 共享的 HTTP 连接池
+    await http_pool.start()
+    # 跨 worker 的停止生成通知
+    await stop_signal.start()
+    # 断线续传的数据帧缓存
+    await replay_store.start()
+    # 答案缓存的跨 worker 失效通知
+    await answer_cache.start()
+    # 任务状态变化，推送给医生工作站
+    await task_events.start()
 
     yield  # 生命周期中的主事件循环
 
-    scheduler.shutdown()
-    service_logger.info("Scheduler stopped.")
+    await task_events.close()
+    await answer_cache.close()
+    await replay_store.close()
+    await stop_signal.close()
+    await http_pool.close()
+    if TASK_SCHEDULER_ENABLED:
+        task_wakeup.stop()
+        scheduler.shutdown()
+        service_logger.info("Scheduler stopped.")
+        # 等待执行中的任务结束，尚未开始的任务放回队列
+        task_executor.shutdown(TASK_SHUTDOWN_TIMEOUT)
 
 
 app = FastAPI(lifespan=lifespan)
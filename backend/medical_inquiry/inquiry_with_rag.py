@@ -4,7 +4,7 @@ import traceback
 from metrics.meter_key import MeterKey
 from metrics.meters import record_latency
 from metrics.metrics import SEARCH_ALGO_LATENCY
-from rag.rag_http import http_request
+from rag.rag_http import http_request, http_stream
 from service.config.config import algo_config
 from util.timer import Timer
 from util.logger import algo_logger
@@ -40,3 +40,16 @@ def inquiry_with_rag(response_queue: ResponseQueue, model_query, tracer, carrier
             coroutine.close()
             record_latency(MeterKey(inquiry_with_rag.__qualname__, inquiry_with_rag.__name__), SEARCH_ALGO_LATENCY, timer.duration())
             return result
+
+
+async def inquiry_with_rag_async(response_queue: ResponseQueue, model_query, tracer, carrier, tracker: StreamingSearchTracker):
+    # 在服务自身的事件循环中运行，复用 rag http 接口 http_stream
+    return await http_stream(
+        url=inquiry_service_url,
+        response_queue=response_queue,
+        model_query=model_query,
+        tracer=tracer,
+        carrier=carrier,
+        tracker=tracker,
+        meter_key=MeterKey(inquiry_with_rag_async.__qualname__, inquiry_with_rag_async.__name__),
+    )
@@ -44,6 +44,7 @@ def record_latency(meter_key: MeterKey, metric: Metrics, latency: float) -> None
             labelnames=meter_key.__dict__.keys(),
             namespace=NAMESPACE,
             subsystem=SUBSYSTEM,
+            buckets=metric.buckets or Histogram.DEFAULT_BUCKETS,
         )
         meters[metric] = meter
     meter.labels(*meter_key.__dict__.values()).observe(latency)
@@ -13,9 +13,11 @@ class Metrics:
         obj._value_ = args[0]
         return obj
 
-    def __init__(self, name: str, metric_type: MetricType):
+    def __init__(self, name: str, metric_type: MetricType, buckets: tuple = None):
         self.name = name
         self.metric_type = metric_type
+        # Histogram 的分桶，None 使用 prometheus_client 的默认分桶（最大 10 秒）
+        self.buckets = buckets
 
 
 REQUEST_LATENCY = Metrics("request_latency", MetricType.Histogram)
@@ -38,4 +40,54 @@ FIRST_TOKEN_LATENCY_FROM_LLM = Metrics("first_token_latency_from_llm", MetricTyp
 FIRST_TOKEN_LATENCY_FROM_BEGINNING = Metrics("first_token_latency_from_beginning", MetricType.Histogram)
 ANSWER_FUSION_TOTAL_LATENCY = Metrics("answer_fusion_total_duration", MetricType.Histogram)
 ANSWER_FUSION_FIRST_TOKEN_LATENCY = Metrics("answer_fusion_first_token_duration", MetricType.Histogram)
-EXTRACT_INFO_LATENCY = Metrics("extract_info_duration", MetricType.Histogram)
\ No newline at end of file
+EXTRACT_INFO_LATENCY = Metrics("extract_info_duration", MetricType.Histogram)
+
+# Stream
+RESPONSE_QUEUE_LATENCY = Metrics("response_queue_latency", MetricType.Histogram)
+RESPONSE_QUEUE_DEPTH = Metrics("response_queue_depth", MetricType.Gauge)
+RESPONSE_QUEUE_BYTES = Metrics("response_queue_buffered_bytes", MetricType.Gauge)
+RESPONSE_QUEUE_OVERFLOW_COUNT = Metrics("response_queue_overflow_count", MetricType.Counter)
+STREAM_CANCELLED_COUNT = Metrics("stream_cancelled_count", MetricType.Counter)
+# 估算值：客户端断开时，正常结束的回答平均增量数（指数移动平均）减去已经生成的增量数，不是上游实际取消的 token 数
+STREAM_CANCELLED_TOKENS_SAVED_ESTIMATE = Metrics("stream_cancelled_tokens_saved_estimate", MetricType.Counter)
+
+# 答案缓存
+ANSWER_CACHE_HIT_COUNT = Metrics("answer_cache_hit_count", MetricType.Counter)
+ANSWER_CACHE_MISS_COUNT = Metrics("answer_cache_miss_count", MetricType.Counter)
+ANSWER_CACHE_ENTRIES = Metrics("answer_cache_entries", MetricType.Gauge)
+
+# 问题推荐
+QUESTION_RECOMMEND_LATENCY = Metrics("question_recommend_latency", MetricType.Histogram)
+QUESTION_RECOMMEND_DROPPED_COUNT = Metrics("question_recommend_dropped_count", MetricType.Counter)
+QUESTION_RECOMMEND_CACHE_HIT_COUNT = Metrics("question_recommend_cache_hit_count", MetricType.Counter)
+
+# 后台任务
+TASK_START_LATENCY = Metrics("task_start_latency", MetricType.Histogram)
+TASK_QUEUE_DEPTH = Metrics("task_executor_queue_depth", MetricType.Gauge)
+TASK_IN_FLIGHT = Metrics("task_executor_in_flight", MetricType.Gauge)
+TASK_LEASE_EXPIRED_COUNT = Metrics("task_lease_expired_count", MetricType.Counter)
+TASK_RECLAIMED_COUNT = Metrics("task_reclaimed_count", MetricType.Counter)
+TASK_RETRY_COUNT = Metrics("task_retry_count", MetricType.Counter)
+# 依赖图从提交到每个任务完成的耗时，例如提交候诊到处置方案生成
+TASK_PIPELINE_LATENCY = Metrics("task_pipeline_latency", MetricType.Histogram,
+                                buckets=(1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, float("inf")))
+# 按任务类型：从可以执行（ready_at）到开始执行的等待时间、每次执行的耗时
+TASK_WAIT_LATENCY = Metrics("task_wait_latency", MetricType.Histogram,
+                            buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, float("inf")))
+TASK_RUN_LATENCY = Metrics("task_run_latency", MetricType.Histogram,
+                           buckets=(0.5, 1, 5, 10, 20, 30, 60, 120, 300, 600, float("inf")))
+TASK_COMPLETED_COUNT = Metrics("task_completed_count", MetricType.Counter)
+TASK_FAILED_COUNT = Metrics("task_failed_count", MetricType.Counter)
+TASK_CANCELLED_COUNT = Metrics("task_cancelled_count", MetricType.Counter)
+# 任务队列的积压，按任务类型定时统计，可用于按积压扩缩任务进程
+# pending 包含等待重试的任务，ready 只包含已经到期、可以立即执行的任务
+TASK_PENDING_DEPTH = Metrics("task_pending_depth", MetricType.Gauge)
+TASK_READY_DEPTH = Metrics("task_ready_depth", MetricType.Gauge)
+TASK_PROCESSING_COUNT = Metrics("task_processing_count", MetricType.Gauge)
+# 最早到期、尚未开始执行的任务已经等待的秒数（队列延迟）
+TASK_OLDEST_PENDING_AGE = Metrics("task_oldest_pending_age", MetricType.Gauge)
+
+# HTTP 连接池
+HTTP_POOL_ACQUIRED = Metrics("http_pool_acquired_connections", MetricType.Gauge)
+HTTP_POOL_IDLE = Metrics("http_pool_idle_connections", MetricType.Gauge)
+HTTP_POOL_LIMIT = Metrics("http_pool_connection_limit", MetricType.Gauge)
@@ -4,11 +4,12 @@ from random import choice
 from metrics.meter_key import MeterKey
 from metrics.meters import record_latency
 from metrics.metrics import SEARCH_ALGO_LATENCY
-from service.question_recommend.question_recommend import ThreadGetQuestionRecommend, question_filter
-from service.config.config import algo_config
+from service.question_recommend.question_recommend import QuestionRecommendTask
+from service.config.config import algo_config, STREAM_DELTA
 from util.aiohttp_sse_client import aiosseclient
 from util.timer import Timer
 from util.logger import algo_logger
+from util.stream.answer_delta import AnswerDelta
 from util.stream.response_queue import ResponseQueue
 from util.stream.stream_search_model import StreamSearchData
 from util.tracker.stream_search_tracker import StreamingSearchTracker
@@ -42,6 +43,41 @@ def rag_search_http(response_queue: ResponseQueue, model_query, tracer, carrier,
             return result
 
 
+async def rag_search_async(response_queue: ResponseQueue, model_query, tracer, carrier, tracker: StreamingSearchTracker):
+    # 在服务自身的事件循环中运行，不再需要线程池和新的事件循环
+    return await http_stream(
+        url=rag_service_url,
+        response_queue=response_queue,
+        model_query=model_query,
+        tracer=tracer,
+        carrier=carrier,
+        tracker=tracker,
+        meter_key=MeterKey(rag_search_async.__qualname__, rag_search_async.__name__),
+    )
+
+
+async def http_stream(url: str, response_queue: ResponseQueue, model_query, tracer, carrier, tracker: StreamingSearchTracker, meter_key: MeterKey):
+    ctx = TraceContextTextMapPropagator().extract(carrier=carrier)
+    with tracer.start_as_current_span("algo_task", context=ctx):
+        result = {}
+        timer = Timer()
+        try:
+            result = await http_request(
+                url=url,
+                response_queue=response_queue,
+                model_query=model_query,
+                tracker=tracker,
+            )
+        except Exception as search_ex:
+            carrier.update({"msg": str(search_ex)})
+            response_queue.put(StreamSearchData.build_from_error("", carrier))
+            response_queue.put(None)
+            algo_logger.error(traceback.format_exc())
+        finally:
+            record_latency(meter_key, SEARCH_ALGO_LATENCY, timer.duration())
+        return result
+
+
 async def http_request(url: str, response_queue: ResponseQueue, model_query, tracker: StreamingSearchTracker):
     task = asyncio.create_task(request_work(url, response_queue, model_query))
     tracker.bind_to_task(task)
@@ -50,11 +86,25 @@ async def http_request(url: str, response_queue: ResponseQueue, model_query, tra
 
 
 async def request_work(url: str, response_queue: ResponseQueue, model_query):
-    unfinished_answer = ""
+    # 问题推荐在当前事件循环中异步请求，算法请求结束（包括取消）时一并取消
+    rec_by_context = QuestionRecommendTask()
+    rec_by_ref = QuestionRecommendTask()
+    try:
+        return await stream_events(url, response_queue, model_query, rec_by_context, rec_by_ref)
+    finally:
+        rec_by_context.cancel()
+        rec_by_ref.cancel()
+
+
+async def stream_events(url: str, response_queue: ResponseQueue, model_query, rec_by_context: QuestionRecommendTask, rec_by_ref: QuestionRecommendTask):
+    # 回答只向下游传递增量，避免每个 token 都携带完整回答
+    answer_delta = AnswerDelta()
+    if STREAM_DELTA:
+        model_query = {**model_query, "stream_delta": True}
     cite_idx2ref={} # 引用编号到references_list的字典映射，用于问题推荐的过滤，格式 {0: {}, 1: {}}
-    thread_rec_by_context = ThreadGetQuestionRecommend(chat_history=[], reference={})
-    thread_rec_by_ref = ThreadGetQuestionRecommend(chat_history=[], reference={})
     async for raw_event in aiosseclient(url=url, data=model_query, timeout_total=2*60):
+        # 客户端消费慢时暂停读取算法服务的数据
+        await response_queue.drain()
         event = {}
 
         try:
@@ -103,8 +153,7 @@ async def request_work(url: str, response_queue: ResponseQueue, model_query):
         # 问题改写之后的query
         if "query_fixed_list" in event and len(event["query_fixed_list"]) > 0:
             query_rewrite = event["query_fixed_list"][-1]
-            thread_rec_by_context.set(chat_history=model_query["chat_history"], reference=[], query_rewrite=query_rewrite)
-            thread_rec_by_context.start_working()
+            rec_by_context.start(chat_history=model_query["chat_history"], reference=[], query_rewrite=query_rewrite)
         
         if event_type == StreamSearchData.SearchEvent.Trace.__str__():
             # 收集溯源信息，包括文档ID
@@ -131,12 +180,8 @@ async def request_work(url: str, response_queue: ResponseQueue, model_query):
         elif event_type == StreamSearchData.SearchEvent.Answer.__str__() or event_type == StreamSearchData.SearchEvent.Refine_Answer.__str__():
             # Answer 与 Refine_Answer
             try:
-                unfinished_answer = event[event_type.__str__()]
-                response_queue.put(StreamSearchData
-                            .Builder()
-                            .event(StreamSearchData.SearchEvent.Answering)
-                            .answer(unfinished_answer)
-                            .build())
+                delta = answer_delta.next(event, event.get(event_type.__str__()))
+                response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, delta))
             except Exception as e:
                 algo_logger.error(f"can not get unfinished answer, error: {e}")
 
@@ -165,48 +210,39 @@ async def request_work(url: str, response_queue: ResponseQueue, model_query):
                 answer_event = StreamSearchData.SearchEvent.Answering
              # 收集回答片段
             try:
+                unfinished_answer = None
                 if "answer" in event:
                     # 兼容新的回答格式
                     unfinished_answer = event["answer"]
                 elif "messages" in event:
                     # 兼容旧的回答格式
                     unfinished_answer = event["messages"][0]["content"]["parts"][0]["content"]
+                delta = answer_delta.next(event, unfinished_answer)
                 # 判断带不带溯源信息
                 if "trace" in event:
                     trace_info = event["trace"]
-                    response_queue.put(StreamSearchData
-                                .Builder()
-                                .event(answer_event)
-                                .answer(unfinished_answer)
-                                .trace(trace_info)
-                                .build())
+                    response_queue.put(StreamSearchData.build_answer(answer_event, delta, trace_info))
                     
-                    if (not thread_rec_by_ref.has_started()) and ("cite_idx" in trace_info) and (len(trace_info["cite_idx"]) > 0):
+                    if (not rec_by_ref.has_started()) and ("cite_idx" in trace_info) and (len(trace_info["cite_idx"]) > 0):
                         cite_idx = event["trace"]["cite_idx"][0]
-                        thread_rec_by_ref.set(chat_history=[], reference=[cite_idx2ref[cite_idx]])
-                        thread_rec_by_ref.start_working()
+                        rec_by_ref.start(chat_history=[], reference=[cite_idx2ref[cite_idx]])
                 else:
-                    response_queue.put(StreamSearchData
-                                .Builder()
-                                .event(answer_event)
-                                .answer(unfinished_answer)
-                                .build())
+                    response_queue.put(StreamSearchData.build_answer(answer_event, delta))
             except Exception as e:
                 # 打印完整的 Exception 信息
                 algo_logger.info(f"can not get unfinished answer, event={event}, error={e}")
         
         elif event_type == StreamSearchData.SearchEvent.Finished.__str__():
             # 处理结束
-            # 结束之前先问题推荐
-            if thread_rec_by_context.has_started():
-                rec_by_context_result = thread_rec_by_context.wait_result()
-                questions = rec_by_context_result["dial_questions"]
-                if thread_rec_by_ref.has_started():
-                    rec_by_ref_result = thread_rec_by_ref.wait_result()
-                    if rec_by_ref_result and len(rec_by_ref_result["rag_questions"]) > 0:
-                        if len(questions) >= 3:
-                            questions.pop()
-                        questions.append(choice(rec_by_ref_result["rag_questions"]))
+            # 结束之前先问题推荐，只使用已经返回（或在 finish_wait 内返回）的结果
+            if rec_by_context.has_started():
+                # 两个推荐同时等待，总等待时间不超过 finish_wait；缓存的结果是共享的，复制之后再修改
+                rec_by_context_result, rec_by_ref_result = await asyncio.gather(rec_by_context.result(), rec_by_ref.result())
+                questions = list((rec_by_context_result or {}).get("dial_questions") or [])
+                if rec_by_ref_result and len(rec_by_ref_result.get("rag_questions", [])) > 0:
+                    if len(questions) >= 3:
+                        questions.pop()
+                    questions.append(choice(rec_by_ref_result["rag_questions"]))
 
                 # 发送推荐问题
                 response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Question_Recommend).question_recommend(questions).build())
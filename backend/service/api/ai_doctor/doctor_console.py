@@ -1,18 +1,22 @@
+import asyncio
+import json
 import uuid
 from datetime import datetime
 from fastapi import APIRouter, Depends
 from starlette.exceptions import HTTPException
 from starlette.requests import Request
-from starlette.responses import JSONResponse
-from service.config.config import IS_DEMO_MODE
+from starlette.responses import JSONResponse, StreamingResponse
+from service.config.config import IS_DEMO_MODE, TASK_PROGRESS_HEARTBEAT
 from service.repository.mongo_dialog_manager import dialog_manager
 from service.repository.mongo_treatment_info import treatment_info_manager
 from service.repository.mongo_dialog_manager import get_ai_doctor_chat_history
 from service.repository.mongo_medical_record_manager import medical_record_manager
 from service.repository.mongo_feedback import mongo_feedback_manager
-from service.repository.mongo_task_manager import task_manager, TaskStatus
+from service.repository.mongo_task_manager import task_manager, TaskStatus, task_dedupe_key
 from service.package.hospital_info_sys import upload_ai_emr
-from worker.process_upload_report import get_report_info_by_id
+from service.package.task_events import task_events, compact_task
+from worker.process_upload_report import get_report_info_by_ids
+from worker.pipelines import submit_diagnosis_pipeline
 from util.oss import oss_client
 from util.logger import service_logger
 
@@ -45,13 +49,52 @@ async def rerun_task(request: Request):
     if not task:
         raise HTTPException(status_code=400, detail="task not found")
     
-    task_manager.update_task_status(task_id, TaskStatus.PENDING)
+    # 只重新执行已经结束的任务，任务未结束或者已经有相同的任务在执行时不重复执行，返回正在执行的任务
+    if not task_manager.rerun_task(task_id):
+        task = task_manager.get_by_task_id(task_id) or task
+        if task_not_completed(task.get("status")):
+            active_task_id, msg = task_id, "task is still running"
+        else:
+            active_task_id, msg = task_manager.find_active_task_id(task.get("dedupe_key")), "same task is running"
+        service_logger.info(f"rerun task skipped, task_id: {task_id}, status: {task.get('status')}, active task_id: {active_task_id}")
+        return JSONResponse({
+            "code": 409,
+            "msg": msg,
+            "data": {
+                "task_id": active_task_id
+            }
+        })
     return JSONResponse({
         "code": 0,
         "msg": "ok",
     })
     
 
+# 判断任务是否成功完成
+def task_not_completed(task_status):
+    return task_status in (TaskStatus.PENDING.value, TaskStatus.PROCESSING.value, TaskStatus.WAITING.value)
+
+
+# 判断当前处于哪个阶段，tasks 为 compact_task 的结果
+# 依赖图提交时所有任务同时创建，按阶段的先后判断，而不是按任务的创建顺序
+def get_current_stage(tasks):
+    unfinished = [task for task in tasks if task_not_completed(task["status"])]
+    if any(task["task_type"] == "upload_report" for task in unfinished):
+        # 第一阶段
+        return "report_text_extract", "识别报告内容"
+    if any(task["task_type"] == "generate_first_electronic_report" for task in unfinished):
+        # 第二阶段
+        return "emr_generation", "生成电子病历"
+    if any(task["task_type"] in ("generate_diagnosis_and_treatment_plan", "generate_treatment")
+           and task["source"] == "generate_first_electronic_report" for task in unfinished):
+        # 第三阶段
+        return "diagnose_generation", "生成初步诊断"
+    # 历史总结与处置方案并行，处置方案完成后仍在总结时属于第二阶段
+    if any(task["task_type"] == "summarize_history_data" for task in unfinished):
+        return "emr_generation", "生成电子病历"
+    return "completed", "完成"
+
+
 @router.get("/get_execution_progress")
 async def get_execution_progress(request: Request):
     treatment_id = request.query_params.get("treatment_id")
@@ -59,29 +102,7 @@ async def get_execution_progress(request: Request):
         raise HTTPException(status_code=400, detail="treatment_id is required")
     
     tasks = task_manager.find_task_by_treatment_id(treatment_id)
-
-    # 判断任务是否成功完成
-    def task_not_completed(task_status):
-        return task_status == TaskStatus.PENDING.value or task_status == TaskStatus.PROCESSING.value
-    # 判断当前处于哪个阶段
-    def get_current_stage(tasks):
-        for task in tasks:
-            task_type, task_status = task["task_type"], task["status"]
-            if task_type == "upload_report" and task_not_completed(task_status):
-                # 第一阶段
-                return "report_text_extract", "识别报告内容"
-            elif (task_type == "generate_first_electronic_report" or task_type == "summarize_history_data") and task_not_completed(task_status):
-                # 第二阶段
-                return "emr_generation", "生成电子病历"
-            elif (task_type == "generate_diagnosis_and_treatment_plan" or task_type == "generate_treatment") and task_not_completed(task_status):
-                source = task.get("params", {}).get("source", "")
-                if source == "generate_first_electronic_report":
-                    # 第三阶段
-                    return "diagnose_generation", "生成初步诊断"
-        
-        return "completed", "完成"
-    
-    stage, stage_text = get_current_stage(tasks)
+    stage, stage_text = get_current_stage([compact_task(task) for task in tasks])
 
     # 将 tasks 中的 task_id 转换为 _id
     return JSONResponse({
@@ -94,6 +115,65 @@ async def get_execution_progress(request: Request):
         }
     })
 
+# 推送任务进度时只查询和返回的字段
+TASK_PROGRESS_PROJECTION = {"task_type": 1, "status": 1, "params.source": 1}
+TASK_PROGRESS_FIELDS = ("task_id", "task_type", "status", "source")
+
+
+def _progress_packet(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+# 实时推送任务进度，代替轮询 get_execution_progress / get_examine_result
+# 先推送一次精简的快照（snapshot），之后只推送状态变化的任务（task）和阶段变化（stage）；断开重连时重新推送快照
+@router.get("/execution_progress/stream")
+async def stream_execution_progress(request: Request):
+    treatment_id = request.query_params.get("treatment_id")
+    if not treatment_id:
+        raise HTTPException(status_code=400, detail="treatment_id is required")
+
+    async def generate():
+        # 先订阅再查询快照，查询期间的状态变化不会丢失
+        queue = task_events.subscribe(treatment_id)
+        try:
+            documents = task_manager.find_task_by_treatment_id(treatment_id, projection=TASK_PROGRESS_PROJECTION)
+            # task_id -> 精简状态，按创建时间倒序，与 get_current_stage 的判断顺序一致
+            tasks = {task["task_id"]: task for task in map(compact_task, documents)}
+            updated_at = {}
+            stage = get_current_stage(tasks.values())
+            yield _progress_packet("snapshot", {"tasks": list(tasks.values()), "stage": stage[0], "stage_text": stage[1]})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=TASK_PROGRESS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield b": ping\n\n"
+                    continue
+                task_id = event["task_id"]
+                # 不同进程发布的事件可能乱序，忽略比已知状态更早的事件；状态没有变化时不推送
+                if event["ts"] < updated_at.get(task_id, 0):
+                    continue
+                updated_at[task_id] = event["ts"]
+                task = {field: event[field] for field in TASK_PROGRESS_FIELDS}
+                if tasks.get(task_id) == task:
+                    continue
+                if task_id in tasks:
+                    tasks[task_id] = task
+                else:
+                    tasks = {task_id: task, **tasks}
+                yield _progress_packet("task", task)
+                new_stage = get_current_stage(tasks.values())
+                if new_stage != stage:
+                    stage = new_stage
+                    yield _progress_packet("stage", {"stage": stage[0], "stage_text": stage[1]})
+        finally:
+            task_events.unsubscribe(treatment_id, queue)
+
+    return StreamingResponse(generate(), media_type="text/event-stream", status_code=200,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @router.get("/get_all_treatments")
 async def get_all_treatments(request: Request):
     raw_treatments = treatment_info_manager.get_all_treatments()
@@ -218,14 +298,16 @@ async def get_patient_appendix(request: Request):
         #print(f"message: {message}")
         content = message.get("content")
         if content and "type" in content and content["type"] == "report":
-            if "task_id" in content:
-                # 将图片报告的解析内容加入进去
-                report_content = get_report_info_by_id(content["task_id"])
-                if report_content:
-                    content["content"] = report_content
-                else:
-                    content["content"] = "报告解析失败，请查看报告原图"
             result.append(content)
+
+    # 将图片报告的解析内容加入进去，所有报告一次查询
+    reports = [content for content in result if "task_id" in content]
+    report_contents = get_report_info_by_ids([content["task_id"] for content in reports])
+    for content, report_content in zip(reports, report_contents):
+        if report_content:
+            content["content"] = report_content
+        else:
+            content["content"] = "报告解析失败，请查看报告原图"
     return JSONResponse({
         "code": 0,
         "msg": "ok",
@@ -319,20 +401,8 @@ async def generate_diagnose(request: Request):
     if not treatment_id:
         raise HTTPException(status_code=400, detail="treatment_id is required")
     
-    # 随机生成 diagnose_id 和 treatment_plan_id
-    diagnose_id = str(uuid.uuid4())
-    treatment_plan_id = str(uuid.uuid4())
-
     # 异步生成诊断和治疗方案
-    task_manager.add_task(
-        task_type="generate_diagnosis_and_treatment_plan",
-        params={
-            "treatment_id": treatment_id,
-            "diagnose_id": diagnose_id,
-            "treatment_plan_id": treatment_plan_id,
-            "source": "doctor_console"
-        }
-    )
+    diagnose_id, treatment_plan_id = submit_diagnosis_pipeline(treatment_id, "doctor_console")
     # 返回 task_id 给前端
     return JSONResponse({
         "code": 0,
@@ -389,14 +459,20 @@ async def generate_treatment_plan(request: Request):
     # 随机生成 treatment_plan_id
     treatment_plan_id = str(uuid.uuid4())
 
-    task_manager.add_task(
+    params = {
+        "treatment_id": treatment_id,
+        "diagnose_id": diagnose_id,
+        "treatment_plan_id": treatment_plan_id
+    }
+    # 同一个诊断的处置方案尚未生成完时，返回正在生成的处置方案
+    task_id = task_manager.add_task(
         task_type="generate_treatment",
-        params={
-            "treatment_id": treatment_id,
-            "diagnose_id": diagnose_id,
-            "treatment_plan_id": treatment_plan_id
-        }
+        params=params,
+        dedupe_key=task_dedupe_key("generate_treatment", params, ignore=("treatment_plan_id",))
     )
+    existing = task_manager.get_by_task_id(task_id)
+    if existing:
+        treatment_plan_id = existing["params"].get("treatment_plan_id", treatment_plan_id)
     # 返回 task_id 给前端
     return JSONResponse({
         "code": 0,
@@ -8,16 +8,20 @@ from starlette.requests import Request
 from starlette.responses import JSONResponse, StreamingResponse
 
 from service.api.stream_search import overwrite_ans
-from service.config.config import service_config, DIRECT_TO_DOCTOR_WORKSTATION, DOCTOR_WORKSTATION_URL, IS_DEMO_MODE, PROLOGUE
+from service.config.config import service_config, DIRECT_TO_DOCTOR_WORKSTATION, DOCTOR_WORKSTATION_URL, IS_DEMO_MODE, PROLOGUE, STREAM_RESUME_ENABLED
 from service.repository.mongo_dialog_manager import dialog_manager, get_ai_doctor_chat_history
-from service.repository.mongo_task_manager import task_manager, TaskStatus
+from service.repository.mongo_task_manager import task_manager, TaskStatus, task_dedupe_key
 from service.repository.mongo_treatment_info import treatment_info_manager
+from worker.pipelines import submit_first_diagnosis_pipeline
 from service.repository.mongo_medical_record_manager import medical_record_manager
 
 from service.package.auth import authenticate, check_user_dialog_id
 from service.package.hospital_info_sys import get_patient_base_info
 
 from util.stream.response_queue import ResponseQueue
+from util.stream.resumable_stream import ResumableStream, replay_store
+from util.stream.stream_engine import start_stream
+from util.stream.stop_signal import stop_signal
 from util.stream.stream_search_model import StreamSearchData
 from util.tracker.stream_search_tracker import StreamingSearchTracker
 from util.oss import oss_client
@@ -27,7 +31,7 @@ from util.model_types import AppResponse, StatusCode,User
 from util.mode import DOMAIN_AI_DOCTOR
 from util.logger import service_logger
 
-from agents.medical_dialogue import medical_dialogue
+from agents.medical_dialogue import medical_dialogue, medical_dialogue_async
 router = APIRouter(
     prefix="/api/doctor"
 )
@@ -122,12 +126,15 @@ async def new_treatment_chat(request: Request):
 
         # 创建异步任务：对接医院 HIS 系统，获取患者历史就诊记录，并生成总结，二者都保存到数据库中
         # 用于AI问诊时上下文的参考
+        # 重复进入问诊时不重复总结
+        summarize_params = {
+            "treatment_id": treatment_id,
+            "with_diagnosis_info": False
+        }
         task_manager.add_task(
             task_type="summarize_history_data",
-            params={
-                "treatment_id": treatment_id,
-                "with_diagnosis_info": False
-            }
+            params=summarize_params,
+            dedupe_key=task_dedupe_key("summarize_history_data", summarize_params)
         )
 
     # 获取对话历史
@@ -248,13 +255,17 @@ async def stream(request: Request, requester: User = Depends(authenticate)):
         tracker.untrack()
         finished_event.set()
 
-    response_queue = ResponseQueue(next_action=_next_callback, error_action=_error_callback, complete_action=_completed_callback, tracker=tracker)
+    # 开启断线续传时，客户端断开不立即取消生成，由 ResumableStream 在超时无人接收后取消
+    response_queue = ResponseQueue(next_action=_next_callback, error_action=_error_callback, complete_action=_completed_callback, tracker=tracker,
+                                   is_disconnected=None if STREAM_RESUME_ENABLED else request.is_disconnected)
+    message_id = None
     try:        
         # 初始化 message
-        message_id = asyncio.run(overwrite_ans(dialog_id, data.get("message_id"), metadata, domain, data.get("enable_think")))
-        query_data = asyncio.run(build_dialogue_query(dialog_id=dialog_id,
+        message_id = await overwrite_ans(dialog_id, data.get("message_id"), metadata, domain, data.get("enable_think"))
+        stop_signal.register(message_id, response_queue.cancel)
+        query_data = await build_dialogue_query(dialog_id=dialog_id,
                                                 raw_query=raw_query,
-                                                enable_think=data.get("enable_think")))
+                                                enable_think=data.get("enable_think"))
         if mock_mode:
             # 如果 mock 模式开启，则将 mock 信息添加到 query_data 中
             query_data["mock_info"] = {
@@ -263,7 +274,7 @@ async def stream(request: Request, requester: User = Depends(authenticate)):
             }
             service_logger.info(f"mock mode is enabled, dialog_id: {dialog_id}")
 
-        # There are some sync calls in algo modules, thus put it in an executor to avoid blocking the elp
+        # 根据配置在事件循环中直接运行，或者放到 executor 中运行
         response_queue.put(StreamSearchData.Builder()
                             .event(StreamSearchData.SearchEvent.Received)
                             .query(raw_query)
@@ -280,7 +291,7 @@ async def stream(request: Request, requester: User = Depends(authenticate)):
         else:
             service_logger.info(f"dialog_id: {dialog_id}, medical_dialogue by query: {query_data}")
             # 请求病史采集 Agent
-            asyncio.get_event_loop().run_in_executor(None, medical_dialogue, response_queue, query_data, metadata, tracker)
+            start_stream(medical_dialogue, medical_dialogue_async, response_queue, query_data, metadata, tracker)
 
     except Exception as search_ex:
         service_logger.error(f"failed to do search: {str(search_ex)}, stack: {traceback.format_exc()}")
@@ -292,6 +303,7 @@ async def stream(request: Request, requester: User = Depends(authenticate)):
         async def flush():
             try:
                 await finished_event.wait()
+                stop_signal.unregister(message_id)
                 tracker.store_message(dialog_id, message_id, data.get("sources"), domain=domain)
             except asyncio.CancelledError:
                 service_logger.warning("asyncio.CancelledError in flush")
@@ -299,9 +311,35 @@ async def stream(request: Request, requester: User = Depends(authenticate)):
                 service_logger.error(f"flush failed: {flush_ex}")
 
         asyncio.create_task(flush())
+        if STREAM_RESUME_ENABLED and message_id is not None:
+            resumable = ResumableStream(response_queue, await replay_store.create(dialog_id, message_id)).start()
+            return StreamingResponse(resumable.follow(), media_type="text/event-stream", status_code=200)
         return StreamingResponse(response_queue.subscribe(), media_type="text/event-stream", status_code=200)
 
 
+# 断线续传：补发 Last-Event-ID 之后的数据帧，然后继续接收正在生成的回答，不会重新请求算法服务
+@router.post("/stream/resume")
+async def resume_stream(request: Request, requester: User = Depends(authenticate)):
+    data = await request.json()
+    dialog_id = data.get("dialog_id", None)
+    message_id = data.get("message_id", None)
+    if not dialog_id or not message_id:
+        raise HTTPException(status_code=400, detail="dialog_id and message_id are required")
+    check_user_dialog_id(requester, dialog_id)
+
+    last_event_id = request.headers.get("Last-Event-ID", data.get("last_event_id", 0))
+    try:
+        last_event_id = int(last_event_id or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid Last-Event-ID")
+
+    buffer = await replay_store.open(dialog_id, message_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="stream not found or expired")
+    service_logger.info(f"resume stream, dialog_id: {dialog_id}, message_id: {message_id}, last_event_id: {last_event_id}")
+    return StreamingResponse(buffer.follow(last_event_id), media_type="text/event-stream", status_code=200)
+
+
 async def build_dialogue_query(dialog_id, raw_query, enable_think):
     # 组装历史对话
     chat_history, diagnose_finished = get_ai_doctor_chat_history(dialog_id)
@@ -477,15 +515,9 @@ async def submit_to_wait(request: Request, requester: User = Depends(authenticat
     # 检查 dialog_id 与 Token 是否合法
     check_user_dialog_id(requester, dialog_id)
 
-    # 构建异步任务，生成并保存电子病历
+    # 构建异步任务的依赖图，生成并保存电子病历
     # 生成电子病历 -> 生成诊断结论 -> 生成历史总结+处置方案
-    task_id = task_manager.add_task(
-        task_type="generate_first_electronic_report",
-        params={
-            "dialog_id": dialog_id,
-            "treatment_id": requester.treatment_id,
-        }
-    )
+    task_id = submit_first_diagnosis_pipeline(dialog_id, requester.treatment_id)
 
     redirect = False
     if DIRECT_TO_DOCTOR_WORKSTATION and (DIRECT_TO_DOCTOR_WORKSTATION is True or DIRECT_TO_DOCTOR_WORKSTATION == "true"):
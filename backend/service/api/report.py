@@ -127,10 +127,10 @@ async def check_report_process(request: Request, requester: User = Depends(authe
     # 将 task_id 转换为列表
     task_ids = task_id.split(",") if task_id else []
     
-    # 从任务队列中获取任务状态
+    # 从任务队列中一次获取所有任务的状态
     result = []
-    for task_id in task_ids:
-        task = task_manager.get_by_task_id(task_id)
+    tasks = task_manager.get_by_task_ids(task_ids, projection={"status": 1})
+    for task_id, task in zip(task_ids, tasks):
         if not task:
             return JSONResponse({
                 AppResponse.status_code: StatusCode.InternalError,
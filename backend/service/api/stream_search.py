@@ -4,10 +4,11 @@ import json
 from fastapi import APIRouter, Depends
 from opentelemetry import trace
 from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+from starlette.exceptions import HTTPException
 from starlette.requests import Request
 from starlette.responses import JSONResponse, StreamingResponse
-from rag.rag_http import rag_search_http
-from medical_inquiry.inquiry_with_rag import inquiry_with_rag
+from rag.rag_http import rag_search_http, rag_search_async
+from medical_inquiry.inquiry_with_rag import inquiry_with_rag, inquiry_with_rag_async
 from service.config.config import service_config
 from service.repository.mongo_dialog_manager import dialog_manager
 from service.exceptions import BackendServiceExceptionReasonCode
@@ -17,15 +18,18 @@ from service.package.dumper_client import HttpAsyncDumperClient
 from service.package.file_service_client import HttpAsyncFileServiceClient
 from util.execution_context import ExecutionContext
 from util.stream.response_queue import ResponseQueue
+from util.stream.stream_engine import start_stream
+from util.stream.stop_signal import stop_signal
+from util.stream.answer_cache import answer_cache
 from util.logger import service_logger
 from util.stream.stream_search_model import StreamSearchData
 from util.tracker.stream_search_tracker import StreamingSearchTracker
 from util.model_types import MessageCollectionModel, User, ReferenceType, AppResponse, StatusCode, StopGeneratingReason
 from util.timer import Timer
-from service.config.config import algo_config
+from service.config.config import algo_config, ANSWER_CACHE_ENABLED
 from util.mode import MODE_INQUIRY, MODE_INQUIRY_MINI, DOMAIN_SEARCH, DOMAIN_INQUIRY, DOMAIN_INQUIRY_MINI, get_domain_from_mode
 from service.repository.mongo_task_manager import task_manager
-from worker.process_upload_report import get_report_info_by_id
+from worker.process_upload_report import get_report_info_by_ids
 router = APIRouter(
     prefix="/api"
 )
@@ -57,6 +61,8 @@ async def stop_generating(request: Request, requester: User = Depends(authentica
                                     ExecutionContext.current())
 
     result = dialog_manager.stop_generating(message_id, stop_generating_reason)
+    # 通知正在输出该消息的 worker 立即取消算法请求
+    await stop_signal.publish(message_id)
     
     if result.matched_count == 1:
         resp = {
@@ -69,6 +75,19 @@ async def stop_generating(request: Request, requester: User = Depends(authentica
                                     ExecutionContext.current())
     return JSONResponse(resp)
 
+@router.post('/search/answer_cache/invalidate')
+async def invalidate_answer_cache(requester: User = Depends(authenticate)):
+    # 知识库重建索引后调用，清空所有 worker 的答案缓存
+    check_user(requester)
+    timer = Timer()
+    if not getattr(requester, "is_admin", False):
+        raise HTTPException(status_code=403, detail="admin only")
+    await answer_cache.invalidate()
+    return JSONResponse({
+        AppResponse.status_code: StatusCode.Success,
+        AppResponse.latency: timer.duration()
+    })
+
 @router.post('/search/stream')
 async def search(request: Request, requester: User = Depends(authenticate)):
     status_code = 200
@@ -110,7 +129,7 @@ async def search(request: Request, requester: User = Depends(authenticate)):
         tracker.untrack()
         data_event.set()
 
-    response_queue = ResponseQueue(next_action=on_next_callback, error_action=on_error_callback, complete_action=on_completed_callback, tracker=tracker)
+    response_queue = ResponseQueue(next_action=on_next_callback, error_action=on_error_callback, complete_action=on_completed_callback, tracker=tracker, is_disconnected=request.is_disconnected)
     try:
         tracer = trace.get_tracer(__name__)
         with tracer.start_as_current_span("search") as span:
@@ -137,6 +156,8 @@ async def search(request: Request, requester: User = Depends(authenticate)):
                 dialog_manager.activate_dialog(dialog_id)
             # 初始化 message
             message_id = await overwrite_ans(dialog_id, data.get("message_id"), carrier, domain, data.get("enable_think"))
+            # stop_generating 可能落在其他 worker 上，通过 stop_signal 通知到这里
+            stop_signal.register(message_id, response_queue.cancel)
             model_query = await build_model_query(kb_key=requester.id,
                                                   raw_query=data.get("query"),
                                                   sources=data.get("sources"),
@@ -155,7 +176,7 @@ async def search(request: Request, requester: User = Depends(authenticate)):
             if data.get("previous_auxiliary_upload"):
                 model_query["previous_auxiliary_upload"] = build_previous_auxiliary_upload_query(data)
 
-            # There are some sync calls in algo modules, thus put it in an executor to avoid blocking the elp
+            # 根据配置在事件循环中直接运行，或者放到 executor 中运行
             response_queue.put(StreamSearchData.Builder()
                              .event(StreamSearchData.SearchEvent.Received)
                              .query(raw_query)
@@ -168,10 +189,19 @@ async def search(request: Request, requester: User = Depends(authenticate)):
                 if domain == DOMAIN_INQUIRY_MINI:
                     # multi_step 可选参数，默认是 True，如果用户选了 mini 版本就传 False
                     model_query["multi_step"] = data["multi_step"]
-                asyncio.get_event_loop().run_in_executor(None, inquiry_with_rag, response_queue, model_query, tracer, carrier, tracker)
+                start_stream(inquiry_with_rag, inquiry_with_rag_async, response_queue, model_query, tracer, carrier, tracker)
             else:
-                service_logger.info(f"rag_search_http by query: {model_query}")
-                asyncio.get_event_loop().run_in_executor(None, rag_search_http, response_queue, model_query, tracer, carrier, tracker)
+                # 首轮、无附加信息的知识问答可以直接回放缓存的答案
+                cache_key = answer_cache.fingerprint(model_query, data.get("enable_think"), data.get("mode")) if ANSWER_CACHE_ENABLED else None
+                cached_events = answer_cache.get(cache_key) if cache_key else None
+                if cached_events is not None:
+                    service_logger.info(f"answer cache hit: {cache_key}")
+                    tracker.bind_to_task(asyncio.create_task(answer_cache.replay(cached_events, response_queue)))
+                else:
+                    if cache_key:
+                        response_queue.record_to(answer_cache.recorder(cache_key))
+                    service_logger.info(f"rag_search_http by query: {model_query}")
+                    start_stream(rag_search_http, rag_search_async, response_queue, model_query, tracer, carrier, tracker)
 
     except Exception as search_ex:
         service_logger.error(f"failed to do search: {str(search_ex)}, stack: {traceback.format_exc()}")
@@ -187,6 +217,7 @@ async def search(request: Request, requester: User = Depends(authenticate)):
         async def flush():
             try:
                 await data_event.wait()
+                stop_signal.unregister(message_id)
                 tracker.store_message(dialog_id, message_id, data.get("sources"), domain=domain)
             except asyncio.CancelledError:
                 service_logger.warning("asyncio.CancelledError in flush")
@@ -296,11 +327,7 @@ def get_auxiliary_choice(history, data):
 
 
 def get_additional_info_from_id(report_ids):
-    additional_info_list = []
-    for report_id in report_ids:
-        additional_info = get_report_info_by_id(report_id)
-        if additional_info:
-            additional_info_list.append(additional_info)
+    additional_info_list = [additional_info for additional_info in get_report_info_by_ids(report_ids) if additional_info]
 
     if len(additional_info_list) == 0:
         return ""
@@ -37,4 +37,97 @@ DIRECT_TO_DOCTOR_WORKSTATION = os.getenv("DIRECT_TO_DOCTOR_WORKSTATION", getattr
 DOCTOR_WORKSTATION_URL = os.getenv("DOCTOR_WORKSTATION_URL", getattr(service_config, 'doctor_workstation_url', "https://pre.pc.zhongshan-doctor.inf-health.cn"))
 
 # AI 的开场白
-PROLOGUE = os.getenv("PROLOGUE", getattr(service_config, 'prologue', "您好，我是复旦大学附属中山医院观心门诊医生。请问您有什么不舒服？"))
\ No newline at end of file
+PROLOGUE = os.getenv("PROLOGUE", getattr(service_config, 'prologue', "您好，我是复旦大学附属中山医院观心门诊医生。请问您有什么不舒服？"))
+
+# 算法流式请求的执行方式：async 在服务事件循环中直接运行，executor 为旧的线程池方式，便于 A/B 对比
+STREAM_ENGINE = os.getenv("STREAM_ENGINE", getattr(service_config, 'stream_engine', "executor"))
+# 是否请求算法服务按增量返回回答（事件中带 delta 字段），算法服务不支持时仍按累计回答计算增量
+STREAM_DELTA = get_env_bool("STREAM_DELTA", getattr(algo_config, 'stream_delta', False))
+
+# 回答 token 合并输出：窗口内（毫秒）连续的回答增量合并为一个 SSE 帧，累计达到 max_bytes 时立即输出；window_ms 为 0 表示不合并
+STREAM_COALESCE_WINDOW_MS = float(os.getenv("STREAM_COALESCE_WINDOW_MS", getattr(service_config, 'stream_coalesce_window_ms', 0)))
+STREAM_COALESCE_MAX_BYTES = int(os.getenv("STREAM_COALESCE_MAX_BYTES", getattr(service_config, 'stream_coalesce_max_bytes', 1024)))
+
+# 流式响应队列上限：maxsize 为 0 表示不限制；超过 maxsize 条或 max_bytes 字节时按 policy 处理
+# policy: block（算法请求暂停读取，等待客户端消费）| coalesce（回答增量合并到队尾）| drop_debug（丢弃 debug 数据）
+STREAM_QUEUE_MAXSIZE = int(os.getenv("STREAM_QUEUE_MAXSIZE", getattr(service_config, 'stream_queue_maxsize', 0)))
+STREAM_QUEUE_MAX_BYTES = int(os.getenv("STREAM_QUEUE_MAX_BYTES", getattr(service_config, 'stream_queue_max_bytes', 4 * 1024 * 1024)))
+STREAM_QUEUE_POLICY = os.getenv("STREAM_QUEUE_POLICY", getattr(service_config, 'stream_queue_policy', "block"))
+# coalesce / drop_debug 策略下队列满且数据无法合并或丢弃时的处理：block 等待客户端消费，disconnect 断开流
+STREAM_QUEUE_OVERFLOW_FALLBACK = os.getenv("STREAM_QUEUE_OVERFLOW_FALLBACK", getattr(service_config, 'stream_queue_overflow_fallback', "block"))
+# 写入方最多等待的秒数，超时说明客户端长时间不消费，断开流并取消算法请求
+STREAM_QUEUE_BLOCK_TIMEOUT = float(os.getenv("STREAM_QUEUE_BLOCK_TIMEOUT", getattr(service_config, 'stream_queue_block_timeout', 30)))
+
+# 流式响应检查客户端是否断开的间隔（秒），断开后取消算法请求
+STREAM_DISCONNECT_CHECK_INTERVAL = float(os.getenv("STREAM_DISCONNECT_CHECK_INTERVAL", getattr(service_config, 'stream_disconnect_check_interval', 1.0)))
+
+# 停止生成的通知频道（Redis pub/sub），所有 worker 订阅，由持有该流式响应的 worker 取消算法请求
+STOP_GENERATING_CHANNEL = os.getenv("STOP_GENERATING_CHANNEL", getattr(service_config, 'stop_generating_channel', "stop_generating"))
+
+# 断线续传：流式响应按 message_id 缓存已输出的数据帧，客户端带 Last-Event-ID 重连后补发并继续接收
+STREAM_RESUME_ENABLED = get_env_bool("STREAM_RESUME_ENABLED", getattr(service_config, 'stream_resume_enabled', False))
+# 没有客户端接收超过 grace 秒后取消算法请求；缓存保留 ttl 秒，最多 maxlen 帧
+STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", getattr(service_config, 'stream_resume_grace', 30)))
+STREAM_REPLAY_TTL = int(os.getenv("STREAM_REPLAY_TTL", getattr(service_config, 'stream_replay_ttl', 600)))
+STREAM_REPLAY_MAXLEN = int(os.getenv("STREAM_REPLAY_MAXLEN", getattr(service_config, 'stream_replay_maxlen', 4096)))
+
+# 知识问答的答案缓存：首轮问题按 (query, sources, enable_think, mode) 缓存完整的事件序列
+ANSWER_CACHE_ENABLED = get_env_bool("ANSWER_CACHE_ENABLED", getattr(service_config, 'answer_cache_enabled', False))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", getattr(service_config, 'answer_cache_ttl', 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", getattr(service_config, 'answer_cache_max_entries', 512)))
+# 回放时按录制时的事件间隔加速输出的倍数，单个间隔不超过 max_interval 秒
+ANSWER_CACHE_REPLAY_SPEED = float(os.getenv("ANSWER_CACHE_REPLAY_SPEED", getattr(service_config, 'answer_cache_replay_speed', 4)))
+ANSWER_CACHE_REPLAY_MAX_INTERVAL = float(os.getenv("ANSWER_CACHE_REPLAY_MAX_INTERVAL", getattr(service_config, 'answer_cache_replay_max_interval', 0.05)))
+# 知识库重建索引后，通过该频道通知所有 worker 清空缓存
+ANSWER_CACHE_CHANNEL = os.getenv("ANSWER_CACHE_CHANNEL", getattr(service_config, 'answer_cache_channel', "answer_cache_invalidate"))
+
+# 问题推荐：请求超过 timeout 秒取消；回答结束时最多再等待 finish_wait 秒，之后未返回的结果丢弃
+QUESTION_RECOMMEND_TIMEOUT = float(os.getenv("QUESTION_RECOMMEND_TIMEOUT", getattr(service_config, 'question_recommend_timeout', 5)))
+QUESTION_RECOMMEND_FINISH_WAIT = float(os.getenv("QUESTION_RECOMMEND_FINISH_WAIT", getattr(service_config, 'question_recommend_finish_wait', 0.5)))
+# 相同 (query_rewrite, reference) 的推荐结果缓存
+QUESTION_RECOMMEND_CACHE_TTL = int(os.getenv("QUESTION_RECOMMEND_CACHE_TTL", getattr(service_config, 'question_recommend_cache_ttl', 600)))
+QUESTION_RECOMMEND_CACHE_MAX_ENTRIES = int(os.getenv("QUESTION_RECOMMEND_CACHE_MAX_ENTRIES", getattr(service_config, 'question_recommend_cache_max_entries', 1024)))
+
+# 任务分发：add_task 之后通过 Redis Streams 唤醒空闲的进程立即处理，轮询只作为兜底
+TASK_DISPATCH_ENABLED = get_env_bool("TASK_DISPATCH_ENABLED", getattr(service_config, 'task_dispatch_enabled', False))
+# stream 名称默认跟随任务集合，不同环境共用 Redis 时互不干扰
+TASK_DISPATCH_STREAM = os.getenv("TASK_DISPATCH_STREAM", getattr(service_config, 'task_dispatch_stream', f"{service_config.task_queue_name}_dispatch"))
+TASK_DISPATCH_MAXLEN = int(os.getenv("TASK_DISPATCH_MAXLEN", getattr(service_config, 'task_dispatch_maxlen', 10000)))
+# 轮询待处理任务的间隔（秒）
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", getattr(service_config, 'task_poll_interval', 2)))
+
+# 每种任务类型的并发数，未配置的类型使用 TASK_DEFAULT_CONCURRENCY
+TASK_CONCURRENCY = {key: int(value) for key, value in vars(getattr(service_config, 'task_concurrency', Config({}))).items()}
+TASK_DEFAULT_CONCURRENCY = int(os.getenv("TASK_DEFAULT_CONCURRENCY", getattr(service_config, 'task_default_concurrency', 1)))
+# 停止服务时等待执行中任务的秒数
+TASK_SHUTDOWN_TIMEOUT = float(os.getenv("TASK_SHUTDOWN_TIMEOUT", getattr(service_config, 'task_shutdown_timeout', 30)))
+
+# 每种任务类型的优先级，数值越小越先执行；未配置的类型使用 TASK_DEFAULT_PRIORITY
+TASK_PRIORITY = {key: int(value) for key, value in vars(getattr(service_config, 'task_priority', Config({}))).items()}
+TASK_DEFAULT_PRIORITY = int(os.getenv("TASK_DEFAULT_PRIORITY", getattr(service_config, 'task_default_priority', 0)))
+
+# 任务租约：获取任务时租约 lease 秒，执行期间每 heartbeat 秒续约；
+# 每 reap_interval 秒回收租约过期（worker 退出）的任务，重新执行不超过 max_attempts 次
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", getattr(service_config, 'task_lease_seconds', 300)))
+TASK_HEARTBEAT_INTERVAL = float(os.getenv("TASK_HEARTBEAT_INTERVAL", getattr(service_config, 'task_heartbeat_interval', 60)))
+TASK_REAP_INTERVAL = float(os.getenv("TASK_REAP_INTERVAL", getattr(service_config, 'task_reap_interval', 60)))
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", getattr(service_config, 'task_max_attempts', 3)))
+
+# 任务失败后的重试策略（见 worker/retry_policy.py），按 check_time 延迟重新调度，等待期间不占用 worker
+# 未配置的类型使用 TASK_DEFAULT_RETRY，默认不重试
+TASK_RETRY = {key: vars(value) for key, value in vars(getattr(service_config, 'task_retry', Config({}))).items()}
+TASK_DEFAULT_RETRY = vars(getattr(service_config, 'task_default_retry', Config({"max_attempts": 1})))
+
+# 任务状态变化通过 Redis 发布订阅推送给医生工作站（/api/doctor/execution_progress/stream）
+TASK_EVENTS_ENABLED = get_env_bool("TASK_EVENTS_ENABLED", getattr(service_config, 'task_events_enabled', False))
+TASK_EVENTS_CHANNEL = os.getenv("TASK_EVENTS_CHANNEL", getattr(service_config, 'task_events_channel', f"{service_config.task_queue_name}_events"))
+# 推送连接没有状态变化时发送心跳的间隔（秒）
+TASK_PROGRESS_HEARTBEAT = float(os.getenv("TASK_PROGRESS_HEARTBEAT", getattr(service_config, 'task_progress_heartbeat', 15)))
+
+# 每 queue_stats_interval 秒按任务类型统计队列积压和延迟（task_pending_depth、task_oldest_pending_age），0 表示不统计
+TASK_QUEUE_STATS_INTERVAL = float(os.getenv("TASK_QUEUE_STATS_INTERVAL", getattr(service_config, 'task_queue_stats_interval', 0)))
+
+# API 进程是否同时运行任务引擎；单独部署任务进程（python -m worker）后可以关闭
+TASK_SCHEDULER_ENABLED = get_env_bool("TASK_SCHEDULER_ENABLED", getattr(service_config, 'task_scheduler_enabled', True))
+# 独立任务进程的 Prometheus 端口
+TASK_WORKER_METRICS_PORT = int(os.getenv("TASK_WORKER_METRICS_PORT", getattr(service_config, 'task_worker_metrics_port', 2113)))
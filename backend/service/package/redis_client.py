@@ -1,4 +1,5 @@
 import redis
+import redis.asyncio
 import logging
 import os
 import traceback
@@ -31,6 +32,9 @@ class RedisClient():
     def get(self, key):
         return self._redis.get(key)
 
+    def publish(self, channel, message):
+        return self._redis.publish(channel, message)
+
     def close(self):
         self._redis.close()
 
@@ -55,15 +59,16 @@ class MessageClient:
             except redis.exceptions.ResponseError as e:
                 logging.log(logging.DEBUG, f"create consumer group {e}, {traceback.format_exc()}")
 
-    def send(self, msg: dict):
+    def send(self, msg: dict, maxlen: int = None):
         channel = self._in_channel
-        resp = self._redis.xadd(name=channel, fields=msg)
+        # maxlen 限制 stream 长度（近似裁剪），None 表示不限制
+        resp = self._redis.xadd(name=channel, fields=msg, maxlen=maxlen, approximate=True)
         logging.log(
             logging.DEBUG,
             f"send channel: {channel} message: {msg} with resp:{resp}")
         return resp
 
-    def receive(self):
+    def receive(self, block: int = 10):
 
         def read_msg(last_id, block):
             resp = self._redis.xreadgroup(groupname=self.GROUP,
@@ -93,7 +98,7 @@ class MessageClient:
             else:
                 self._read_pending = True
 
-        return read_msg('>', 10)
+        return read_msg('>', block)
 
     def pendings(self, count=1):
         resp = self._redis.xpending_range(name=self._in_channel,
@@ -113,6 +118,36 @@ class MessageClient:
         self._redis.close()
 
 
+def create_async_redis() -> redis.asyncio.Redis:
+    return redis.asyncio.Redis(**redis_conf)
+
+
+class PubSubClient:
+    """基于 redis.asyncio 的发布订阅，用于 worker 之间的实时通知"""
+
+    def __init__(self):
+        self._redis = create_async_redis()
+
+    async def ping(self):
+        return await self._redis.ping()
+
+    async def publish(self, channel: str, message: str) -> int:
+        return await self._redis.publish(channel, message)
+
+    async def subscribe(self, channel: str):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield message["data"]
+        finally:
+            await pubsub.aclose()
+
+    async def close(self):
+        await self._redis.aclose()
+
+
 def receive_message(channel, read_pending=False):
     client = MessageClient(in_channel=channel,
                            consumer_id=channel,
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, Set
+
+from service.config.config import TASK_EVENTS_CHANNEL
+from service.package.redis_client import RedisClient, PubSubClient
+from util.logger import service_logger
+from util.model_types import TaskCollectionModel
+
+
+def compact_task(task: dict) -> dict:
+    """任务的精简状态，推送给前端时不包含参数和结果（例如报告识别的全文）"""
+    params = task.get(TaskCollectionModel.params) or {}
+    return {
+        "task_id": str(task.get("_id", task.get("task_id"))),
+        "task_type": task.get(TaskCollectionModel.task_type),
+        "status": task.get(TaskCollectionModel.status),
+        "source": params.get("source", ""),
+    }
+
+
+class TaskEvents:
+    """
+    任务状态变化的实时通知，用于医生工作站的进度推送
+    - MongoTaskManager 在任务状态变化时调用 publish（任意进程、任意线程），通过 Redis 发布订阅广播
+    - API 进程订阅频道，按 treatment_id 分发给正在推送的连接
+    - Redis 不可用时退化为进程内通知，只能收到当前进程中的状态变化
+    """
+
+    def __init__(self, channel: str = TASK_EVENTS_CHANNEL, client_factory=RedisClient):
+        self._channel = channel
+        self._client_factory = client_factory
+        self._producer = None
+        self._lock = threading.Lock()
+        # treatment_id -> 正在推送的连接的队列
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._loop = None
+        self._client = None
+        self._listener = None
+
+    def publish(self, task: dict):
+        """任务状态变化后调用，只发布带 treatment_id 的任务"""
+        treatment_id = (task.get(TaskCollectionModel.params) or {}).get("treatment_id")
+        if not treatment_id:
+            return
+        event = compact_task(task)
+        event["treatment_id"] = treatment_id
+        event["ts"] = time.time()
+        message = json.dumps(event, ensure_ascii=False)
+        try:
+            if self._producer is None:
+                with self._lock:
+                    if self._producer is None:
+                        self._producer = self._client_factory()
+            self._producer.publish(self._channel, message)
+            return
+        except Exception as e:
+            # 不影响任务状态的更新，前端重新连接时会拿到最新的快照
+            service_logger.warning(f"publish task event failed, task_id: {event['task_id']}, error: {e}")
+        self._dispatch_threadsafe(message)
+
+    async def start(self):
+        if self._listener is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        try:
+            client = PubSubClient()
+            await client.ping()
+        except Exception as e:
+            service_logger.warning(f"redis unavailable, task events only work in current worker: {e}")
+            return
+        self._client = client
+        self._listener = asyncio.create_task(self._listen())
+        service_logger.info(f"task events subscribed to channel: {self._channel}")
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        self._loop = None
+
+    def subscribe(self, treatment_id: str) -> asyncio.Queue:
+        """订阅 treatment_id 的任务状态变化，队列中为 compact_task 加上 ts"""
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(treatment_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, treatment_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(treatment_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[treatment_id]
+
+    def _dispatch_threadsafe(self, message: str):
+        # 任务状态可能在 worker 线程中变化，交给事件循环分发
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._dispatch, message)
+
+    def _dispatch(self, message: str):
+        try:
+            event = json.loads(message)
+        except ValueError:
+            return
+        for queue in self._subscribers.get(event.get("treatment_id"), ()):
+            queue.put_nowait(event)
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self._client.subscribe(self._channel):
+                    self._dispatch(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                service_logger.warning(f"task events subscription broken, retry in 1s: {e}")
+                await asyncio.sleep(1)
+
+
+task_events = TaskEvents()
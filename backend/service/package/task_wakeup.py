@@ -0,0 +1,91 @@
+import threading
+from typing import Callable
+
+from service.config.config import TASK_DISPATCH_STREAM, TASK_DISPATCH_MAXLEN
+from service.package.redis_client import MessageClient
+from util.logger import service_logger
+
+
+class TaskWakeup:
+    """
+    新任务的唤醒通知，基于 Redis Streams 消费组，每条通知只投递给一个进程
+    - add_task 写入 Mongo 之后发送 task_id，空闲进程的监听线程阻塞读取，收到后立即处理
+    - 通知只用于降低延迟，任务本身以 Mongo 为准：发送失败、进程退出丢失的通知由低频轮询兜底
+    """
+
+    def __init__(self, stream: str = TASK_DISPATCH_STREAM, maxlen: int = TASK_DISPATCH_MAXLEN, client_factory=MessageClient):
+        self._stream = stream
+        self._maxlen = maxlen
+        self._client_factory = client_factory
+        self._producer = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        # 延迟任务的定时器，停止监听时取消，未执行的任务由其他进程轮询处理
+        self._timers = []
+
+    def notify(self, task_id: str, delay: float = 0):
+        try:
+            if self._producer is None:
+                with self._lock:
+                    if self._producer is None:
+                        self._producer = self._client_factory(in_channel=self._stream)
+            self._producer.send({"task_id": task_id, "delay": delay}, maxlen=self._maxlen)
+        except Exception as e:
+            # 不影响任务写入，等待轮询处理
+            service_logger.warning(f"notify task {task_id} failed: {e}")
+
+    def listen(self, handler: Callable[[str], None], consumer_id: str):
+        """启动监听线程，收到通知后调用 handler(task_id)；延迟任务到期后再调用"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, args=(handler, consumer_id), name="task-wakeup", daemon=True)
+        self._thread.start()
+        service_logger.info(f"task wakeup listening on {self._stream}, consumer: {consumer_id}")
+
+    def stop(self, timeout: float = 2):
+        self._stopped.set()
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self, handler: Callable[[str], None], consumer_id: str):
+        client = None
+        while not self._stopped.is_set():
+            try:
+                if client is None:
+                    # consumer_id 每个进程唯一，没有需要重新读取的历史消息
+                    client = self._client_factory(in_channel=self._stream, consumer_id=consumer_id, read_pending=True)
+                message = client.receive(block=1000)
+                if not message:
+                    continue
+                message_id, fields = message
+                # 先确认：任务由 acquire_lock 保证只执行一次，通知丢失由轮询兜底
+                client.ack(message_id)
+                task_id = fields["task_id"]
+                delay = float(fields.get("delay", 0))
+                if delay > 0:
+                    timer = threading.Timer(delay, handler, args=(task_id,))
+                    timer.daemon = True
+                    timer.start()
+                    self._timers = [t for t in self._timers if t.is_alive()] + [timer]
+                else:
+                    handler(task_id)
+            except Exception as e:
+                service_logger.warning(f"task wakeup error, retry in 1s: {e}")
+                if client is not None:
+                    try:
+                        client.close()
+                    except Exception:
+                        pass
+                    client = None
+                self._stopped.wait(1)
+        if client is not None:
+            client.close()
+
+
+task_wakeup = TaskWakeup()
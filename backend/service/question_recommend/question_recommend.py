@@ -1,12 +1,21 @@
-from threading import Thread
-from service.config.config import algo_config
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from metrics.meter_key import MeterKey
+from metrics.meters import record_count, record_latency
+from metrics.metrics import QUESTION_RECOMMEND_LATENCY, QUESTION_RECOMMEND_DROPPED_COUNT, QUESTION_RECOMMEND_CACHE_HIT_COUNT
+from service.config.config import algo_config, QUESTION_RECOMMEND_TIMEOUT, QUESTION_RECOMMEND_FINISH_WAIT, QUESTION_RECOMMEND_CACHE_TTL, QUESTION_RECOMMEND_CACHE_MAX_ENTRIES
+from util.async_http import async_post
 from util.logger import algo_logger
 from util.sync_http_request import send_request
+from util.timer import Timer
 
 question_recommend_service_url = algo_config.medical_algo_service_http_url + "/assistant/batch-question-recommend"
 question_filter_service_url = algo_config.medical_algo_service_http_url + "/assistant/question-filter"
 
-def batch_question_recommend(chat_history: list, reference: list[dict], top_k=None, query_rewrite=None):
+async def batch_question_recommend(chat_history: list, reference: list[dict], top_k=None, query_rewrite=None, timeout=QUESTION_RECOMMEND_TIMEOUT):
     body = {
         "chat_history": chat_history,
         "reference": reference,
@@ -20,9 +29,11 @@ def batch_question_recommend(chat_history: list, reference: list[dict], top_k=No
 
     gen_questions = {}
     try:
-        resp = send_request(url=question_recommend_service_url, body=body)
-        #algo_logger.info(f"batch question recommend request:{body} response: {resp}")
-        gen_questions = resp["body"]["data"]
+        resp = await async_post(url=question_recommend_service_url, json=body, timeout=timeout)
+        # 推荐服务没有结果时 data 可能为 null
+        gen_questions = (resp or {}).get("data") or {}
+    except asyncio.TimeoutError:
+        algo_logger.warning(f"request question recommend timeout after {timeout}s")
     except Exception as e:
         algo_logger.error(f"request question recommend error: {e}")
 
@@ -49,38 +60,94 @@ def question_filter(gen_questions: dict, ref_info: list[dict], current_answer=No
     return filtered_questions
 
 
-class ThreadGetQuestionRecommend(Thread):
-    def __init__(self, chat_history: list, reference: list[dict], top_k=None, query_rewrite=None):
-        Thread.__init__(self)
-        self.chat_history = chat_history
-        self.reference = reference
-        self.top_k = top_k
-        self.query_rewrite = query_rewrite
-        self.result = {}
-        self.started = False
+class QuestionRecommendCache:
+    """相同 (query_rewrite, reference, top_k) 的推荐结果缓存，LRU + TTL；executor 方式下多个线程共用，需要加锁"""
 
-    def set(self, chat_history: list, reference: list[dict], top_k=None, query_rewrite=None):
-        self.chat_history = chat_history
-        self.reference = reference
-        self.top_k = top_k
-        self.query_rewrite = query_rewrite
+    def __init__(self, max_entries: int = QUESTION_RECOMMEND_CACHE_MAX_ENTRIES, ttl: float = QUESTION_RECOMMEND_CACHE_TTL):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(reference: list[dict], top_k=None, query_rewrite=None) -> str:
+        # query_rewrite 是结合历史对话改写后的问题，不再单独区分 chat_history
+        return json.dumps([query_rewrite, reference, top_k], sort_keys=True, ensure_ascii=False)
+
+    def get(self, key: str):
+        if self._ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, result: dict):
+        if self._ttl <= 0 or not result:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+question_recommend_cache = QuestionRecommendCache()
+
+
+class QuestionRecommendTask:
+    """
+    在当前事件循环中异步请求问题推荐，替代每个请求单独启动的线程
+    - 请求通过共享的 HTTP 连接池发送，超过 timeout 秒取消
+    - 回答结束时调用 result()，最多等待 finish_wait 秒，没有返回的结果丢弃，不阻塞 finished 事件
+    """
+
+    def __init__(self, timeout: float = QUESTION_RECOMMEND_TIMEOUT, cache: QuestionRecommendCache = question_recommend_cache):
+        self._timeout = timeout
+        self._cache = cache
+        self._task = None
+        self._meter_key = MeterKey(path="question_recommend", method="batch")
 
     def has_started(self):
-        return self.started
-    
-    def start_working(self):
-        if self.started:
+        return self._task is not None
+
+    def start(self, chat_history: list, reference: list[dict], top_k=None, query_rewrite=None):
+        if self._task is not None:
             return
-        self.started = True
-        self.start()
-
-    def run(self):
-        self.result = batch_question_recommend(
-            chat_history=self.chat_history, 
-            reference=self.reference, 
-            top_k=self.top_k, 
-            query_rewrite=self.query_rewrite)
-
-    def wait_result(self):
-        self.join()
-        return self.result
\ No newline at end of file
+        self._task = asyncio.create_task(self._request(chat_history, reference, top_k, query_rewrite))
+
+    async def _request(self, chat_history: list, reference: list[dict], top_k=None, query_rewrite=None) -> dict:
+        key = self._cache.key(reference, top_k, query_rewrite)
+        cached = self._cache.get(key)
+        if cached is not None:
+            record_count(self._meter_key, QUESTION_RECOMMEND_CACHE_HIT_COUNT, 1)
+            return cached
+        timer = Timer()
+        result = await batch_question_recommend(chat_history, reference, top_k, query_rewrite, timeout=self._timeout)
+        record_latency(self._meter_key, QUESTION_RECOMMEND_LATENCY, timer.duration())
+        self._cache.set(key, result)
+        return result
+
+    async def result(self, finish_wait: float = QUESTION_RECOMMEND_FINISH_WAIT) -> dict:
+        """返回已经得到的推荐结果，未完成时最多等待 finish_wait 秒，超时返回空结果"""
+        if self._task is None:
+            return {}
+        if not self._task.done():
+            await asyncio.wait([self._task], timeout=finish_wait)
+        if not self._task.done():
+            self._task.cancel()
+            record_count(self._meter_key, QUESTION_RECOMMEND_DROPPED_COUNT, 1)
+            algo_logger.warning(f"question recommend not ready in {finish_wait}s, dropped")
+            return {}
+        if self._task.cancelled() or self._task.exception() is not None:
+            return {}
+        return self._task.result() or {}
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
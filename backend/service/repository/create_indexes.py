@@ -1,6 +1,7 @@
 from pymongo import MongoClient, ASCENDING, DESCENDING
 
 from service.config.config import service_config
+from service.repository.mongo_task_manager import MongoTaskManager
 
 """
 此脚本根据仓库中各 MongoDB Manager 的查询 / 更新方式，
@@ -123,4 +124,24 @@ db[TASK_COLLECTION].create_index(
     background=True,
 )
 
+# claim_next_task 按 (priority, check_time) 获取下一个到期的任务
+db[TASK_COLLECTION].create_index(
+    [("status", ASCENDING), ("priority", ASCENDING), ("check_time", ASCENDING)],
+    name="idx_status_priority_check_time",
+    background=True,
+)
+
+# add_task / submit_graph 的去重：同一时间只有一个去重键相同的未结束任务，任务结束时删除 active_dedupe_key
+db[TASK_COLLECTION].create_index(
+    [("active_dedupe_key", ASCENDING)],
+    name="uk_active_dedupe_key",
+    unique=True,
+    partialFilterExpression={"active_dedupe_key": {"$exists": True}},
+    background=True,
+)
+
+# 旧任务没有 priority 字段，按 priority 升序获取时会排在所有任务之前，补充优先级
+backfilled = MongoTaskManager(client, service_config.storage.mongo_db, TASK_COLLECTION).backfill_priorities()
+print(f"Backfilled priority for {backfilled} tasks in {TASK_COLLECTION}")
+
 print("All indexes created successfully.") 
\ No newline at end of file
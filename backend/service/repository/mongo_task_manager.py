@@ -1,24 +1,105 @@
+import hashlib
+import json
+import time
 import traceback
 from enum import Enum
 from bson.objectid import ObjectId
 from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta
 
+from metrics.meter_key import MeterKey
+from metrics.meters import record_count
+from metrics.metrics import TASK_COMPLETED_COUNT, TASK_FAILED_COUNT, TASK_CANCELLED_COUNT
 from util.model_types import TaskCollectionModel
 from util.logger import service_logger
-from service.config.config import service_config
+from service.config.config import service_config, TASK_DISPATCH_ENABLED, TASK_PRIORITY, TASK_DEFAULT_PRIORITY, TASK_LEASE_SECONDS, TASK_MAX_ATTEMPTS, TASK_EVENTS_ENABLED
+from service.package.task_wakeup import task_wakeup
+from service.package.task_events import task_events
 class TaskStatus(str, Enum):
     PENDING = "pending"
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAIL = "fail"
     CANCEL = "cancel"
+    WAITING = "waiting" # 依赖的任务尚未全部完成
+
+
+# 任务结束的状态，进入这些状态时释放等待它的任务
+FINISHED_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAIL, TaskStatus.CANCEL)
+
+# 任务结束时计数的指标
+FINISHED_METRICS = {
+    TaskStatus.COMPLETED: TASK_COMPLETED_COUNT,
+    TaskStatus.FAIL: TASK_FAILED_COUNT,
+    TaskStatus.CANCEL: TASK_CANCELLED_COUNT,
+}
+
+
+def task_dedupe_key(task_type: str, params: dict, ignore: tuple = ()) -> str:
+    """
+    任务的去重键：(task_type, treatment_id, 参数的指纹)
+    :param ignore: 不参与指纹的参数，例如每次随机生成的 diagnose_id、treatment_plan_id
+    """
+    fingerprint_params = {key: value for key, value in params.items() if key not in ignore}
+    fingerprint = hashlib.sha1(json.dumps(fingerprint_params, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:16]
+    return f"{task_type}:{params.get('treatment_id', '')}:{fingerprint}"
+
+
+class WaitForTasks:
+    """
+    任务需要等待其他任务结束（完成、失败或取消）后重新执行时返回，例如电子病历等待报告识别：
+    任务不占用 worker，转为 waiting 状态，最后一个等待的任务结束时重新放入队列
+    """
+
+    def __init__(self, task_ids: list):
+        self.task_ids = list(task_ids)
+
+
+class TaskGraph:
+    """
+    声明式的任务依赖图，通过 MongoTaskManager.submit_graph 一次写入：
+    没有依赖的任务立即可以执行，其余任务在最后一个依赖完成时放入队列；依赖失败或取消时下游任务被取消
+    任务只能依赖已经添加的任务，因此不会出现环
+
+        graph = TaskGraph("first_diagnosis")
+        report = graph.add("generate_first_electronic_report", {...})
+        diagnosis = graph.add("generate_diagnosis_and_treatment_plan", {...}, depends_on=[report])
+        graph.add("generate_treatment", {...}, depends_on=[diagnosis])
+        graph.add("summarize_history_data", {...}, depends_on=[diagnosis])
+        task_manager.submit_graph(graph)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pipeline_id = str(ObjectId())
+        # [(task_id, task_type, params, depends_on)]，按添加顺序
+        self.nodes = []
+
+    def add(self, task_type: str, params: dict, depends_on: list = None) -> str:
+        """添加任务，返回任务ID，可以作为其他任务的依赖"""
+        depends_on = list(depends_on or [])
+        task_ids = {node[0] for node in self.nodes}
+        unknown = [task_id for task_id in depends_on if task_id not in task_ids]
+        if unknown:
+            raise ValueError(f"unknown dependencies: {unknown}")
+        task_id = str(ObjectId())
+        self.nodes.append((task_id, task_type, params, depends_on))
+        return task_id
 
 
 class MongoTaskManager():
-    def __init__(self, mongo_client, db, collection_name):
+    def __init__(self, mongo_client, db, collection_name, notifier=None, priorities=None, lease_seconds=TASK_LEASE_SECONDS, events=None):
         self.db = mongo_client[db]
         self.collection = self.db[collection_name]
+        # 新任务的唤醒通知（TaskWakeup），None 时只靠轮询
+        self.notifier = notifier
+        # 任务状态变化的通知（TaskEvents），用于推送任务进度
+        self.events = events
+        # 任务类型的优先级，数值越小越先执行
+        self.priorities = TASK_PRIORITY if priorities is None else priorities
+        # 执行租约的时长，worker 需要在到期前续约
+        self.lease_seconds = lease_seconds
         service_logger.info(f"MongoTaskManager initialized, task queue name: {collection_name}")
 
 
@@ -43,18 +124,148 @@ class MongoTaskManager():
             return None
         
 
+    def get_by_task_ids(self, task_ids: list, projection: dict = None) -> list:
+        """
+        批量获取任务详情，一次 $in 查询
+        :param projection: 只返回需要的字段，例如只查状态时不返回报告识别的结果
+        :return: 与 task_ids 顺序一致的列表，不存在或无效的任务ID为 None
+        """
+        object_ids = []
+        for task_id in task_ids:
+            if ObjectId.is_valid(task_id):
+                object_ids.append(ObjectId(task_id))
+        tasks = {}
+        if object_ids:
+            for task in self.collection.find({"_id": {"$in": object_ids}}, projection):
+                task["_id"] = str(task["_id"])
+                tasks[task["_id"]] = task
+        return [tasks.get(task_id) for task_id in task_ids]
+
+
     def update_task_status(self, task_id: str, task_status: TaskStatus):
         try:    
-            self.collection.update_one(
+            update = {"$set": {"status": task_status.value}}
+            if task_status in FINISHED_STATUSES:
+                update["$unset"] = {TaskCollectionModel.active_dedupe_key: ""}
+            task = self.collection.find_one_and_update(
                 {"_id": ObjectId(task_id)},
-                {"$set": {"status": task_status.value}}
+                update,
+                return_document=ReturnDocument.AFTER
             )
+            # 例如取消报告识别，释放等待它的任务
+            if task is not None:
+                self._publish(task)
+                self._on_task_finished(task, task_status)
         except Exception as e:
             service_logger.error(traceback.format_exc())
             return False
         return True
     
     
+    def rerun_task(self, task_id: str) -> bool:
+        """
+        重新执行已经结束的任务，恢复去重键；依赖图中的任务连同所有下游任务一起重新执行
+        先转为 waiting（不会被获取），重置下游任务后再放入队列，避免任务在下游重置前完成
+        :return: 任务不存在、尚未结束，或者已经有相同的任务未结束时返回 False
+        """
+        task = self.get_by_task_id(task_id)
+        if task is None or task.get(TaskCollectionModel.status) not in [status.value for status in FINISHED_STATUSES]:
+            return False
+        update = {
+            "$set": {
+                TaskCollectionModel.status: TaskStatus.WAITING.value,
+                TaskCollectionModel.pending_dependencies: 0,
+                TaskCollectionModel.updated_at: datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                TaskCollectionModel.attempts: 0,
+            },
+            "$unset": {TaskCollectionModel.last_error: ""},
+        }
+        if task.get(TaskCollectionModel.dedupe_key):
+            update["$set"][TaskCollectionModel.active_dedupe_key] = task[TaskCollectionModel.dedupe_key]
+        try:
+            result = self.collection.find_one_and_update(
+                {"_id": ObjectId(task_id), TaskCollectionModel.status: task[TaskCollectionModel.status]},
+                update,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            service_logger.info(f"rerun task skipped, same task not finished, task_id: {task_id}, dedupe_key: {task[TaskCollectionModel.dedupe_key]}")
+            return False
+        if result is None:
+            return False
+
+        if result.get(TaskCollectionModel.downstream):
+            self._reset_downstream(result)
+
+        now = datetime.now()
+        result = self.collection.find_one_and_update(
+            {"_id": ObjectId(task_id), TaskCollectionModel.status: TaskStatus.WAITING.value},
+            {"$set": {
+                TaskCollectionModel.status: TaskStatus.PENDING.value,
+                TaskCollectionModel.check_time: now.strftime("%Y-%m-%d %H:%M:%S"),
+                TaskCollectionModel.updated_at: now.strftime("%Y-%m-%d %H:%M:%S"),
+                TaskCollectionModel.ready_at: time.time(),
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if result is None:
+            return False
+        self._publish(result)
+        if self.notifier is not None:
+            self.notifier.notify(task_id, 0)
+        return True
+
+    def _reset_downstream(self, task: dict):
+        """
+        重新执行依赖图中的任务时，所有下游任务（已完成、失败、取消）重新等待：
+        依赖数按 depends_on 中未完成的任务重新计算，重新执行的任务都算作未完成；执行中的下游任务不处理
+        """
+        rerun_ids = {str(task["_id"])}
+        pending = list(task.get(TaskCollectionModel.downstream, []))
+        nodes = {}
+        while pending:
+            downstream_id = pending.pop()
+            if downstream_id in nodes:
+                continue
+            node = self.collection.find_one({"_id": ObjectId(downstream_id)})
+            if node is None or node.get(TaskCollectionModel.status) == TaskStatus.PROCESSING.value:
+                continue
+            nodes[downstream_id] = node
+            rerun_ids.add(downstream_id)
+            pending.extend(node.get(TaskCollectionModel.downstream, []))
+
+        # 依赖图之外的依赖按当前状态判断
+        outside_ids = {dependency for node in nodes.values() for dependency in node.get(TaskCollectionModel.depends_on, [])} - rerun_ids
+        completed = {task["_id"] for task in self.get_by_task_ids(list(outside_ids), projection={TaskCollectionModel.status: 1})
+                     if task is not None and task.get(TaskCollectionModel.status) == TaskStatus.COMPLETED.value}
+
+        for downstream_id, node in nodes.items():
+            depends_on = node.get(TaskCollectionModel.depends_on, [])
+            update = {
+                "$set": {
+                    TaskCollectionModel.status: TaskStatus.WAITING.value,
+                    TaskCollectionModel.pending_dependencies: len([dependency for dependency in depends_on if dependency not in completed]),
+                    TaskCollectionModel.updated_at: datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    TaskCollectionModel.attempts: 0,
+                },
+                "$unset": {TaskCollectionModel.last_error: "", "worker_id": ""},
+            }
+            if node.get(TaskCollectionModel.dedupe_key):
+                update["$set"][TaskCollectionModel.active_dedupe_key] = node[TaskCollectionModel.dedupe_key]
+            try:
+                result = self.collection.find_one_and_update(
+                    {"_id": node["_id"], TaskCollectionModel.status: node[TaskCollectionModel.status]},
+                    update,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                service_logger.warning(f"reset downstream task skipped, same task not finished, task_id: {downstream_id}")
+                continue
+            if result is not None:
+                self._publish(result)
+                service_logger.info(f"upstream task rerun, downstream task reset, task_id: {downstream_id}, upstream_task_id: {task['_id']}")
+
+
     def update_task(self, task_id: str, task_result: dict):
         try:
             self.collection.update_one(
@@ -67,7 +278,45 @@ class MongoTaskManager():
         return True
 
     
-    def add_task(self, task_type, params, delay=0):
+    def add_task(self, task_type, params, delay=0, dedupe_key=None):
+        """
+        写入任务，返回任务ID
+        :param dedupe_key: 去重键（见 task_dedupe_key），已经有相同去重键的未结束任务时不写入，返回已有任务的ID
+        """
+        if dedupe_key is not None:
+            existing = self._find_active(dedupe_key)
+            if existing is not None:
+                service_logger.info(f"duplicate task skipped, task_type: {task_type}, dedupe_key: {dedupe_key}, existing task_id: {existing['_id']}")
+                return str(existing["_id"])
+        row = self._new_task_row(task_type, params, delay, dedupe_key)
+        try:
+            result = self.collection.insert_one(row)
+        except DuplicateKeyError:
+            # 并发写入相同的任务，由唯一索引保证只有一个写入成功
+            existing = self._find_active(dedupe_key)
+            if existing is None:
+                # 已有的任务刚好结束，重新写入
+                return self.add_task(task_type, params, delay, dedupe_key)
+            service_logger.info(f"duplicate task skipped, task_type: {task_type}, dedupe_key: {dedupe_key}, existing task_id: {existing['_id']}")
+            return str(existing["_id"])
+        task_id = str(result.inserted_id)
+        self._publish(row)
+        if self.notifier is not None:
+            self.notifier.notify(task_id, delay)
+        return task_id
+
+    def _find_active(self, dedupe_key: str, projection: dict = None):
+        """获取去重键相同的未结束任务"""
+        return self.collection.find_one({TaskCollectionModel.active_dedupe_key: dedupe_key}, projection)
+
+    def find_active_task_id(self, dedupe_key: str):
+        """去重键相同的未结束任务的ID，没有时返回 None"""
+        if not dedupe_key:
+            return None
+        task = self._find_active(dedupe_key, projection={"_id": 1})
+        return str(task["_id"]) if task is not None else None
+
+    def _new_task_row(self, task_type, params, delay=0, dedupe_key=None):
         # 获取当前时间
         now = datetime.now()
         now_time_string = now.strftime("%Y-%m-%d %H:%M:%S")
@@ -86,17 +335,202 @@ class MongoTaskManager():
             TaskCollectionModel.check_time: check_time_string,
             TaskCollectionModel.created_at: now_time_string,
             TaskCollectionModel.updated_at: now_time_string,
+            TaskCollectionModel.ready_at: time.time() + max(delay, 0),
+            TaskCollectionModel.priority: self.priorities.get(task_type, TASK_DEFAULT_PRIORITY),
+            TaskCollectionModel.attempts: 0,
         }
-        result = self.collection.insert_one(row)
-        return str(result.inserted_id)
+        if dedupe_key is not None:
+            row[TaskCollectionModel.dedupe_key] = dedupe_key
+            row[TaskCollectionModel.active_dedupe_key] = dedupe_key
+        return row
+
+    def submit_graph(self, graph: TaskGraph, dedupe_key: str = None) -> list:
+        """
+        一次写入依赖图中的所有任务：有依赖的任务状态为 waiting，记录未完成的依赖数；
+        每个任务记录下游任务，完成时由 release_lock 逐个减少下游的依赖数
+        :param dedupe_key: 依赖图的去重键，写在第一个任务上；第一个任务相同的依赖图未结束时不写入，返回已有依赖图的任务ID
+        :return: 按添加顺序的任务ID
+        """
+        if dedupe_key is not None:
+            existing = self._find_active(dedupe_key)
+            if existing is not None:
+                return self._existing_graph_task_ids(existing, dedupe_key)
+
+        downstream = {}
+        for task_id, _, _, depends_on in graph.nodes:
+            for dependency in depends_on:
+                downstream.setdefault(dependency, []).append(task_id)
+
+        started_at = time.time()
+        rows = []
+        for index, (task_id, task_type, params, depends_on) in enumerate(graph.nodes):
+            row = self._new_task_row(task_type, params, dedupe_key=dedupe_key if index == 0 else None)
+            row["_id"] = ObjectId(task_id)
+            row[TaskCollectionModel.pipeline] = graph.name
+            row[TaskCollectionModel.pipeline_id] = graph.pipeline_id
+            row[TaskCollectionModel.pipeline_started_at] = started_at
+            if depends_on:
+                row[TaskCollectionModel.status] = TaskStatus.WAITING.value
+                row[TaskCollectionModel.depends_on] = depends_on
+                row[TaskCollectionModel.pending_dependencies] = len(depends_on)
+            if task_id in downstream:
+                row[TaskCollectionModel.downstream] = downstream[task_id]
+            rows.append(row)
+        try:
+            # 按顺序写入，第一个任务去重失败时整个依赖图都不会写入
+            self.collection.insert_many(rows, ordered=True)
+        except DuplicateKeyError:
+            existing = self._find_active(dedupe_key)
+            if existing is None:
+                return self.submit_graph(graph, dedupe_key)
+            return self._existing_graph_task_ids(existing, dedupe_key)
+        for row in rows:
+            self._publish(row)
+
+        if self.notifier is not None:
+            for task_id, _, _, depends_on in graph.nodes:
+                if not depends_on:
+                    self.notifier.notify(task_id, 0)
+        return [task_id for task_id, _, _, _ in graph.nodes]
+
+    def _existing_graph_task_ids(self, existing: dict, dedupe_key: str) -> list:
+        """去重时返回已有依赖图的任务ID，ObjectId 按添加顺序生成，按 _id 排序即为添加顺序"""
+        service_logger.info(f"duplicate pipeline skipped, dedupe_key: {dedupe_key}, existing task_id: {existing['_id']}")
+        pipeline_id = existing.get(TaskCollectionModel.pipeline_id)
+        if not pipeline_id:
+            return [str(existing["_id"])]
+        cursor = self.collection.find({TaskCollectionModel.pipeline_id: pipeline_id}, {"_id": 1}).sort([("_id", 1)])
+        return [str(task["_id"]) for task in cursor]
+
+    def _release_waiting(self, task_ids: list):
+        """依赖的任务结束后减少等待任务的依赖数，最后一个依赖结束时放入队列"""
+        for downstream_id in task_ids:
+            node = self.collection.find_one_and_update(
+                {"_id": ObjectId(downstream_id), TaskCollectionModel.status: TaskStatus.WAITING.value},
+                {"$inc": {TaskCollectionModel.pending_dependencies: -1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if node is None or node.get(TaskCollectionModel.pending_dependencies, 0) > 0:
+                continue
+            # 多个依赖同时完成时只有一个会看到依赖数为 0，条件更新保证只放入队列一次
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            released = self.collection.find_one_and_update(
+                {"_id": node["_id"], TaskCollectionModel.status: TaskStatus.WAITING.value},
+                {"$set": {
+                    TaskCollectionModel.status: TaskStatus.PENDING.value,
+                    TaskCollectionModel.check_time: now,
+                    TaskCollectionModel.updated_at: now,
+                    TaskCollectionModel.ready_at: time.time(),
+                }},
+                return_document=ReturnDocument.AFTER
+            )
+            if released is not None:
+                self._publish(released)
+                service_logger.info(f"dependencies finished, task released, task_id: {downstream_id}, pipeline_id: {node.get(TaskCollectionModel.pipeline_id)}")
+                if self.notifier is not None:
+                    self.notifier.notify(downstream_id, 0)
+
+    def _cancel_downstream(self, task: dict, task_status: TaskStatus):
+        """任务失败或取消后，取消所有等待它的下游任务"""
+        upstream_id = str(task["_id"])
+        pending = list(task.get(TaskCollectionModel.downstream, []))
+        while pending:
+            downstream_id = pending.pop()
+            node = self.collection.find_one_and_update(
+                {"_id": ObjectId(downstream_id), TaskCollectionModel.status: TaskStatus.WAITING.value},
+                {
+                    "$set": {
+                        TaskCollectionModel.status: TaskStatus.CANCEL.value,
+                        TaskCollectionModel.updated_at: datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        TaskCollectionModel.last_error: f"upstream task {upstream_id} {task_status.value}",
+                    },
+                    "$unset": {TaskCollectionModel.active_dedupe_key: ""},
+                },
+                return_document=ReturnDocument.AFTER
+            )
+            if node is not None:
+                self._publish(node)
+                self._record_finished(node, TaskStatus.CANCEL)
+                service_logger.warning(f"upstream task {task_status.value}, task cancelled, task_id: {downstream_id}, upstream_task_id: {upstream_id}")
+                pending.extend(node.get(TaskCollectionModel.downstream, []))
+
+    def _record_finished(self, task: dict, task_status: TaskStatus):
+        meter_key = MeterKey(path="task", method=task.get(TaskCollectionModel.task_type) or "unknown")
+        record_count(meter_key, FINISHED_METRICS[task_status], 1)
+
+    def _on_task_finished(self, task: dict, task_status: TaskStatus):
+        if task_status not in FINISHED_STATUSES:
+            return
+        self._record_finished(task, task_status)
+        # 等待任务结束的任务（wait_for_tasks），不论结果都放入队列
+        if task.get(TaskCollectionModel.waiters):
+            waiters = self._take_waiters(task["_id"])
+            if waiters:
+                self._release_waiting(waiters)
+        # 依赖图的下游任务只在完成时放入队列
+        if task.get(TaskCollectionModel.downstream):
+            if task_status is TaskStatus.COMPLETED:
+                self._release_waiting(task[TaskCollectionModel.downstream])
+            else:
+                self._cancel_downstream(task, task_status)
+
+    def _take_waiters(self, task_id) -> list:
+        """
+        原子地取出并清空等待任务结束的任务，每个等待只释放一次：
+        任务重新执行后再次结束时，不会再次减少等待任务的依赖数
+        """
+        task = self.collection.find_one_and_update(
+            {"_id": ObjectId(str(task_id)), TaskCollectionModel.waiters: {"$exists": True}},
+            {"$unset": {TaskCollectionModel.waiters: ""}},
+            projection={TaskCollectionModel.waiters: 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if task is None:
+            return []
+        return task.get(TaskCollectionModel.waiters) or []
+
+    def wait_for_tasks(self, task_id: str, worker_id: str, task_ids: list) -> bool:
+        """
+        执行中的任务改为等待 task_ids 全部结束后重新执行，释放 worker
+        先转为 waiting 再登记到每个依赖上，依赖在登记前已经结束时直接减少依赖数，不会错过结束事件
+        :return: 任务已经不由 worker_id 持有时返回 False
+        """
+        task_ids = list(dict.fromkeys(task_ids))
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        result = self.collection.find_one_and_update(
+            {"_id": ObjectId(task_id), "worker_id": worker_id, TaskCollectionModel.status: TaskStatus.PROCESSING.value},
+            {
+                "$set": {
+                    TaskCollectionModel.status: TaskStatus.WAITING.value,
+                    TaskCollectionModel.pending_dependencies: len(task_ids),
+                    TaskCollectionModel.updated_at: now,
+                },
+                "$unset": {"worker_id": "", TaskCollectionModel.lease_expires_at: ""},
+                # 等待不计入执行次数
+                "$inc": {TaskCollectionModel.attempts: -1},
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if result is None:
+            return False
+        self._publish(result)
+        unfinished = [TaskStatus.PENDING.value, TaskStatus.PROCESSING.value, TaskStatus.WAITING.value]
+        for dependency_id in task_ids:
+            registered = self.collection.update_one(
+                {"_id": ObjectId(dependency_id), TaskCollectionModel.status: {"$in": unfinished}},
+                {"$addToSet": {TaskCollectionModel.waiters: task_id}}
+            )
+            if registered.matched_count == 0:
+                self._release_waiting([task_id])
+        return True
     
-    def find_task_by_treatment_id(self, treatment_id):
-        # 查询 params 中字段 treatment_id 的值为 treatment_id 的文档
+    def find_task_by_treatment_id(self, treatment_id, projection: dict = None):
+        # 查询 params 中字段 treatment_id 的值为 treatment_id 的文档，projection 为 None 时返回完整文档
         try:
             query = {
                 f"{TaskCollectionModel.params}.treatment_id": treatment_id
             }
-            cursor = self.collection.find(query).limit(100).skip(0).sort([(TaskCollectionModel.created_at, -1)])
+            cursor = self.collection.find(query, projection).limit(100).skip(0).sort([(TaskCollectionModel.created_at, -1)])
             documents = []
             for each in cursor:
                 each["_id"] = str(each["_id"])
@@ -112,7 +546,7 @@ class MongoTaskManager():
             TaskCollectionModel.status: TaskStatus.PENDING.name.lower(),
             TaskCollectionModel.check_time: {"$lte": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
         }
-        cursor = self.collection.find(query).limit(10).skip(0).sort("time", -1)
+        cursor = self.collection.find(query).limit(10).skip(0).sort([(TaskCollectionModel.priority, 1), (TaskCollectionModel.check_time, 1)])
         documents = []
         for each in cursor:
             each["task_id"] = str(each["_id"])
@@ -120,16 +554,220 @@ class MongoTaskManager():
         return documents
 
 
+    def queue_stats(self) -> dict:
+        """
+        按任务类型统计队列积压，一次聚合查询
+        :return: {task_type: {"pending": 待处理数（包含等待重试）, "ready": 已经到期的待处理数,
+                  "processing": 执行中的任务数, "oldest_ready_at": 最早到期的待处理任务的 ready_at}}
+        """
+        now = time.time()
+        cursor = self.collection.aggregate([
+            {"$match": {TaskCollectionModel.status: {"$in": [TaskStatus.PENDING.value, TaskStatus.PROCESSING.value]}}},
+            {"$group": {
+                "_id": {"task_type": f"${TaskCollectionModel.task_type}", "status": f"${TaskCollectionModel.status}"},
+                "count": {"$sum": 1},
+                # 没有 ready_at 的旧任务按已经到期统计
+                "ready": {"$sum": {"$cond": [{"$lte": [{"$ifNull": [f"${TaskCollectionModel.ready_at}", 0]}, now]}, 1, 0]}},
+                "oldest_ready_at": {"$min": f"${TaskCollectionModel.ready_at}"},
+            }},
+        ])
+        stats = {}
+        for group in cursor:
+            task_type = group["_id"].get("task_type") or "unknown"
+            entry = stats.setdefault(task_type, {"pending": 0, "ready": 0, "processing": 0, "oldest_ready_at": None})
+            if group["_id"].get("status") == TaskStatus.PENDING.value:
+                entry["pending"] = group["count"]
+                entry["ready"] = group["ready"]
+                entry["oldest_ready_at"] = group.get("oldest_ready_at")
+            else:
+                entry["processing"] = group["count"]
+        return stats
+
+    def backfill_priorities(self) -> int:
+        """
+        为没有 priority 字段的旧任务补充优先级（按任务类型的配置），
+        否则按 priority 升序获取时，缺少该字段（null）的任务排在所有任务之前
+        :return: 补充的任务数
+        """
+        unfinished = [TaskStatus.PENDING.value, TaskStatus.PROCESSING.value, TaskStatus.WAITING.value]
+        missing = {TaskCollectionModel.priority: {"$exists": False}, TaskCollectionModel.status: {"$in": unfinished}}
+        updated = 0
+        for task_type, priority in self.priorities.items():
+            result = self.collection.update_many({**missing, TaskCollectionModel.task_type: task_type},
+                                                 {"$set": {TaskCollectionModel.priority: priority}})
+            updated += result.modified_count
+        # 未配置的类型使用默认优先级
+        result = self.collection.update_many(missing, {"$set": {TaskCollectionModel.priority: TASK_DEFAULT_PRIORITY}})
+        return updated + result.modified_count
+
+    def claim_next_task(self, worker_id: str, exclude_types: list = None):
+        """
+        原子地获取下一个到期的任务：按 (priority, check_time) 取第一个待处理任务并加锁，
+        多个 worker 并发获取时不会争抢同一批候选任务
+        :param exclude_types: 不获取的任务类型（本 worker 没有空闲名额的类型）
+        :return: 任务详情（包含 task_id），没有可执行的任务时返回 None
+        """
+        now = datetime.now()
+        query = {
+            TaskCollectionModel.status: TaskStatus.PENDING.value,
+            TaskCollectionModel.check_time: {"$lte": now.strftime("%Y-%m-%d %H:%M:%S")},
+        }
+        if exclude_types:
+            query[TaskCollectionModel.task_type] = {"$nin": list(exclude_types)}
+        task = self.collection.find_one_and_update(
+            filter=query,
+            update=self._claim_update(worker_id),
+            sort=[(TaskCollectionModel.priority, 1), (TaskCollectionModel.check_time, 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if task is None:
+            return None
+        self._publish(task)
+        task["task_id"] = str(task["_id"])
+        return task
+
+
     def acquire_lock(self, task_id: str, worker_id: str) -> bool:
         """
         尝试获取任务锁
         """
         result = self.collection.find_one_and_update(
             filter={"_id": ObjectId(task_id), "status": TaskStatus.PENDING.value},
-            update={"$set": {"status": TaskStatus.PROCESSING.value, "worker_id": worker_id}},
+            update=self._claim_update(worker_id),
             return_document=ReturnDocument.AFTER
         )
-        return result is not None
+        if result is None:
+            return False
+        self._publish(result)
+        return True
+
+
+    def _claim_update(self, worker_id: str) -> dict:
+        # 加锁的同时获取执行租约，并记录执行次数
+        return {
+            "$set": {
+                "status": TaskStatus.PROCESSING.value,
+                "worker_id": worker_id,
+                TaskCollectionModel.lease_expires_at: time.time() + self.lease_seconds,
+            },
+            "$inc": {TaskCollectionModel.attempts: 1},
+        }
+
+
+    def renew_leases(self, task_ids: list, worker_id: str) -> int:
+        """
+        续约 worker 正在执行的任务，一次更新所有任务
+        :return: 续约成功的任务数，少于 task_ids 说明部分任务已经被回收
+        """
+        if not task_ids:
+            return 0
+        result = self.collection.update_many(
+            {
+                "_id": {"$in": [ObjectId(task_id) for task_id in task_ids]},
+                "worker_id": worker_id,
+                "status": TaskStatus.PROCESSING.value,
+            },
+            {"$set": {TaskCollectionModel.lease_expires_at: time.time() + self.lease_seconds}}
+        )
+        return result.matched_count
+
+
+    def reap_expired_tasks(self, max_attempts: int = TASK_MAX_ATTEMPTS) -> list:
+        """
+        回收租约过期的任务（worker 退出、卡死）：执行次数未达到 max_attempts 的放回队列，否则标记为失败
+        多个进程同时回收时，条件更新保证每个任务只被回收一次
+        :return: 被回收的任务列表 [(task_type, 回收后的状态)]
+        """
+        now = time.time()
+        # 引入租约之前获取的任务没有 lease_expires_at，补充一个租约期后按过期回收；
+        # 滚动发布时旧版本 worker 仍在执行的任务也有一个租约期的时间完成
+        legacy = self.collection.update_many(
+            {
+                TaskCollectionModel.status: TaskStatus.PROCESSING.value,
+                TaskCollectionModel.lease_expires_at: {"$exists": False},
+            },
+            {"$set": {TaskCollectionModel.lease_expires_at: now + self.lease_seconds}}
+        )
+        if legacy.modified_count:
+            service_logger.warning(f"found {legacy.modified_count} processing tasks without lease, reclaim after {self.lease_seconds} seconds")
+        expired = self.collection.find(
+            {
+                TaskCollectionModel.status: TaskStatus.PROCESSING.value,
+                TaskCollectionModel.lease_expires_at: {"$lt": now},
+            },
+            projection={TaskCollectionModel.task_type: 1, TaskCollectionModel.attempts: 1, "worker_id": 1, TaskCollectionModel.lease_expires_at: 1}
+        )
+        reaped = []
+        for task in expired:
+            if task.get(TaskCollectionModel.attempts, 0) < max_attempts:
+                new_status = TaskStatus.PENDING
+                update = {
+                    "$set": {
+                        TaskCollectionModel.status: new_status.value,
+                        TaskCollectionModel.check_time: datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        TaskCollectionModel.updated_at: datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        # 从回收时开始计算等待时间，不包含租约过期前的执行时间
+                        TaskCollectionModel.ready_at: time.time(),
+                    },
+                    "$unset": {"worker_id": "", TaskCollectionModel.lease_expires_at: ""},
+                }
+            else:
+                new_status = TaskStatus.FAIL
+                update = {
+                    "$set": {
+                        TaskCollectionModel.status: new_status.value,
+                        TaskCollectionModel.updated_at: datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    },
+                    "$unset": {TaskCollectionModel.lease_expires_at: "", TaskCollectionModel.active_dedupe_key: ""},
+                }
+            result = self.collection.find_one_and_update(
+                {
+                    "_id": task["_id"],
+                    TaskCollectionModel.status: TaskStatus.PROCESSING.value,
+                    TaskCollectionModel.lease_expires_at: task[TaskCollectionModel.lease_expires_at],
+                },
+                update,
+                return_document=ReturnDocument.AFTER
+            )
+            if result is not None:
+                self._publish(result)
+                service_logger.warning(f"task lease expired, task_id: {task['_id']}, worker_id: {task.get('worker_id')}, "
+                                       f"attempts: {task.get(TaskCollectionModel.attempts, 0)}, new status: {new_status.value}")
+                reaped.append((task.get(TaskCollectionModel.task_type), new_status))
+                if new_status is TaskStatus.PENDING and self.notifier is not None:
+                    # 唤醒所有 worker，不只等本进程下一次轮询
+                    self.notifier.notify(str(task["_id"]), 0)
+                self._on_task_finished(result, new_status)
+        return reaped
+
+
+    def retry_task(self, task_id: str, worker_id: str, delay: float, time_cost: float = 0, error: str = None) -> bool:
+        """
+        执行失败的任务延迟 delay 秒后重试：放回队列并推迟 check_time，等待期间不占用 worker，执行次数保留
+        """
+        now = datetime.now()
+        update = {
+            "$set": {
+                TaskCollectionModel.status: TaskStatus.PENDING.value,
+                TaskCollectionModel.check_time: (now + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S"),
+                TaskCollectionModel.ready_at: time.time() + delay,
+                TaskCollectionModel.updated_at: now.strftime("%Y-%m-%d %H:%M:%S"),
+                TaskCollectionModel.last_error: error,
+                "time_cost": time_cost,
+            },
+            "$unset": {"worker_id": "", TaskCollectionModel.lease_expires_at: ""},
+        }
+        result = self.collection.find_one_and_update(
+            {"_id": ObjectId(task_id), "worker_id": worker_id, "status": TaskStatus.PROCESSING.value},
+            update,
+            return_document=ReturnDocument.AFTER
+        )
+        if result is None:
+            return False
+        self._publish(result)
+        if self.notifier is not None:
+            self.notifier.notify(task_id, delay)
+        return True
 
 
     def release_lock(self, task_id: str, worker_id: str, task_status: TaskStatus, time_cost: float = 0) -> bool:
@@ -139,22 +777,40 @@ class MongoTaskManager():
         if task_status is TaskStatus.PROCESSING:
             return False
         
+        update = {
+            "$set": {
+                "status": task_status.value,
+                "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "time_cost": time_cost
+            },
+            "$unset": {TaskCollectionModel.lease_expires_at: ""},
+        }
+        if task_status is TaskStatus.PENDING:
+            # 获取后没有执行就放回队列，不计入执行次数
+            update["$inc"] = {TaskCollectionModel.attempts: -1}
+        elif task_status in FINISHED_STATUSES:
+            # 任务结束后可以再次写入相同的任务
+            update["$unset"][TaskCollectionModel.active_dedupe_key] = ""
         result = self.collection.find_one_and_update(
             filter={"_id": ObjectId(task_id), "worker_id": worker_id, "status": TaskStatus.PROCESSING.value},
-            update={
-                "$set": {
-                    "status": task_status.value,
-                    "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "time_cost": time_cost
-                }
-            },
+            update=update,
             return_document=ReturnDocument.AFTER
         )
-        return result is not None
+        if result is None:
+            return False
+        self._publish(result)
+        self._on_task_finished(result, task_status)
+        return True
+
+    def _publish(self, task: dict):
+        if self.events is not None:
+            self.events.publish(task)
 
 
 task_manager = MongoTaskManager(
     mongo_client=MongoClient(service_config.storage.mongo_url),
     db=service_config.storage.mongo_db,
-    collection_name=service_config.task_queue_name
+    collection_name=service_config.task_queue_name,
+    notifier=task_wakeup if TASK_DISPATCH_ENABLED else None,
+    events=task_events if TASK_EVENTS_ENABLED else None
 )
\ No newline at end of file
@@ -21,7 +21,7 @@ class TestReportAPI(unittest.TestCase):
         # 重置mock
         task_manager.add_task = MagicMock()
         dialog_manager.upsert_message = MagicMock()
-        task_manager.get_by_task_id = MagicMock()
+        task_manager.get_by_task_ids = MagicMock()
 
     def test_submit_report_success(self):
         # 测试正常提交报告
@@ -97,7 +97,7 @@ class TestReportAPI(unittest.TestCase):
         }
         
         # Mock task_manager返回任务
-        task_manager.get_by_task_id.return_value = test_task
+        task_manager.get_by_task_ids.return_value = [test_task]
         
         response = client.get("/api/check_report_process?report_id=task_123")
         print(f"response: {response.json()}")
@@ -108,7 +108,7 @@ class TestReportAPI(unittest.TestCase):
 
     def test_check_report_process_not_found(self):
         # 测试查询不存在的任务
-        task_manager.get_by_task_id.return_value = None
+        task_manager.get_by_task_ids.return_value = [None]
         
         response = client.get("/api/check_report_process?report_id=invalid_id")
         print(f"response: {response.json()}")
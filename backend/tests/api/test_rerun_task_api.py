@@ -0,0 +1,63 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import json
+import unittest
+from unittest.mock import MagicMock, patch, AsyncMock
+from mongomock import MongoClient
+from service.api.ai_doctor import doctor_console
+from service.repository.mongo_task_manager import MongoTaskManager, TaskStatus, task_dedupe_key
+
+
+class TestRerunTaskApi(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.task_manager = MongoTaskManager(mongo_client=MongoClient(), db="test_db", collection_name="test_tasks")
+        self.task_manager.collection.create_index(
+            "active_dedupe_key", unique=True, partialFilterExpression={"active_dedupe_key": {"$exists": True}})
+        self.patcher = patch.object(doctor_console, "task_manager", self.task_manager)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    async def rerun(self, task_id):
+        request = MagicMock()
+        request.json = AsyncMock(return_value={"task_id": task_id})
+        response = await doctor_console.rerun_task(request)
+        return json.loads(response.body)
+
+    async def test_rerun_finished_task(self):
+        task_id = self.task_manager.add_task("generate_treatment", {"treatment_id": "t1"})
+        self.task_manager.update_task_status(task_id, TaskStatus.FAIL)
+        self.assertEqual((await self.rerun(task_id))["code"], 0)
+        self.assertEqual(self.task_manager.get_by_task_id(task_id)["status"], TaskStatus.PENDING.value)
+
+    async def test_rerun_running_task(self):
+        # 任务未结束时不重新执行，返回该任务
+        task_id = self.task_manager.add_task("generate_treatment", {"treatment_id": "t1"})
+        self.assertTrue(self.task_manager.acquire_lock(task_id, "worker1"))
+        body = await self.rerun(task_id)
+        self.assertNotEqual(body["code"], 0)
+        self.assertEqual(body["data"]["task_id"], task_id)
+        self.assertEqual(self.task_manager.get_by_task_id(task_id)["status"], TaskStatus.PROCESSING.value)
+
+    async def test_rerun_with_active_duplicate(self):
+        # 已经有相同的任务未结束时不重新执行，返回正在执行的任务
+        params = {"treatment_id": "t1", "with_diagnosis_info": False}
+        key = task_dedupe_key("summarize_history_data", params)
+        finished_id = self.task_manager.add_task("summarize_history_data", params, dedupe_key=key)
+        self.task_manager.update_task_status(finished_id, TaskStatus.COMPLETED)
+        active_id = self.task_manager.add_task("summarize_history_data", params, dedupe_key=key)
+
+        body = await self.rerun(finished_id)
+        self.assertNotEqual(body["code"], 0)
+        self.assertEqual(body["data"]["task_id"], active_id)
+        self.assertEqual(self.task_manager.get_by_task_id(finished_id)["status"], TaskStatus.COMPLETED.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
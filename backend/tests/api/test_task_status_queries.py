@@ -0,0 +1,94 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from mongomock import MongoClient
+from service.api import report
+from service.api.ai_doctor import doctor_console
+from service.api.stream_search import get_additional_info_from_id
+from service.repository.mongo_task_manager import task_manager, TaskStatus, WaitForTasks
+from worker.generate_first_electronic_report import generate_first_electronic_report
+
+
+class CountingCollection:
+    """记录对任务集合发出的查询次数"""
+    QUERY_METHODS = {"find", "find_one", "find_one_and_update", "aggregate", "count_documents"}
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.queries = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in self.QUERY_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self.queries += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class TestTaskStatusQueries(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.collection = MongoClient()["test_db"]["test_tasks"]
+        self.patcher = patch.object(task_manager, "collection", CountingCollection(self.collection))
+        self.counter = self.patcher.start()
+        # 三个报告：识别完成、识别中、识别失败
+        self.report_ids = []
+        for status, result in [(TaskStatus.COMPLETED, {"result": "血常规正常"}), (TaskStatus.PROCESSING, None), (TaskStatus.FAIL, None)]:
+            inserted = self.collection.insert_one({"task_type": "upload_report", "status": status.value, "result": result, "params": {}})
+            self.report_ids.append(str(inserted.inserted_id))
+        self.counter.queries = 0
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    async def test_check_report_process(self):
+        request = MagicMock()
+        request.query_params = {"report_id": ",".join(reversed(self.report_ids))}
+        response = await report.check_report_process(request, requester=MagicMock())
+
+        self.assertEqual(self.counter.queries, 1)
+        result = json.loads(response.body)["data"]["result"]
+        self.assertEqual([item["report_id"] for item in result], list(reversed(self.report_ids)))
+        self.assertEqual([item["status"] for item in result], ["fail", "processing", "completed"])
+
+    async def test_get_patient_appendix(self):
+        dialog = [{"content": {"type": "report", "task_id": report_id}} for report_id in self.report_ids]
+        dialog.insert(1, {"content": "你好"})
+        request = MagicMock()
+        request.query_params = {"treatment_id": "treatment_id"}
+        with patch.object(doctor_console, "get_dialog_by_treatment_id", return_value=dialog):
+            response = await doctor_console.get_patient_appendix(request)
+
+        self.assertEqual(self.counter.queries, 1)
+        appendix_list = json.loads(response.body)["data"]["appendix_list"]
+        self.assertEqual([appendix["task_id"] for appendix in appendix_list], self.report_ids)
+        self.assertEqual([appendix["content"] for appendix in appendix_list],
+                         ["血常规正常", "报告解析失败，请查看报告原图", "报告解析失败，请查看报告原图"])
+
+    def test_get_additional_info_from_id(self):
+        self.assertEqual(get_additional_info_from_id(self.report_ids + ["invalid_id"]), "血常规正常")
+        self.assertEqual(self.counter.queries, 1)
+
+    def test_generate_first_electronic_report_waits_with_one_query(self):
+        chat_history = [{"role": "user", "content": "头痛"}]
+        chat_history += [{"appendix": True, "content": {"type": "report", "file_oss_key": "key", "task_id": report_id}}
+                         for report_id in self.report_ids]
+        with patch("worker.generate_first_electronic_report.get_ai_doctor_chat_history", return_value=(chat_history, False)):
+            result = generate_first_electronic_report("task_id", {"dialog_id": "dialog_id", "treatment_id": "treatment_id"})
+
+        self.assertIsInstance(result, WaitForTasks)
+        self.assertEqual(result.task_ids, [self.report_ids[1]])
+        self.assertEqual(self.counter.queries, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
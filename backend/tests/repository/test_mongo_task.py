@@ -7,12 +7,17 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 import unittest
+from unittest.mock import MagicMock
 from bson.objectid import ObjectId
 from mongomock import MongoClient
 from service.repository.mongo_task_manager import (
     MongoTaskManager,
-    TaskStatus
+    TaskStatus,
+    TaskGraph,
+    task_dedupe_key
 )
+from service.package.task_wakeup import TaskWakeup
+from service.config.config import TASK_DEFAULT_PRIORITY
 
 class TestMongoTaskManager(unittest.TestCase):
     def setUp(self):
@@ -179,5 +184,406 @@ class TestMongoTaskManager(unittest.TestCase):
         self.assertEqual(str(tasks[0]["_id"]), task_id)
         self.assertEqual(tasks[0]["status"], TaskStatus.PENDING.value)
 
+    def test_claim_next_task_by_priority(self):
+        """测试按优先级原子获取任务
+        步骤：
+        1. 添加低优先级、高优先级和延迟任务
+        2. 多次获取任务
+        验证：
+        1. 先获取高优先级任务，同优先级按 check_time 先后
+        2. 获取到的任务状态为 processing，未到期的任务不会被获取
+        3. exclude_types 中的任务类型不会被获取
+        """
+        self.task_manager.priorities = {"upload_report": 0, "summarize_history_data": 5}
+        summary_id = self.task_manager.add_task("summarize_history_data", {})
+        delayed_id = self.task_manager.add_task("upload_report", {}, delay=60)
+        ocr_id = self.task_manager.add_task("upload_report", {})
+
+        self.assertIsNone(self.task_manager.claim_next_task("worker1", exclude_types=["upload_report", "summarize_history_data"]))
+        task = self.task_manager.claim_next_task("worker1")
+        self.assertEqual(task["task_id"], ocr_id)
+        self.assertEqual(task["status"], TaskStatus.PROCESSING.value)
+        self.assertEqual(task["worker_id"], "worker1")
+        self.assertEqual(self.task_manager.claim_next_task("worker2")["task_id"], summary_id)
+        self.assertIsNone(self.task_manager.claim_next_task("worker2"))
+        self.assertEqual(self.task_manager.get_by_task_id(delayed_id)["status"], TaskStatus.PENDING.value)
+
+    def test_backfill_priorities_for_legacy_tasks(self):
+        """测试旧任务（没有 priority 字段）补充优先级后，按任务类型的优先级获取"""
+        self.task_manager.priorities = {"urgent": 0, "background": 5}
+        legacy = self.task_manager.collection.insert_one({
+            "task_type": "background",
+            "status": TaskStatus.PENDING.value,
+            "params": {},
+            "check_time": "2000-01-01 00:00:00",
+        })
+        legacy_unknown = self.task_manager.collection.insert_one({
+            "task_type": "unknown_type",
+            "status": TaskStatus.PENDING.value,
+            "params": {},
+            "check_time": "2000-01-01 00:00:00",
+        })
+        urgent_id = self.task_manager.add_task("urgent", {})
+
+        self.assertEqual(self.task_manager.backfill_priorities(), 2)
+        self.assertEqual(self.task_manager.get_by_task_id(str(legacy.inserted_id))["priority"], 5)
+        self.assertEqual(self.task_manager.get_by_task_id(str(legacy_unknown.inserted_id))["priority"], TASK_DEFAULT_PRIORITY)
+        # 旧任务不再排在优先级更高的任务之前
+        self.assertEqual(self.task_manager.claim_next_task("worker1")["task_id"], urgent_id)
+        self.assertEqual(self.task_manager.backfill_priorities(), 0)
+
+    def test_lease_renew_and_reap(self):
+        """测试任务租约的续约和回收
+        步骤：
+        1. 获取两个任务，其中一个持续续约
+        2. 租约过期后回收
+        验证：
+        1. 续约的任务不会被回收
+        2. 未续约的任务放回队列，执行次数达到上限后标记为失败
+        """
+        self.task_manager.lease_seconds = 0.2
+        alive_id = self.task_manager.add_task("test_type", {})
+        orphan_id = self.task_manager.add_task("test_type", {})
+        notifier = MagicMock()
+        self.task_manager.notifier = notifier
+        self.assertTrue(self.task_manager.acquire_lock(alive_id, "worker1"))
+        self.assertTrue(self.task_manager.acquire_lock(orphan_id, "worker2"))
+        time.sleep(0.1)
+        self.assertEqual(self.task_manager.renew_leases([alive_id], "worker1"), 1)
+        self.assertEqual(self.task_manager.renew_leases([orphan_id], "worker1"), 0)
+        time.sleep(0.15)
+
+        self.assertEqual(self.task_manager.reap_expired_tasks(max_attempts=2), [("test_type", TaskStatus.PENDING)])
+        self.assertEqual(self.task_manager.get_by_task_id(alive_id)["status"], TaskStatus.PROCESSING.value)
+        orphan = self.task_manager.get_by_task_id(orphan_id)
+        self.assertEqual(orphan["status"], TaskStatus.PENDING.value)
+        self.assertNotIn("worker_id", orphan)
+        # 等待时间从回收时开始计算，并立即唤醒其他 worker
+        self.assertGreater(orphan["ready_at"], time.time() - 0.1)
+        notifier.notify.assert_called_once_with(orphan_id, 0)
+        # 原来的 worker 不能再释放被回收的任务
+        self.assertFalse(self.task_manager.release_lock(orphan_id, "worker2", TaskStatus.COMPLETED))
+
+        # 第二次执行仍然没有续约，达到执行次数上限
+        self.assertTrue(self.task_manager.acquire_lock(orphan_id, "worker3"))
+        time.sleep(0.25)
+        self.task_manager.renew_leases([alive_id], "worker1")
+        self.assertEqual(self.task_manager.reap_expired_tasks(max_attempts=2), [("test_type", TaskStatus.FAIL)])
+        orphan = self.task_manager.get_by_task_id(orphan_id)
+        self.assertEqual(orphan["status"], TaskStatus.FAIL.value)
+        self.assertEqual(orphan["attempts"], 2)
+
+    def test_reap_legacy_task_without_lease(self):
+        """测试引入租约之前由已经退出的 worker 获取的任务（没有 lease_expires_at）在一个租约期后被回收"""
+        self.task_manager.lease_seconds = 0.1
+        legacy = self.task_manager.collection.insert_one({
+            "task_type": "test_type",
+            "status": TaskStatus.PROCESSING.value,
+            "worker_id": "old_worker",
+            "params": {},
+            "check_time": "2000-01-01 00:00:00",
+        })
+        task_id = str(legacy.inserted_id)
+
+        # 第一次回收时补充租约，不立即回收
+        self.assertEqual(self.task_manager.reap_expired_tasks(), [])
+        self.assertIn("lease_expires_at", self.task_manager.get_by_task_id(task_id))
+        time.sleep(0.15)
+        self.assertEqual(self.task_manager.reap_expired_tasks(), [("test_type", TaskStatus.PENDING)])
+        task = self.task_manager.get_by_task_id(task_id)
+        self.assertEqual(task["status"], TaskStatus.PENDING.value)
+        self.assertNotIn("worker_id", task)
+
+    def test_requeue_not_counted_as_attempt(self):
+        task_id = self.task_manager.add_task("test_type", {})
+        self.assertEqual(self.task_manager.claim_next_task("worker1")["attempts"], 1)
+        self.assertTrue(self.task_manager.release_lock(task_id, "worker1", TaskStatus.PENDING))
+        self.assertEqual(self.task_manager.get_by_task_id(task_id)["attempts"], 0)
+
+    def test_retry_task(self):
+        """测试失败的任务延迟重试
+        验证：
+        1. 任务放回队列，到期前不会被获取，执行次数保留
+        2. 发送延迟唤醒通知
+        3. 不持有锁的 worker 不能重新调度
+        """
+        notifier = MagicMock()
+        self.task_manager.notifier = notifier
+        task_id = self.task_manager.add_task("test_type", {})
+        self.assertEqual(self.task_manager.claim_next_task("worker1")["attempts"], 1)
+        self.assertFalse(self.task_manager.retry_task(task_id, "worker2", 30))
+        self.assertTrue(self.task_manager.retry_task(task_id, "worker1", 30, error="ConnectionError()"))
+        notifier.notify.assert_called_with(task_id, 30)
+
+        task = self.task_manager.get_by_task_id(task_id)
+        self.assertEqual(task["status"], TaskStatus.PENDING.value)
+        self.assertEqual(task["attempts"], 1)
+        self.assertEqual(task["last_error"], "ConnectionError()")
+        self.assertNotIn("worker_id", task)
+        self.assertGreater(task["ready_at"], time.time() + 20)
+        self.assertIsNone(self.task_manager.claim_next_task("worker1"))
+
+    def test_task_graph_release(self):
+        """测试依赖图的扇出和汇合
+        步骤：
+        1. a -> (b, c) -> d
+        2. 依次完成 a、b、c
+        验证：
+        1. 只有没有依赖的任务可以获取
+        2. a 完成后 b、c 同时放入队列并发送唤醒通知
+        3. d 在最后一个依赖完成时才放入队列
+        """
+        notifier = MagicMock()
+        self.task_manager.notifier = notifier
+        graph = TaskGraph("test_pipeline")
+        a = graph.add("type_a", {})
+        b = graph.add("type_b", {}, depends_on=[a])
+        c = graph.add("type_c", {}, depends_on=[a])
+        d = graph.add("type_d", {}, depends_on=[b, c])
+        self.assertEqual(self.task_manager.submit_graph(graph), [a, b, c, d])
+        notifier.notify.assert_called_once_with(a, 0)
+        self.assertEqual(self.task_manager.get_by_task_id(d)["status"], TaskStatus.WAITING.value)
+        self.assertEqual(self.task_manager.get_by_task_id(d)["pipeline_id"], graph.pipeline_id)
+
+        self.assertEqual(self.task_manager.claim_next_task("worker1")["task_id"], a)
+        self.assertIsNone(self.task_manager.claim_next_task("worker1"))
+        self.assertTrue(self.task_manager.release_lock(a, "worker1", TaskStatus.COMPLETED))
+        notifier.notify.assert_any_call(b, 0)
+        notifier.notify.assert_any_call(c, 0)
+
+        claimed = {self.task_manager.claim_next_task("worker1")["task_id"], self.task_manager.claim_next_task("worker2")["task_id"]}
+        self.assertEqual(claimed, {b, c})
+        self.assertTrue(self.task_manager.release_lock(b, "worker1", TaskStatus.COMPLETED))
+        self.assertEqual(self.task_manager.get_by_task_id(d)["status"], TaskStatus.WAITING.value)
+        self.assertTrue(self.task_manager.release_lock(c, "worker2", TaskStatus.COMPLETED))
+        self.assertEqual(self.task_manager.claim_next_task("worker1")["task_id"], d)
+
+        with self.assertRaises(ValueError):
+            graph.add("type_e", {}, depends_on=["unknown"])
+
+    def test_task_graph_cancel(self):
+        """测试依赖失败后取消所有下游任务，重试不影响下游"""
+        graph = TaskGraph("test_pipeline")
+        a = graph.add("type_a", {})
+        b = graph.add("type_b", {}, depends_on=[a])
+        c = graph.add("type_c", {}, depends_on=[b])
+        self.task_manager.submit_graph(graph)
+
+        self.task_manager.claim_next_task("worker1")
+        self.assertTrue(self.task_manager.retry_task(a, "worker1", 0))
+        self.assertEqual(self.task_manager.get_by_task_id(b)["status"], TaskStatus.WAITING.value)
+
+        self.task_manager.claim_next_task("worker1")
+        self.assertTrue(self.task_manager.release_lock(a, "worker1", TaskStatus.FAIL))
+        for task_id in (b, c):
+            self.assertEqual(self.task_manager.get_by_task_id(task_id)["status"], TaskStatus.CANCEL.value)
+        self.assertIsNone(self.task_manager.claim_next_task("worker1"))
+
+    def test_rerun_failed_upstream_resets_downstream(self):
+        """测试重新执行失败的上游任务后，被取消的下游任务重新等待并依次执行"""
+        notifier = MagicMock()
+        self.task_manager.notifier = notifier
+        graph = TaskGraph("test_pipeline")
+        a = graph.add("type_a", {})
+        b = graph.add("type_b", {}, depends_on=[a])
+        c = graph.add("type_c", {}, depends_on=[b])
+        d = graph.add("type_d", {}, depends_on=[b])
+        self.task_manager.submit_graph(graph)
+        self.task_manager.claim_next_task("worker1")
+        self.assertTrue(self.task_manager.release_lock(a, "worker1", TaskStatus.FAIL))
+        self.assertEqual(self.task_manager.get_by_task_id(c)["status"], TaskStatus.CANCEL.value)
+
+        self.assertTrue(self.task_manager.rerun_task(a))
+        notifier.notify.assert_called_with(a, 0)
+        for task_id in (b, c, d):
+            task = self.task_manager.get_by_task_id(task_id)
+            self.assertEqual((task["status"], task["pending_dependencies"]), (TaskStatus.WAITING.value, 1))
+
+        for expected in ([a], [b], [c, d]):
+            claimed = []
+            while True:
+                task = self.task_manager.claim_next_task("worker1")
+                if task is None:
+                    break
+                claimed.append(task["task_id"])
+            self.assertEqual(sorted(claimed), sorted(expected))
+            for task_id in claimed:
+                self.assertTrue(self.task_manager.release_lock(task_id, "worker1", TaskStatus.COMPLETED))
+
+    def test_rerun_completed_node_regenerates_downstream(self):
+        """测试重新执行已经完成的诊断后，处置方案重新生成，其他分支的依赖按当前状态计算"""
+        graph = TaskGraph("test_pipeline")
+        a = graph.add("type_a", {})
+        b = graph.add("type_b", {}, depends_on=[a])
+        c = graph.add("type_c", {}, depends_on=[a, b])
+        self.task_manager.submit_graph(graph)
+        for task_id in (a, b, c):
+            self.assertEqual(self.task_manager.claim_next_task("worker1")["task_id"], task_id)
+            self.assertTrue(self.task_manager.release_lock(task_id, "worker1", TaskStatus.COMPLETED))
+
+        self.assertTrue(self.task_manager.rerun_task(b))
+        # a 没有重新执行，c 只等待 b
+        task = self.task_manager.get_by_task_id(c)
+        self.assertEqual((task["status"], task["pending_dependencies"]), (TaskStatus.WAITING.value, 1))
+        self.assertEqual(self.task_manager.get_by_task_id(a)["status"], TaskStatus.COMPLETED.value)
+        self.assertEqual(self.task_manager.claim_next_task("worker1")["task_id"], b)
+        self.assertTrue(self.task_manager.release_lock(b, "worker1", TaskStatus.COMPLETED))
+        self.assertEqual(self.task_manager.claim_next_task("worker1")["task_id"], c)
+
+    def test_wait_for_tasks(self):
+        """测试任务等待其他任务结束
+        步骤：
+        1. 电子病历任务等待两个报告识别任务，其中一个已经完成
+        2. 取消另一个报告识别任务
+        验证：
+        1. 等待期间任务为 waiting，不能被获取，不计入执行次数
+        2. 最后一个报告结束（包括取消）时重新放入队列
+        """
+        done_id = self.task_manager.add_task("upload_report", {})
+        report_id = self.task_manager.add_task("upload_report", {})
+        report_task_id = self.task_manager.add_task("generate_first_electronic_report", {})
+        self.task_manager.update_task_status(done_id, TaskStatus.COMPLETED)
+        self.assertTrue(self.task_manager.acquire_lock(report_task_id, "worker1"))
+
+        self.assertFalse(self.task_manager.wait_for_tasks(report_task_id, "worker2", [report_id]))
+        self.assertTrue(self.task_manager.wait_for_tasks(report_task_id, "worker1", [report_id, done_id]))
+        task = self.task_manager.get_by_task_id(report_task_id)
+        self.assertEqual(task["status"], TaskStatus.WAITING.value)
+        self.assertEqual(task["pending_dependencies"], 1)
+        self.assertEqual(task["attempts"], 0)
+        self.assertEqual(self.task_manager.get_by_task_id(report_id)["waiters"], [report_task_id])
+
+        self.task_manager.update_task_status(report_id, TaskStatus.CANCEL)
+        self.assertEqual(self.task_manager.get_by_task_id(report_task_id)["status"], TaskStatus.PENDING.value)
+
+    def test_rerun_dependency_releases_waiter_once(self):
+        """测试等待的报告重新识别后再次结束，不会再次减少电子病历的依赖数"""
+        first_id = self.task_manager.add_task("upload_report", {})
+        second_id = self.task_manager.add_task("upload_report", {})
+        report_task_id = self.task_manager.add_task("generate_first_electronic_report", {})
+        self.assertTrue(self.task_manager.acquire_lock(report_task_id, "worker1"))
+        self.assertTrue(self.task_manager.wait_for_tasks(report_task_id, "worker1", [first_id, second_id]))
+
+        self.task_manager.update_task_status(first_id, TaskStatus.COMPLETED)
+        self.assertNotIn("waiters", self.task_manager.get_by_task_id(first_id))
+        self.assertTrue(self.task_manager.rerun_task(first_id))
+        self.assertTrue(self.task_manager.acquire_lock(first_id, "worker2"))
+        self.assertTrue(self.task_manager.release_lock(first_id, "worker2", TaskStatus.COMPLETED))
+        task = self.task_manager.get_by_task_id(report_task_id)
+        self.assertEqual((task["status"], task["pending_dependencies"]), (TaskStatus.WAITING.value, 1))
+
+        self.task_manager.update_task_status(second_id, TaskStatus.COMPLETED)
+        self.assertEqual(self.task_manager.get_by_task_id(report_task_id)["status"], TaskStatus.PENDING.value)
+
+    def test_wait_for_task_completed_by_worker(self):
+        """测试等待的任务由 worker 执行完成时放入队列"""
+        report_id = self.task_manager.add_task("upload_report", {})
+        report_task_id = self.task_manager.add_task("generate_first_electronic_report", {})
+        self.assertTrue(self.task_manager.acquire_lock(report_task_id, "worker1"))
+        self.assertTrue(self.task_manager.acquire_lock(report_id, "worker2"))
+        self.assertTrue(self.task_manager.wait_for_tasks(report_task_id, "worker1", [report_id]))
+        self.assertIsNone(self.task_manager.claim_next_task("worker1"))
+
+        self.assertTrue(self.task_manager.release_lock(report_id, "worker2", TaskStatus.COMPLETED))
+        self.assertEqual(self.task_manager.claim_next_task("worker1")["task_id"], report_task_id)
+
+    def test_get_by_task_ids(self):
+        """测试批量获取任务：按请求顺序返回，不存在或无效的任务ID为 None，只返回需要的字段"""
+        first_id = self.task_manager.add_task("type_a", {"param": "a"})
+        second_id = self.task_manager.add_task("type_b", {"param": "b"})
+        missing_id = str(ObjectId())
+        tasks = self.task_manager.get_by_task_ids([second_id, missing_id, "invalid_id", first_id], projection={"status": 1})
+        self.assertEqual([task and task["_id"] for task in tasks], [second_id, None, None, first_id])
+        self.assertEqual(tasks[0], {"_id": second_id, "status": TaskStatus.PENDING.value})
+        self.assertEqual(self.task_manager.get_by_task_ids([]), [])
+
+    def test_queue_stats(self):
+        """测试队列统计：按任务类型统计待处理（区分已到期和等待重试）、执行中的任务数和最早到期时间"""
+        before = time.time()
+        first_id = self.task_manager.add_task("type_a", {})
+        self.task_manager.add_task("type_a", {}, delay=60)
+        self.task_manager.add_task("type_b", {})
+        self.task_manager.acquire_lock(self.task_manager.add_task("type_b", {}), "worker_1")
+        self.task_manager.update_task_status(self.task_manager.add_task("type_c", {}), TaskStatus.COMPLETED)
+
+        stats = self.task_manager.queue_stats()
+        self.assertEqual(set(stats), {"type_a", "type_b"})
+        self.assertEqual((stats["type_a"]["pending"], stats["type_a"]["ready"], stats["type_a"]["processing"]), (2, 1, 0))
+        self.assertEqual((stats["type_b"]["pending"], stats["type_b"]["ready"], stats["type_b"]["processing"]), (1, 1, 1))
+        first_ready_at = self.task_manager.get_by_task_id(first_id)["ready_at"]
+        self.assertEqual(stats["type_a"]["oldest_ready_at"], first_ready_at)
+        self.assertGreaterEqual(first_ready_at, before)
+
+    def test_add_task_dedupe(self):
+        """测试去重：相同去重键的任务未结束时返回已有任务，结束后可以再次写入"""
+        self.task_manager.collection.create_index(
+            "active_dedupe_key", unique=True, partialFilterExpression={"active_dedupe_key": {"$exists": True}})
+        params = {"treatment_id": "t1", "with_diagnosis_info": False}
+        key = task_dedupe_key("summarize_history_data", params)
+        self.assertEqual(key, task_dedupe_key("summarize_history_data", dict(reversed(list(params.items())))))
+        self.assertNotEqual(key, task_dedupe_key("summarize_history_data", {"treatment_id": "t1", "with_diagnosis_info": True}))
+        self.assertEqual(task_dedupe_key("generate_treatment", {"treatment_id": "t1", "treatment_plan_id": "a"}, ignore=("treatment_plan_id",)),
+                         task_dedupe_key("generate_treatment", {"treatment_id": "t1", "treatment_plan_id": "b"}, ignore=("treatment_plan_id",)))
+
+        first_id = self.task_manager.add_task("summarize_history_data", params, dedupe_key=key)
+        # 执行中的任务同样去重
+        self.assertTrue(self.task_manager.acquire_lock(first_id, "worker_1"))
+        self.assertEqual(self.task_manager.add_task("summarize_history_data", params, dedupe_key=key), first_id)
+        self.assertNotEqual(self.task_manager.add_task("summarize_history_data", params), first_id)
+        self.assertEqual(self.task_manager.collection.count_documents({}), 2)
+
+        # 已有任务之前的查询没有发现时，由唯一索引去重
+        original_find_active = self.task_manager._find_active
+        calls = []
+        def find_active_after_insert(dedupe_key, projection=None):
+            calls.append(dedupe_key)
+            return None if len(calls) == 1 else original_find_active(dedupe_key, projection)
+        self.task_manager._find_active = find_active_after_insert
+        self.assertEqual(self.task_manager.add_task("summarize_history_data", params, dedupe_key=key), first_id)
+        del self.task_manager._find_active
+
+        self.assertTrue(self.task_manager.release_lock(first_id, "worker_1", TaskStatus.COMPLETED))
+        self.assertNotIn("active_dedupe_key", self.task_manager.get_by_task_id(first_id))
+        second_id = self.task_manager.add_task("summarize_history_data", params, dedupe_key=key)
+        self.assertNotEqual(second_id, first_id)
+
+        # 相同的任务未结束时不能重新执行已经结束的任务
+        self.assertFalse(self.task_manager.rerun_task(first_id))
+        self.assertFalse(self.task_manager.rerun_task(second_id))
+        self.task_manager.update_task_status(second_id, TaskStatus.CANCEL)
+        self.assertTrue(self.task_manager.rerun_task(first_id))
+        task = self.task_manager.get_by_task_id(first_id)
+        self.assertEqual((task["status"], task["active_dedupe_key"], task["attempts"]), (TaskStatus.PENDING.value, key, 0))
+
+    def test_submit_graph_dedupe(self):
+        """测试依赖图去重：第一个任务相同的依赖图未结束时返回已有依赖图的任务ID，不写入新的任务"""
+        def build_graph():
+            graph = TaskGraph("pipeline")
+            root = graph.add("type_a", {"treatment_id": "t1"})
+            graph.add("type_b", {"treatment_id": "t1"}, depends_on=[root])
+            return graph
+
+        first = self.task_manager.submit_graph(build_graph(), dedupe_key="type_a:t1")
+        second = self.task_manager.submit_graph(build_graph(), dedupe_key="type_a:t1")
+        self.assertEqual(second, first)
+        self.assertEqual(self.task_manager.collection.count_documents({}), 2)
+        # 只有第一个任务带去重键
+        self.assertIsNone(self.task_manager.get_by_task_id(first[1]).get("dedupe_key"))
+
+    def test_add_task_notify(self):
+        """测试添加任务后发送唤醒通知
+        验证：
+        1. 通知携带任务ID和延迟时间
+        2. 通知失败不影响任务写入
+        """
+        notifier = MagicMock()
+        self.task_manager.notifier = notifier
+        task_id = self.task_manager.add_task("test_type", {"param": "value"}, delay=3)
+        notifier.notify.assert_called_once_with(task_id, 3)
+
+        self.task_manager.notifier = TaskWakeup(client_factory=MagicMock(side_effect=ConnectionError("no redis")))
+        task_id = self.task_manager.add_task("test_type", {"param": "value"})
+        self.assertEqual(self.task_manager.get_by_task_id(task_id)["status"], TaskStatus.PENDING.value)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,122 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import json
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from util.stream.answer_cache import AnswerCache
+from util.stream.response_queue import ResponseQueue
+from util.stream.stream_search_model import StreamSearchData
+from util.tracker.stream_search_tracker import StreamingSearchTracker
+
+
+def build_model_query(query, history=None, sources=None, config=None):
+    chat_history = list(history or [])
+    chat_history.append({"role": "user", "content": query})
+    return {"config": config or {}, "sources": sources or [], "chat_history": chat_history}
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_normalized_query(self):
+        key = AnswerCache.fingerprint(build_model_query("感冒了怎么办？"), False, None)
+        self.assertIsNotNone(key)
+        self.assertEqual(key, AnswerCache.fingerprint(build_model_query("  感冒了怎么办 "), False, None))
+        self.assertEqual(key, AnswerCache.fingerprint(build_model_query("感冒了怎么办?"), None, None))
+        self.assertNotEqual(key, AnswerCache.fingerprint(build_model_query("感冒了怎么办"), True, None))
+        self.assertNotEqual(key, AnswerCache.fingerprint(build_model_query("感冒了怎么办", sources=[{"index": "health-guideline"}]), False, None))
+
+    def test_not_cacheable(self):
+        history = [{"role": "user", "content": "头疼"}, {"role": "assistant", "content": "多休息"}]
+        self.assertIsNone(AnswerCache.fingerprint(build_model_query("还有呢", history=history), False, None))
+        self.assertIsNone(AnswerCache.fingerprint(build_model_query("新闻", config={"bing_searcher_config": {"enabled": True}}), False, None))
+        self.assertIsNone(AnswerCache.fingerprint(build_model_query("我的文档", sources=[{"type": "private", "kb_key": "u1"}]), False, None))
+        model_query = build_model_query("查体")
+        model_query["physical_choice"] = {}
+        self.assertIsNone(AnswerCache.fingerprint(model_query, False, None))
+
+
+class TestAnswerCache(unittest.IsolatedAsyncioTestCase):
+
+    def build_queue(self):
+        tracker = StreamingSearchTracker(MagicMock())
+        return ResponseQueue(next_action=lambda item: item,
+                             error_action=lambda error: StreamSearchData.build_from_error("", {}),
+                             complete_action=tracker.untrack,
+                             tracker=tracker,
+                             coalesce_window_ms=0)
+
+    async def generate(self, response_queue, error=False):
+        response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Received).message_id("m1").build())
+        for token in ["多", "喝", "水"]:
+            response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, token))
+            await asyncio.sleep(0.01)
+        if error:
+            response_queue.put(StreamSearchData.build_from_error("", {}))
+        response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Finished).build())
+        response_queue.put(None)
+
+    async def collect(self, response_queue):
+        events = []
+        async for packet in response_queue.subscribe():
+            events.append(json.loads(packet.decode("utf-8")[len("data: "):]))
+        return events
+
+    async def test_record_and_replay(self):
+        cache = AnswerCache(max_entries=4, ttl=60)
+        response_queue = self.build_queue()
+        response_queue.record_to(cache.recorder("key"))
+        asyncio.create_task(self.generate(response_queue))
+        original = await self.collect(response_queue)
+
+        cached_events = cache.get("key")
+        self.assertIsNotNone(cached_events)
+        # received 每次由接口生成，不缓存
+        self.assertNotIn(StreamSearchData.SearchEvent.Received, [item.event for _, item in cached_events])
+
+        replay_queue = self.build_queue()
+        start = time.monotonic()
+        asyncio.create_task(cache.replay(cached_events, replay_queue, speed=4, max_interval=0.05))
+        replayed = await self.collect(replay_queue)
+        self.assertLess(time.monotonic() - start, 0.03)
+        self.assertEqual(replayed, original[1:])
+        self.assertEqual(replay_queue._tracker._streaming_search_data["answer_with_cite"], "多喝水")
+
+    async def test_error_not_cached(self):
+        cache = AnswerCache(max_entries=4, ttl=60)
+        response_queue = self.build_queue()
+        response_queue.record_to(cache.recorder("key"))
+        asyncio.create_task(self.generate(response_queue, error=True))
+        await self.collect(response_queue)
+        self.assertIsNone(cache.get("key"))
+
+    async def test_lru_and_ttl(self):
+        cache = AnswerCache(max_entries=2, ttl=60)
+        cache.set("a", [])
+        cache.set("b", [])
+        cache.get("a")
+        cache.set("c", [])
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+        cache = AnswerCache(max_entries=2, ttl=-1)
+        cache.set("a", [])
+        self.assertIsNone(cache.get("a"))
+
+    async def test_invalidate_without_redis(self):
+        cache = AnswerCache(max_entries=2, ttl=60)
+        with patch("util.stream.answer_cache.PubSubClient", side_effect=ConnectionError("no redis")):
+            await cache.start()
+        cache.set("a", [])
+        await cache.invalidate()
+        self.assertIsNone(cache.get("a"))
+        await cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
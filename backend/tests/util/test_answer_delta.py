@@ -0,0 +1,49 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import unittest
+from unittest.mock import MagicMock
+from util.stream.answer_delta import AnswerDelta
+from util.stream.stream_search_model import StreamSearchData
+from util.tracker.stream_search_tracker import StreamingSearchTracker
+
+
+class TestAnswerDelta(unittest.TestCase):
+
+    def test_cumulative_answer(self):
+        answer_delta = AnswerDelta()
+        self.assertEqual(answer_delta.next({}, "感"), "感")
+        self.assertEqual(answer_delta.next({}, "感冒"), "冒")
+        # 没有回答内容时不输出
+        self.assertEqual(answer_delta.next({}, None), "")
+        self.assertEqual(answer_delta.next({}, "感冒了"), "了")
+
+    def test_delta_from_upstream(self):
+        answer_delta = AnswerDelta()
+        self.assertEqual(answer_delta.next({"delta": "感冒"}, None), "感冒")
+        self.assertEqual(answer_delta.next({"delta": "了", "answer": "感冒了"}, "感冒了"), "了")
+        # 之后的事件退回累计回答时，仍能接上
+        self.assertEqual(answer_delta.next({}, "感冒了吗"), "吗")
+
+
+class TestTrackerAnswer(unittest.TestCase):
+
+    def test_join_answer_on_store(self):
+        dialog_manager = MagicMock()
+        tracker = StreamingSearchTracker(dialog_manager)
+        tracker.track(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Received).query("q").build())
+        for token in ["多", "喝", "水"]:
+            tracker.track(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Answering).answer(token).build())
+        tracker.track(None)
+        tracker.store_message("dialog_id", "message_id", [], "domain")
+
+        saved = dialog_manager.upsert_message.call_args[0][0]
+        self.assertEqual(saved["query"], "q")
+        self.assertEqual(saved["answer"], "多喝水")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import threading
+import unittest
+from aiohttp import web
+from util.http_pool import HttpSessionPool
+
+
+class TestHttpSessionPool(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.pool = HttpSessionPool(limit=10, limit_per_host=2)
+        await self.pool.start()
+
+        async def handler(request):
+            return web.json_response({"ok": True})
+
+        app = web.Application()
+        app.router.add_get("/ping", handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/ping"
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        await self.runner.cleanup()
+
+    async def test_reuse_connection_on_owner_loop(self):
+        for _ in range(3):
+            async with self.pool.session() as session:
+                self.assertIs(session, self.pool.shared_session())
+                async with session.get(self.url) as rsp:
+                    self.assertEqual((await rsp.json())["ok"], True)
+
+        # 三次请求复用同一个 keepalive 连接
+        stats = self.pool.stats()
+        self.assertEqual(stats["acquired"], 0)
+        self.assertEqual(stats["idle"], 1)
+        self.assertEqual(stats["limit"], 10)
+
+    async def test_other_loop_uses_temporary_session(self):
+        result = {}
+
+        async def call():
+            async with self.pool.session() as session:
+                result["shared"] = session is self.pool._session
+                async with session.get(self.url) as rsp:
+                    result["status"] = rsp.status
+            result["closed"] = session.closed
+
+        thread = threading.Thread(target=lambda: asyncio.run(call()))
+        thread.start()
+        await asyncio.get_running_loop().run_in_executor(None, thread.join)
+
+        self.assertFalse(result["shared"])
+        self.assertEqual(result["status"], 200)
+        self.assertTrue(result["closed"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+from service.question_recommend.question_recommend import QuestionRecommendTask, QuestionRecommendCache
+
+
+class TestQuestionRecommendTask(unittest.IsolatedAsyncioTestCase):
+
+    async def test_ready_result(self):
+        async def fake_post(url, json, timeout):
+            return {"data": {"dial_questions": ["多喝水有用吗"]}}
+
+        with patch("service.question_recommend.question_recommend.async_post", fake_post):
+            task = QuestionRecommendTask(cache=QuestionRecommendCache(ttl=0))
+            task.start(chat_history=[], reference=[], query_rewrite="感冒怎么办")
+            self.assertEqual(await task.result(finish_wait=1), {"dial_questions": ["多喝水有用吗"]})
+
+    async def test_late_result_dropped(self):
+        async def slow_post(url, json, timeout):
+            await asyncio.sleep(10)
+            return {"data": {"dial_questions": ["太晚了"]}}
+
+        with patch("service.question_recommend.question_recommend.async_post", slow_post):
+            task = QuestionRecommendTask(cache=QuestionRecommendCache(ttl=0))
+            task.start(chat_history=[], reference=[], query_rewrite="感冒怎么办")
+            start = time.monotonic()
+            self.assertEqual(await task.result(finish_wait=0.05), {})
+            self.assertLess(time.monotonic() - start, 0.5)
+            await asyncio.sleep(0)
+            self.assertTrue(task._task.cancelled())
+
+    async def test_error_and_not_started(self):
+        async def failed_post(url, json, timeout):
+            raise ConnectionError("recommender down")
+
+        with patch("service.question_recommend.question_recommend.async_post", failed_post):
+            task = QuestionRecommendTask(cache=QuestionRecommendCache(ttl=0))
+            self.assertEqual(await task.result(), {})
+            task.start(chat_history=[], reference=[], query_rewrite="感冒怎么办")
+            self.assertEqual(await task.result(finish_wait=1), {})
+
+    async def test_null_data(self):
+        async def null_post(url, json, timeout):
+            return {"data": None}
+
+        with patch("service.question_recommend.question_recommend.async_post", null_post):
+            task = QuestionRecommendTask(cache=QuestionRecommendCache(ttl=0))
+            task.start(chat_history=[], reference=[], query_rewrite="感冒怎么办")
+            self.assertEqual(await task.result(finish_wait=1), {})
+
+    async def test_cache_reuse(self):
+        calls = []
+
+        async def fake_post(url, json, timeout):
+            calls.append(json)
+            return {"data": {"rag_questions": ["什么是感冒"]}}
+
+        cache = QuestionRecommendCache(max_entries=4, ttl=60)
+        reference = [{"index": "health-guideline", "doc_id": 1, "content": "感冒"}]
+        with patch("service.question_recommend.question_recommend.async_post", fake_post):
+            for history in ([], [{"role": "user", "content": "感冒"}]):
+                task = QuestionRecommendTask(cache=cache)
+                task.start(chat_history=history, reference=reference)
+                self.assertEqual(await task.result(finish_wait=1), {"rag_questions": ["什么是感冒"]})
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
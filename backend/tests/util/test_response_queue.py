@@ -0,0 +1,319 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import json
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from util.stream.response_queue import ResponseQueue
+from util.stream.stream_search_model import StreamSearchData
+from util.tracker.stream_search_tracker import StreamingSearchTracker
+
+
+def parse_packets(packets):
+    return [json.loads(packet.decode("utf-8")[len("data: "):]) for packet in packets]
+
+
+class TestResponseQueue(unittest.IsolatedAsyncioTestCase):
+
+    def build_queue(self, coalesce_window_ms=0, coalesce_max_bytes=1024, maxsize=0, max_bytes=1024 * 1024, policy="block", is_disconnected=None):
+        tracker = StreamingSearchTracker(MagicMock())
+        return ResponseQueue(next_action=lambda item: item,
+                             error_action=lambda error: StreamSearchData.build_from_error("", {}),
+                             complete_action=tracker.untrack,
+                             tracker=tracker,
+                             is_disconnected=is_disconnected,
+                             coalesce_window_ms=coalesce_window_ms,
+                             coalesce_max_bytes=coalesce_max_bytes,
+                             maxsize=maxsize,
+                             max_bytes=max_bytes,
+                             policy=policy)
+
+    async def collect(self, response_queue):
+        return [packet async for packet in response_queue.subscribe()]
+
+    async def test_put_from_other_thread(self):
+        response_queue = self.build_queue()
+
+        def produce():
+            # 写入队列的回答是增量
+            for i in range(100):
+                response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Answering).answer(str(i)).build())
+            response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Finished).build())
+            response_queue.put(None)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        packets = parse_packets(await asyncio.wait_for(self.collect(response_queue), timeout=5))
+        producer.join()
+
+        answers = [packet["answer"] for packet in packets if packet["event"] == "answering"]
+        self.assertEqual("".join(answers), "".join(str(i) for i in range(100)))
+        self.assertEqual(packets[-1]["event"], "finished")
+        self.assertEqual(response_queue._tracker._streaming_search_data["answer_with_cite"], "".join(str(i) for i in range(100)))
+
+    async def test_put_from_owner_loop(self):
+        response_queue = self.build_queue()
+        response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Received).query("q").build())
+        response_queue.put(None)
+
+        packets = parse_packets(await asyncio.wait_for(self.collect(response_queue), timeout=5))
+        self.assertEqual(packets[0]["event"], "received")
+        self.assertEqual(packets[0]["query"], "q")
+
+    async def test_cross_thread_puts_are_batched(self):
+        response_queue = self.build_queue()
+        response_queue._loop = MagicMock()
+
+        def produce():
+            for i in range(10):
+                response_queue.put(i)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        producer.join()
+
+        # 只唤醒一次事件循环，取走全部数据
+        response_queue._loop.call_soon_threadsafe.assert_called_once()
+        response_queue._drain_pending()
+        self.assertEqual(response_queue._queue.qsize(), 10)
+
+    async def test_coalesce_answer_tokens(self):
+        response_queue = self.build_queue(coalesce_window_ms=1000)
+        answering = StreamSearchData.SearchEvent.Answering
+        for token in ["多", "喝", "水"]:
+            response_queue.put(StreamSearchData.build_answer(answering, token))
+        # 带溯源信息的增量单独输出
+        response_queue.put(StreamSearchData.build_answer(answering, "。", {"source": "guideline"}))
+        response_queue.put(StreamSearchData.build_answer(answering, "休"))
+        response_queue.put(StreamSearchData.build_answer(answering, "息"))
+        response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Finished).build())
+        response_queue.put(None)
+
+        packets = parse_packets(await asyncio.wait_for(self.collect(response_queue), timeout=5))
+        answers = [packet["answer"] for packet in packets if packet["event"] == "answering"]
+        # 首 token 立即输出，之后的增量在其他事件到达前合并
+        self.assertEqual(answers, ["多", "喝水", "。", "休息"])
+        self.assertEqual(packets[-1]["event"], "finished")
+
+    async def test_coalesce_flush_on_window_and_size(self):
+        response_queue = self.build_queue(coalesce_window_ms=20, coalesce_max_bytes=6)
+        answering = StreamSearchData.SearchEvent.Answering
+        packets = []
+
+        async def consume():
+            async for packet in response_queue.subscribe():
+                packets.append(packet)
+
+        consumer = asyncio.create_task(consume())
+        for token in ["多", "喝"]:
+            response_queue.put(StreamSearchData.build_answer(answering, token))
+        await asyncio.sleep(0.2)
+        # 窗口结束后，没有新数据也会输出
+        self.assertEqual([packet["answer"] for packet in parse_packets(packets)], ["多", "喝"])
+
+        # 超过 6 字节立即输出
+        for token in ["水", "休", "息"]:
+            response_queue.put(StreamSearchData.build_answer(answering, token))
+        response_queue.put(None)
+        await asyncio.wait_for(consumer, timeout=5)
+        self.assertEqual([packet["answer"] for packet in parse_packets(packets)], ["多", "喝", "水休", "息"])
+
+    async def test_block_policy(self):
+        response_queue = self.build_queue(maxsize=3, policy=ResponseQueue.POLICY_BLOCK)
+        answering = StreamSearchData.SearchEvent.Answering
+        produced = []
+
+        async def produce():
+            for i in range(10):
+                response_queue.put(StreamSearchData.build_answer(answering, str(i)))
+                produced.append(i)
+                await response_queue.drain()
+            response_queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        await asyncio.sleep(0.05)
+        # 没有消费时，写入方停在队列上限
+        self.assertEqual(len(produced), 3)
+        self.assertFalse(producer.done())
+
+        packets = parse_packets(await asyncio.wait_for(self.collect(response_queue), timeout=5))
+        await producer
+        self.assertEqual("".join(packet["answer"] for packet in packets), "0123456789")
+        self.assertEqual(response_queue._depth, 0)
+        self.assertEqual(response_queue._bytes, 0)
+
+    async def test_block_policy_other_thread(self):
+        response_queue = self.build_queue(max_bytes=4, maxsize=100, policy=ResponseQueue.POLICY_BLOCK)
+        answering = StreamSearchData.SearchEvent.Answering
+        produced = []
+
+        def produce():
+            async def run():
+                for i in range(10):
+                    response_queue.put(StreamSearchData.build_answer(answering, "ab"))
+                    produced.append(i)
+                    await response_queue.drain()
+                response_queue.put(None)
+            asyncio.run(run())
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        await asyncio.sleep(0.1)
+        # 超过 4 字节之后写入线程阻塞
+        self.assertEqual(len(produced), 2)
+
+        packets = parse_packets(await asyncio.wait_for(self.collect(response_queue), timeout=5))
+        await asyncio.get_running_loop().run_in_executor(None, producer.join)
+        self.assertEqual("".join(packet["answer"] for packet in packets), "ab" * 10)
+
+    async def test_coalesce_policy(self):
+        response_queue = self.build_queue(maxsize=2, policy=ResponseQueue.POLICY_COALESCE)
+        answering = StreamSearchData.SearchEvent.Answering
+        for token in ["多", "喝", "水", "休", "息"]:
+            response_queue.put(StreamSearchData.build_answer(answering, token))
+        # 队列满之后的增量合并到最后一条
+        self.assertEqual(response_queue._queue.qsize(), 2)
+        response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Finished).build())
+        response_queue.put(None)
+
+        packets = parse_packets(await asyncio.wait_for(self.collect(response_queue), timeout=5))
+        self.assertEqual([packet["answer"] for packet in packets if packet["event"] == "answering"], ["多", "喝水休息"])
+        self.assertEqual(packets[-1]["event"], "finished")
+
+    async def test_drop_debug_policy(self):
+        response_queue = self.build_queue(maxsize=1, policy=ResponseQueue.POLICY_DROP_DEBUG)
+        response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, "多"))
+        response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Debug).debug({"recall": {}}).build())
+        response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, "喝水"))
+        response_queue.put(None)
+        # debug 被丢弃，其他数据放不进队列，等待消费
+        self.assertEqual(response_queue._queue.qsize(), 1)
+        self.assertEqual(len(response_queue._waiting), 2)
+
+        packets = parse_packets(await asyncio.wait_for(self.collect(response_queue), timeout=5))
+        self.assertEqual([packet["answer"] for packet in packets], ["多", "喝水"])
+
+    async def test_queue_never_exceeds_cap(self):
+        answering = StreamSearchData.SearchEvent.Answering
+        for policy in [ResponseQueue.POLICY_BLOCK, ResponseQueue.POLICY_COALESCE, ResponseQueue.POLICY_DROP_DEBUG]:
+            response_queue = self.build_queue(maxsize=3, policy=policy)
+            sizes = []
+            push = response_queue._push
+
+            def record_push(entry, push=push, response_queue=response_queue, sizes=sizes):
+                push(entry)
+                sizes.append(response_queue._queue.qsize())
+
+            response_queue._push = record_push
+            produced = []
+
+            async def produce(response_queue=response_queue, produced=produced):
+                for i in range(20):
+                    # 带溯源的回答不能合并，debug 只有 drop_debug 策略会丢弃
+                    if i % 3 == 0:
+                        item = StreamSearchData.build_answer(answering, str(i), {"cite_idx": [0]})
+                    elif i % 3 == 1:
+                        item = StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Debug).debug({"recall": {}}).build()
+                    else:
+                        item = StreamSearchData.build_answer(answering, str(i))
+                    response_queue.put(item)
+                    produced.append(i)
+                    await response_queue.drain()
+                response_queue.put(None)
+
+            producer = asyncio.create_task(produce())
+            await asyncio.sleep(0.05)
+            # 没有消费时，写入方停在无法合并或丢弃的数据上
+            self.assertLess(len(produced), 20, policy)
+            self.assertFalse(producer.done(), policy)
+
+            await asyncio.wait_for(self.collect(response_queue), timeout=5)
+            await producer
+            self.assertTrue(sizes, policy)
+            self.assertLessEqual(max(sizes), 3, policy)
+            self.assertEqual(response_queue._depth, 0)
+
+    async def test_disconnect_fallback(self):
+        response_queue = self.build_queue(maxsize=2, policy=ResponseQueue.POLICY_COALESCE)
+        response_queue._overflow_fallback = ResponseQueue.FALLBACK_DISCONNECT
+        answering = StreamSearchData.SearchEvent.Answering
+        response_queue.put(StreamSearchData.build_answer(answering, "多"))
+        response_queue.put(StreamSearchData.build_answer(answering, "喝"))
+        response_queue.put(StreamSearchData.build_answer(answering, "水"))
+        # 队列满且无法合并：断开流，之后写入的数据直接丢弃
+        response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Finished).build())
+        response_queue.put(StreamSearchData.build_answer(answering, "休息"))
+        self.assertTrue(response_queue._cancelled)
+        self.assertEqual(len(response_queue._waiting), 0)
+        await response_queue.drain()
+
+        packets = parse_packets(await asyncio.wait_for(self.collect(response_queue), timeout=5))
+        self.assertEqual([packet["answer"] for packet in packets], ["多", "喝水"])
+        self.assertEqual(response_queue._tracker._streaming_search_data["answer_with_cite"], "多喝水")
+
+    @patch("util.stream.response_queue.STREAM_DISCONNECT_CHECK_INTERVAL", 0.01)
+    async def test_cancel_on_disconnect(self):
+        disconnected = asyncio.Event()
+
+        async def is_disconnected():
+            return disconnected.is_set()
+
+        response_queue = self.build_queue(is_disconnected=is_disconnected)
+
+        async def generate():
+            while True:
+                response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, "多"))
+                await asyncio.sleep(0.005)
+
+        generation = asyncio.create_task(generate())
+        response_queue._tracker.bind_to_task(generation)
+        packets = []
+
+        async def consume():
+            async for packet in response_queue.subscribe():
+                packets.append(packet)
+                if len(packets) == 3:
+                    disconnected.set()
+
+        await asyncio.wait_for(consume(), timeout=5)
+        # 断开后算法请求被取消，已生成的部分回答保存下来
+        with self.assertRaises(asyncio.CancelledError):
+            await generation
+        saved = response_queue._tracker._streaming_search_data["answer_with_cite"]
+        self.assertGreaterEqual(len(saved), 3)
+        self.assertEqual(saved, "多" * len(saved))
+
+    async def test_untrack_task_on_other_thread(self):
+        tracker = StreamingSearchTracker(MagicMock())
+        started = threading.Event()
+        result = {}
+
+        def run():
+            async def generate():
+                tracker.bind_to_task(asyncio.current_task())
+                started.set()
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    result["cancelled"] = True
+                    raise
+            try:
+                asyncio.run(generate())
+            except asyncio.CancelledError:
+                pass
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        self.assertTrue(tracker.untrack())
+        await asyncio.get_running_loop().run_in_executor(None, thread.join, 5)
+        self.assertTrue(result.get("cancelled"))
+
+
+if __name__ == '__main__':
+    unittest.main()
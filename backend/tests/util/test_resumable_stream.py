@@ -0,0 +1,151 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import json
+import unittest
+from unittest.mock import MagicMock
+from util.stream.response_queue import ResponseQueue
+from redis.exceptions import ResponseError
+from util.stream.resumable_stream import LocalReplayBuffer, ResumableStream, ReplayStore
+from util.stream.stream_search_model import StreamSearchData
+from util.tracker.stream_search_tracker import StreamingSearchTracker
+
+
+def parse_frame(frame: bytes):
+    id_line, data_line = frame.decode("utf-8").split("\n")[:2]
+    return int(id_line[len("id: "):]), json.loads(data_line[len("data: "):])
+
+
+class FakeRedis:
+    """只实现 RedisReplayBuffer 用到的命令，xadd 与 Redis 一样要求 entry id 递增"""
+
+    def __init__(self):
+        self.streams = {}
+        self.values = {}
+
+    async def xadd(self, key, fields, id, maxlen=None, approximate=True):
+        entries = self.streams.setdefault(key, [])
+        if entries and int(entries[-1][0].split("-")[0]) >= int(id.split("-")[0]):
+            raise ResponseError("The ID specified in XADD is equal or smaller than the target stream top item")
+        entries.append((id, dict(fields)))
+        return id
+
+    async def xread(self, streams, count=None, block=None):
+        key, last = next(iter(streams.items()))
+        last_seq = int(str(last).split("-")[0])
+        entries = [entry for entry in self.streams.get(key, []) if int(entry[0].split("-")[0]) > last_seq][:count]
+        if not entries:
+            await asyncio.sleep(0.01)
+            return []
+        return [[key, entries]]
+
+    async def expire(self, key, ttl):
+        return True
+
+    async def exists(self, key):
+        return int(key in self.streams or key in self.values)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.streams.pop(key, None)
+            self.values.pop(key, None)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def get(self, key):
+        return self.values.get(key)
+
+
+class TestResumableStream(unittest.IsolatedAsyncioTestCase):
+
+    def build_queue(self):
+        tracker = StreamingSearchTracker(MagicMock())
+        return ResponseQueue(next_action=lambda item: item,
+                             error_action=lambda error: StreamSearchData.build_from_error("", {}),
+                             complete_action=tracker.untrack,
+                             tracker=tracker,
+                             coalesce_window_ms=0)
+
+    async def test_resume_after_disconnect(self):
+        response_queue = self.build_queue()
+        stream = ResumableStream(response_queue, LocalReplayBuffer(), grace=5).start()
+
+        async def generate():
+            for i in range(10):
+                response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, str(i)))
+                await asyncio.sleep(0.01)
+            response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Finished).build())
+            response_queue.put(None)
+
+        generation = asyncio.create_task(generate())
+        response_queue._tracker.bind_to_task(generation)
+
+        # 第一个连接收到 3 帧后断开
+        first = []
+        follower = stream.follow()
+        async for frame in follower:
+            first.append(parse_frame(frame))
+            if len(first) == 3:
+                break
+        await follower.aclose()
+
+        # 生成没有被取消，重连后从 Last-Event-ID 继续
+        resumed = [parse_frame(frame) async for frame in stream.follow(first[-1][0])]
+        await generation
+        frames = first + resumed
+        self.assertEqual([event_id for event_id, _ in frames], list(range(1, len(frames) + 1)))
+        answers = [packet["answer"] for _, packet in frames if packet["event"] == "answering"]
+        self.assertEqual("".join(answers), "0123456789")
+        self.assertEqual(frames[-1][1]["event"], "finished")
+
+    async def test_regenerate_same_message_id(self):
+        # 重新生成回答时 message_id 不变，续传只返回新回答的数据帧
+        store = ReplayStore()
+        store._redis = FakeRedis()
+
+        async def run(text):
+            response_queue = self.build_queue()
+            stream = ResumableStream(response_queue, await store.create("dialog_id", "message_id"), grace=5).start()
+            for char in text:
+                response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, char))
+            response_queue.put(StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Finished).build())
+            response_queue.put(None)
+            return [parse_frame(frame) async for frame in stream.follow()]
+
+        await run("旧的回答")
+        frames = await run("新回答")
+        self.assertEqual("".join(packet["answer"] for _, packet in frames if packet["event"] == "answering"), "新回答")
+
+        buffer = await store.open("dialog_id", "message_id")
+        resumed = [parse_frame(frame) async for frame in buffer.follow(0)]
+        self.assertEqual([event_id for event_id, _ in resumed], list(range(1, len(resumed) + 1)))
+        self.assertEqual("".join(packet["answer"] for _, packet in resumed if packet["event"] == "answering"), "新回答")
+        self.assertEqual(resumed[-1][1]["event"], "finished")
+
+    async def test_cancel_without_followers(self):
+        response_queue = self.build_queue()
+        ResumableStream(response_queue, LocalReplayBuffer(), grace=0.05).start()
+
+        async def generate():
+            while True:
+                response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, "多"))
+                await asyncio.sleep(0.01)
+
+        generation = asyncio.create_task(generate())
+        response_queue._tracker.bind_to_task(generation)
+        # 没有客户端接收，超过 grace 后取消生成
+        await asyncio.wait_for(asyncio.gather(generation, return_exceptions=True), timeout=3)
+        self.assertTrue(generation.cancelled())
+
+    def test_packet_with_event_id(self):
+        data = StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, "多")
+        self.assertEqual(data.to_packet(event_id=7), b"id: 7\n" + data.to_packet())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import json
+import unittest
+from util.aiohttp_sse_client import SSEParser
+
+
+class TestSSEParser(unittest.TestCase):
+
+    def feed_all(self, chunks):
+        parser = SSEParser()
+        events = []
+        for chunk in chunks:
+            events.extend(parser.feed(chunk))
+        return events
+
+    def test_split_at_every_position(self):
+        stream = (':ok\n\n'
+                  'data: {"event": "answer", "answer": "感冒"}\n\n'
+                  'event: custom\nid: 7\ndata: {"event": "finished"}\n\n').encode('utf-8')
+        for i in range(len(stream) + 1):
+            events = self.feed_all([stream[:i], stream[i:]])
+            self.assertEqual([e.data_json["event"] for e in events], ["answer", "finished"])
+            self.assertEqual(events[0].data_json["answer"], "感冒")
+            self.assertEqual(events[1].event, "custom")
+            self.assertEqual(events[1].id, "7")
+
+    def test_crlf_line_endings(self):
+        stream = b'data: {"a": 1}\r\n\r\ndata: {"a": 2}\r\n\r\n'
+        for i in range(len(stream) + 1):
+            events = self.feed_all([stream[:i], stream[i:]])
+            self.assertEqual([e.data_json["a"] for e in events], [1, 2])
+
+    def test_multi_line_data(self):
+        events = self.feed_all([b'data: {"a":\ndata: 1}\n\n'])
+        self.assertEqual(events[0].data, '{"a":\n1}')
+        self.assertEqual(events[0].data_json, {"a": 1})
+
+    def test_large_payload_in_small_chunks(self):
+        answer = "指南" * 200000
+        stream = b'data: ' + json.dumps({"answer": answer}, ensure_ascii=False).encode('utf-8') + b'\n\n'
+        chunks = [stream[i:i + 4096] for i in range(0, len(stream), 4096)]
+        events = self.feed_all(chunks)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].data_json["answer"], answer)
+
+    def test_incomplete_message_is_kept(self):
+        parser = SSEParser()
+        self.assertEqual(parser.feed(b'data: {"a": 1}\n'), [])
+        events = parser.feed(b'\n')
+        self.assertEqual(events[0].data_json, {"a": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from util.stream.response_queue import ResponseQueue
+from util.stream.stop_signal import StopSignal
+from util.stream.stream_search_model import StreamSearchData
+from util.tracker.stream_search_tracker import StreamingSearchTracker
+
+
+class FakePubSubClient:
+    """模拟 Redis 频道：所有订阅者共享同一组队列"""
+    subscribers = []
+
+    async def ping(self):
+        return True
+
+    async def publish(self, channel, message):
+        for queue in FakePubSubClient.subscribers:
+            queue.put_nowait(message)
+        return len(FakePubSubClient.subscribers)
+
+    async def subscribe(self, channel):
+        queue = asyncio.Queue()
+        FakePubSubClient.subscribers.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            FakePubSubClient.subscribers.remove(queue)
+
+    async def close(self):
+        pass
+
+
+class TestStopSignal(unittest.IsolatedAsyncioTestCase):
+
+    def build_stream(self):
+        tracker = StreamingSearchTracker(MagicMock())
+        response_queue = ResponseQueue(next_action=lambda item: item,
+                                       error_action=lambda error: StreamSearchData.build_from_error("", {}),
+                                       complete_action=tracker.untrack,
+                                       tracker=tracker)
+
+        async def generate():
+            while True:
+                response_queue.put(StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, "多"))
+                await asyncio.sleep(0.005)
+
+        generation = asyncio.create_task(generate())
+        tracker.bind_to_task(generation)
+        return response_queue, generation
+
+    async def test_local_fallback(self):
+        signal = StopSignal()
+        with patch("util.stream.stop_signal.PubSubClient", side_effect=ConnectionError("no redis")):
+            await signal.start()
+
+        response_queue, generation = self.build_stream()
+        signal.register("message_id", response_queue.cancel)
+        packets = []
+        async for packet in response_queue.subscribe():
+            packets.append(packet)
+            if len(packets) == 2:
+                await signal.publish("message_id")
+
+        with self.assertRaises(asyncio.CancelledError):
+            await generation
+        # 停止之后不再输出新的回答，已输出的回答保存下来
+        self.assertLessEqual(len(packets), 3)
+        answers = [json.loads(packet.decode("utf-8")[len("data: "):])["answer"] for packet in packets]
+        self.assertEqual(response_queue._tracker._streaming_search_data["answer_with_cite"], "".join(answers))
+
+    @patch("util.stream.stop_signal.PubSubClient", FakePubSubClient)
+    async def test_stop_on_other_worker(self):
+        # 两个 worker：stream_worker 持有流式响应，api_worker 收到 stop_generating 请求
+        stream_worker, api_worker = StopSignal(), StopSignal()
+        await stream_worker.start()
+        await api_worker.start()
+        await asyncio.sleep(0)
+
+        response_queue, generation = self.build_stream()
+        stream_worker.register("message_id", response_queue.cancel)
+        await api_worker.publish("message_id")
+        await asyncio.wait_for(asyncio.gather(generation, return_exceptions=True), timeout=1)
+        self.assertTrue(generation.cancelled())
+
+        await stream_worker.close()
+        await api_worker.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
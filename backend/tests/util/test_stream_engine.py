@@ -0,0 +1,54 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+from util.stream import stream_engine
+
+
+class TestStreamEngine(unittest.IsolatedAsyncioTestCase):
+
+    async def test_async_engine_runs_on_current_loop(self):
+        loop = asyncio.get_running_loop()
+        result = {}
+
+        def executor_func(*args):
+            result["executor"] = True
+
+        async def async_func(*args):
+            result["loop"] = asyncio.get_running_loop()
+            result["args"] = args
+
+        with patch.object(stream_engine, "STREAM_ENGINE", stream_engine.STREAM_ENGINE_ASYNC):
+            task = stream_engine.start_stream(executor_func, async_func, 1, 2)
+        await task
+
+        self.assertIs(result["loop"], loop)
+        self.assertEqual(result["args"], (1, 2))
+        self.assertNotIn("executor", result)
+
+    async def test_executor_engine_runs_in_thread(self):
+        result = {}
+
+        def executor_func(*args):
+            result["thread"] = threading.current_thread()
+            result["args"] = args
+
+        async def async_func(*args):
+            result["async"] = True
+
+        with patch.object(stream_engine, "STREAM_ENGINE", stream_engine.STREAM_ENGINE_EXECUTOR):
+            await stream_engine.start_stream(executor_func, async_func, "a")
+
+        self.assertIsNot(result["thread"], threading.main_thread())
+        self.assertEqual(result["args"], ("a",))
+        self.assertNotIn("async", result)
+
+
+if __name__ == '__main__':
+    unittest.main()
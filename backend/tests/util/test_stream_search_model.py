@@ -4,9 +4,24 @@ import os
 # 将项目根目录添加到 sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+import json
 import unittest
 from util.stream.stream_search_model import StreamSearchData
 
+
+def legacy_packet(data: StreamSearchData):
+    # 优化前的序列化方式：构建 dict 后 json.dumps，再拼接字符串
+    packet_dict = {}
+    for field_name in StreamSearchData.__slots__:
+        field_value = getattr(data, field_name)
+        if field_value is not None:
+            if isinstance(field_value, StreamSearchData.SearchEvent):
+                packet_dict.update({field_name: field_value.name.lower()})
+            else:
+                packet_dict.update({field_name: field_value})
+    return ("data: " + json.dumps(packet_dict, ensure_ascii=False) + "\n\n").encode('utf-8')
+
+
 class TestSearchEvent(unittest.TestCase):
     
     def test_from_str(self):
@@ -26,5 +41,21 @@ class TestSearchEvent(unittest.TestCase):
         self.assertEqual(StreamSearchData.SearchEvent.Answering.from_str("final_electronic_report"), StreamSearchData.SearchEvent.Final_Electronic_Report)
 
 
+class TestToPacket(unittest.TestCase):
+
+    def test_same_as_json_dumps(self):
+        samples = [
+            StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answering, "多喝水\n\"注意\"休息"),
+            StreamSearchData.build_answer(StreamSearchData.SearchEvent.Answer_Thinking, "思考", {"cite_idx": [0], "cite_infos": ["0.0"]}),
+            StreamSearchData.build_from_error("dialog_id", {"trace_id": "0x1", "msg": None}),
+            StreamSearchData.Builder().event(StreamSearchData.SearchEvent.Debug).debug({"recall": {"time": 0.5}, 1: True}).build(),
+            StreamSearchData.Builder().query("没有事件").build(),
+            StreamSearchData(),
+        ]
+        for data in samples:
+            self.assertEqual(data.to_packet(), legacy_packet(data))
+            self.assertEqual(json.loads(data.to_packet()[len("data: "):]), json.loads(json.dumps(data.dict())))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,64 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import unittest
+from unittest.mock import patch
+from mongomock import MongoClient
+from service.repository.mongo_task_manager import MongoTaskManager, TaskStatus
+from worker.pipelines import submit_first_diagnosis_pipeline, submit_diagnosis_pipeline
+
+
+class TestPipelines(unittest.TestCase):
+
+    @patch('worker.pipelines.IS_DEMO_MODE', False)
+    def test_first_diagnosis_pipeline(self):
+        task_manager = MongoTaskManager(mongo_client=MongoClient(), db="test_db", collection_name="test_tasks")
+        with patch('worker.pipelines.task_manager', wraps=task_manager) as mock_task_manager:
+            report_id = submit_first_diagnosis_pipeline("dialog_id", "treatment_id")
+            # 重复提交候诊返回同一个电子病历任务
+            self.assertEqual(submit_first_diagnosis_pipeline("dialog_id", "treatment_id"), report_id)
+
+        graph = mock_task_manager.submit_graph.call_args_list[0][0][0]
+        nodes = {task_type: (task_id, params, depends_on) for task_id, task_type, params, depends_on in graph.nodes}
+        self.assertEqual(nodes["generate_first_electronic_report"][0], report_id)
+        diagnosis_id, diagnosis_params, diagnosis_depends_on = nodes["generate_diagnosis_and_treatment_plan"]
+        self.assertEqual(diagnosis_depends_on, [report_id])
+        self.assertEqual(diagnosis_params["source"], "generate_first_electronic_report")
+        # 诊断完成后，处置方案和历史总结并行
+        self.assertEqual(nodes["generate_treatment"][2], [diagnosis_id])
+        self.assertEqual(nodes["generate_treatment"][1]["treatment_plan_id"], diagnosis_params["treatment_plan_id"])
+        self.assertEqual(nodes["summarize_history_data"][2], [diagnosis_id])
+
+    def test_diagnosis_pipeline(self):
+        task_manager = MongoTaskManager(mongo_client=MongoClient(), db="test_db", collection_name="test_tasks")
+        with patch('worker.pipelines.task_manager', wraps=task_manager) as mock_task_manager:
+            diagnose_id, treatment_plan_id = submit_diagnosis_pipeline("treatment_id", "doctor_console")
+
+        graph = mock_task_manager.submit_graph.call_args[0][0]
+        self.assertEqual([node[1] for node in graph.nodes], ["generate_diagnosis_and_treatment_plan", "generate_treatment"])
+        self.assertEqual(graph.nodes[1][2]["diagnose_id"], diagnose_id)
+        self.assertEqual(graph.nodes[1][2]["treatment_plan_id"], treatment_plan_id)
+
+    def test_duplicate_diagnosis_pipeline(self):
+        # 诊断尚未生成完时重复提交，返回正在生成的诊断，不重复写入任务
+        task_manager = MongoTaskManager(mongo_client=MongoClient(), db="test_db", collection_name="test_tasks")
+        with patch('worker.pipelines.task_manager', task_manager):
+            first = submit_diagnosis_pipeline("treatment_id", "doctor_console")
+            second = submit_diagnosis_pipeline("treatment_id", "doctor_console")
+            other_treatment = submit_diagnosis_pipeline("other_treatment_id", "doctor_console")
+            self.assertEqual(second, first)
+            self.assertNotEqual(other_treatment, first)
+            self.assertEqual(task_manager.collection.count_documents({}), 4)
+
+            # 诊断结束后可以重新生成
+            diagnosis = task_manager.collection.find_one({"params.diagnose_id": first[0], "task_type": "generate_diagnosis_and_treatment_plan"})
+            task_manager.update_task_status(str(diagnosis["_id"]), TaskStatus.COMPLETED)
+            third = submit_diagnosis_pipeline("treatment_id", "doctor_console")
+            self.assertNotEqual(third, first)
+
+
+if __name__ == '__main__':
+    unittest.main()
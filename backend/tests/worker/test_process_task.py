@@ -4,121 +4,228 @@ import os
 # 将项目根目录添加到 sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+import time
 import unittest
 from unittest.mock import patch, MagicMock
-from worker.process_task import process_pending_tasks
-from service.repository.mongo_task_manager import TaskStatus
+from worker.process_task import process_pending_tasks, reap_expired_tasks, renew_leases, record_queue_stats, task_executor
+from service.repository.mongo_task_manager import TaskStatus, WaitForTasks
+from worker.retry_policy import RetryPolicy
 
 class TestProcessPendingTasks(unittest.TestCase):
 
     @patch('worker.process_task.task_manager')
     def test_no_pending_tasks(self, mock_task_manager):
         # 模拟没有待处理任务的情况
-        mock_task_manager.find_pending_tasks.return_value = []
+        mock_task_manager.claim_next_task.return_value = None
         
         process_pending_tasks()
+        task_executor.join(5)
         
-        # 验证没有尝试获取锁
-        mock_task_manager.acquire_lock.assert_not_called()
-
-    @patch('worker.process_task.task_manager')
-    def test_task_already_processed(self, mock_task_manager):
-        # 模拟任务已经被处理的情况
-        mock_task = {
-            'status': TaskStatus.COMPLETED.value,
-            'task_id': 'test_task_id'
-        }
-        mock_task_manager.find_pending_tasks.return_value = [mock_task]
-        
-        process_pending_tasks()
-        
-        # 验证没有尝试获取锁
-        mock_task_manager.acquire_lock.assert_not_called()
+        # 验证只尝试获取一次，没有释放锁
+        mock_task_manager.claim_next_task.assert_called_once()
+        mock_task_manager.release_lock.assert_not_called()
 
     @patch('worker.process_task.task_manager')
-    def test_failed_to_acquire_lock(self, mock_task_manager):
-        # 模拟获取锁失败的情况
+    def test_saturated_task_type_requeued(self, mock_task_manager):
+        # 模拟获取到任务时该类型已经没有空闲名额的情况
         mock_task = {
-            'status': TaskStatus.PENDING.value,
+            'status': TaskStatus.PROCESSING.value,
             'task_id': 'test_task_id',
             'task_type': 'upload_report'
         }
-        mock_task_manager.find_pending_tasks.return_value = [mock_task]
-        mock_task_manager.acquire_lock.return_value = False
+        mock_task_manager.claim_next_task.side_effect = [mock_task, None]
         
-        process_pending_tasks()
+        with patch.object(task_executor, 'reserve', return_value=False):
+            process_pending_tasks()
         
-        # 验证尝试获取锁但失败
-        mock_task_manager.acquire_lock.assert_called_once()
-        # 验证没有尝试处理任务
-        mock_task_manager.release_lock.assert_not_called()
+        # 验证任务放回队列，不再继续获取
+        mock_task_manager.claim_next_task.assert_called_once()
+        mock_task_manager.release_lock.assert_called_once_with('test_task_id', unittest.mock.ANY, TaskStatus.PENDING)
 
     @patch('worker.process_task.task_manager')
-    @patch('worker.process_task.process_upload_report')
-    def test_successful_task_processing(self, mock_process_report, mock_task_manager):
+    def test_successful_task_processing(self, mock_task_manager):
         # 模拟成功处理任务的情况
         mock_task = {
-            'status': TaskStatus.PENDING.value,
+            'status': TaskStatus.PROCESSING.value,
             'task_id': 'test_task_id',
             'task_type': 'upload_report',
             'params': {'file_oss_key': 'test_key'}
         }
-        mock_task_manager.find_pending_tasks.return_value = [mock_task]
-        mock_task_manager.acquire_lock.return_value = True
-        mock_process_report.return_value = TaskStatus.COMPLETED
+        mock_task_manager.claim_next_task.side_effect = [mock_task, None]
+        mock_process_report = MagicMock(return_value=TaskStatus.COMPLETED)
         
-        process_pending_tasks()
+        with patch.dict('worker.process_task.job_map', {'upload_report': mock_process_report}):
+            process_pending_tasks()
+            # 任务在 task_executor 中异步执行
+            task_executor.join(5)
         
         # 验证完整流程
-        mock_task_manager.acquire_lock.assert_called_once()
-        mock_process_report.assert_called_once()
-        mock_task_manager.release_lock.assert_called_once()
+        mock_process_report.assert_called_once_with('test_task_id', {'file_oss_key': 'test_key'})
+        mock_task_manager.release_lock.assert_called_once_with(
+            task_id='test_task_id',
+            worker_id=unittest.mock.ANY,
+            task_status=TaskStatus.COMPLETED,
+            time_cost=unittest.mock.ANY
+        )
 
     @patch('worker.process_task.task_manager')
-    @patch('worker.process_task.process_upload_report')
-    def test_failed_task_processing(self, mock_process_report, mock_task_manager):
-        # 模拟任务处理失败的情况
+    def test_failed_task_processing(self, mock_task_manager):
+        # 模拟任务处理失败、已经用完重试次数的情况
         mock_task = {
-            'status': TaskStatus.PENDING.value,
+            'status': TaskStatus.PROCESSING.value,
             'task_id': 'test_task_id',
             'task_type': 'upload_report',
-            'params': {'file_oss_key': 'test_key'}
+            'params': {'file_oss_key': 'test_key'},
+            'attempts': 3
         }
-        mock_task_manager.find_pending_tasks.return_value = [mock_task]
-        mock_task_manager.acquire_lock.return_value = True
-        mock_process_report.return_value = TaskStatus.FAIL
+        mock_task_manager.claim_next_task.side_effect = [mock_task, None]
+        mock_process_report = MagicMock(return_value=TaskStatus.FAIL)
         
-        process_pending_tasks()
+        with patch.dict('worker.process_task.job_map', {'upload_report': mock_process_report}):
+            process_pending_tasks()
+            task_executor.join(5)
         
         # 验证失败处理流程
-        mock_task_manager.acquire_lock.assert_called_once()
         mock_process_report.assert_called_once()
         mock_task_manager.release_lock.assert_called_once_with(
-            'test_task_id', 
-            unittest.mock.ANY,  # worker_id
-            TaskStatus.FAIL
+            task_id='test_task_id',
+            worker_id=unittest.mock.ANY,
+            task_status=TaskStatus.FAIL,
+            time_cost=unittest.mock.ANY
+        )
+
+    @patch('worker.process_task.task_manager')
+    def test_failed_task_retried(self, mock_task_manager):
+        # 模拟任务失败后按重试策略延迟重新调度，不释放为失败
+        mock_task = {
+            'status': TaskStatus.PROCESSING.value,
+            'task_id': 'test_task_id',
+            'task_type': 'upload_report',
+            'params': {'file_oss_key': 'test_key'},
+            'attempts': 1
+        }
+        mock_task_manager.claim_next_task.side_effect = [mock_task, None]
+        mock_process_report = MagicMock(side_effect=ConnectionError("upstream unavailable"))
+        policy = RetryPolicy(max_attempts=3, base_delay=10, max_delay=60, jitter=0)
+
+        with patch.dict('worker.process_task.job_map', {'upload_report': mock_process_report}), \
+                patch('worker.process_task.get_retry_policy', return_value=policy):
+            process_pending_tasks()
+            task_executor.join(5)
+
+        mock_task_manager.retry_task.assert_called_once_with(
+            'test_task_id', unittest.mock.ANY, 10, time_cost=unittest.mock.ANY, error=unittest.mock.ANY
+        )
+        mock_task_manager.release_lock.assert_not_called()
+
+    @patch('worker.process_task.task_manager')
+    def test_non_retryable_error(self, mock_task_manager):
+        # 模拟任务抛出不可重试的异常，直接标记为失败
+        mock_task = {
+            'status': TaskStatus.PROCESSING.value,
+            'task_id': 'test_task_id',
+            'task_type': 'upload_report',
+            'params': {'file_oss_key': 'test_key'},
+            'attempts': 1
+        }
+        mock_task_manager.claim_next_task.side_effect = [mock_task, None]
+        mock_process_report = MagicMock(side_effect=KeyError("result"))
+
+        with patch.dict('worker.process_task.job_map', {'upload_report': mock_process_report}), \
+                patch('worker.process_task.get_retry_policy', return_value=RetryPolicy(max_attempts=3)):
+            process_pending_tasks()
+            task_executor.join(5)
+
+        mock_task_manager.retry_task.assert_not_called()
+        mock_task_manager.release_lock.assert_called_once_with(
+            task_id='test_task_id',
+            worker_id=unittest.mock.ANY,
+            task_status=TaskStatus.FAIL,
+            time_cost=unittest.mock.ANY
         )
 
+    @patch('worker.process_task.task_manager')
+    def test_task_waiting_for_tasks(self, mock_task_manager):
+        # 模拟任务需要等待报告识别，释放 worker 而不是释放为失败
+        mock_task = {
+            'status': TaskStatus.PROCESSING.value,
+            'task_id': 'test_task_id',
+            'task_type': 'generate_first_electronic_report',
+            'params': {'dialog_id': 'dialog_id'}
+        }
+        mock_task_manager.claim_next_task.side_effect = [mock_task, None]
+        mock_generate_report = MagicMock(return_value=WaitForTasks(['report_task_id']))
+
+        with patch.dict('worker.process_task.job_map', {'generate_first_electronic_report': mock_generate_report}):
+            process_pending_tasks()
+            task_executor.join(5)
+
+        mock_task_manager.wait_for_tasks.assert_called_once_with('test_task_id', unittest.mock.ANY, ['report_task_id'])
+        mock_task_manager.release_lock.assert_not_called()
+
     @patch('worker.process_task.task_manager')
     def test_unknown_task_type(self, mock_task_manager):
         # 模拟未知任务类型的情况
         mock_task = {
-            'status': TaskStatus.PENDING.value,
+            'status': TaskStatus.PROCESSING.value,
             'task_id': 'test_task_id',
             'task_type': 'unknown_type'
         }
-        mock_task_manager.find_pending_tasks.return_value = [mock_task]
-        mock_task_manager.acquire_lock.return_value = True
+        mock_task_manager.claim_next_task.side_effect = [mock_task, None]
         
         process_pending_tasks()
+        task_executor.join(5)
         
         # 验证处理未知任务类型
-        mock_task_manager.acquire_lock.assert_called_once()
         mock_task_manager.release_lock.assert_called_once_with(
-            'test_task_id',
-            unittest.mock.ANY,  # worker_id
-            TaskStatus.FAIL
+            task_id='test_task_id',
+            worker_id=unittest.mock.ANY,
+            task_status=TaskStatus.FAIL,
+            time_cost=unittest.mock.ANY
         )
 
+    @patch('worker.process_task.task_manager')
+    def test_reap_expired_tasks(self, mock_task_manager):
+        # 模拟回收到过期任务，放回队列后立即获取
+        mock_task_manager.reap_expired_tasks.return_value = [('upload_report', TaskStatus.PENDING)]
+        mock_task_manager.claim_next_task.return_value = None
+
+        reap_expired_tasks()
+
+        mock_task_manager.claim_next_task.assert_called_once()
+
+    @patch('worker.process_task.task_manager')
+    def test_renew_leases(self, mock_task_manager):
+        # 没有执行中的任务时不访问数据库
+        renew_leases()
+        mock_task_manager.renew_leases.assert_not_called()
+
+        with patch.object(task_executor, 'running_task_ids', return_value=['task_1', 'task_2']):
+            mock_task_manager.renew_leases.return_value = 2
+            renew_leases()
+        mock_task_manager.renew_leases.assert_called_once_with(['task_1', 'task_2'], unittest.mock.ANY)
+
+class TestRecordQueueStats(unittest.TestCase):
+
+    @patch('worker.process_task.record_gauge')
+    @patch('worker.process_task.task_manager')
+    def test_record_queue_stats(self, mock_task_manager, mock_record_gauge):
+        # 只有 upload_report 有积压，其他任务类型记为 0
+        now = time.time()
+        mock_task_manager.queue_stats.return_value = {
+            "upload_report": {"pending": 3, "ready": 2, "processing": 1, "oldest_ready_at": now - 30},
+        }
+
+        record_queue_stats()
+
+        values = {(call.args[0].method, call.args[1].name): call.args[2] for call in mock_record_gauge.call_args_list}
+        self.assertEqual(values[("upload_report", "task_pending_depth")], 3)
+        self.assertEqual(values[("upload_report", "task_ready_depth")], 2)
+        self.assertEqual(values[("upload_report", "task_processing_count")], 1)
+        self.assertAlmostEqual(values[("upload_report", "task_oldest_pending_age")], 30, delta=5)
+        self.assertEqual(values[("generate_treatment", "task_pending_depth")], 0)
+        self.assertEqual(values[("generate_treatment", "task_oldest_pending_age")], 0)
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
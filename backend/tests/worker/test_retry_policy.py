@@ -0,0 +1,45 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import unittest
+import requests
+from worker.retry_policy import RetryPolicy, load_retry_policies
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_should_retry(self):
+        policy = RetryPolicy(max_attempts=3, retry_on=["ConnectionError", "TimeoutError"])
+        # 返回 FAIL 和可重试的异常在次数内重试
+        self.assertTrue(policy.should_retry(1))
+        self.assertTrue(policy.should_retry(2, requests.exceptions.ConnectionError()))
+        self.assertTrue(policy.should_retry(1, asyncio.TimeoutError()))
+        # 其他异常和用完次数的任务不重试
+        self.assertFalse(policy.should_retry(1, ValueError()))
+        self.assertFalse(policy.should_retry(3))
+        self.assertFalse(RetryPolicy(max_attempts=3, retry_on_fail=False).should_retry(1))
+        # 默认不重试
+        self.assertFalse(RetryPolicy().should_retry(1))
+
+    def test_next_delay(self):
+        policy = RetryPolicy(max_attempts=10, base_delay=10, max_delay=60, jitter=0)
+        self.assertEqual([policy.next_delay(attempts) for attempts in range(1, 6)], [10, 20, 40, 60, 60])
+
+        policy = RetryPolicy(max_attempts=10, base_delay=10, max_delay=60, jitter=0.5)
+        for _ in range(100):
+            self.assertTrue(10 <= policy.next_delay(2) <= 20)
+
+    def test_load_retry_policies(self):
+        policies = load_retry_policies({"upload_report": {"max_attempts": 3}}, default={"max_attempts": 1, "base_delay": 2})
+        self.assertEqual(policies["upload_report"].max_attempts, 3)
+        self.assertEqual(policies["upload_report"].base_delay, 2)
+        with self.assertRaises(ValueError):
+            RetryPolicy(retry_on=["KeyError"])
+
+
+if __name__ == '__main__':
+    unittest.main()
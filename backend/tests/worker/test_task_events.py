@@ -0,0 +1,111 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import asyncio
+import json
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from mongomock import MongoClient
+from service.package.task_events import TaskEvents
+from service.repository.mongo_task_manager import MongoTaskManager, TaskStatus
+
+
+def parse_packet(packet: bytes):
+    event, data = packet.decode("utf-8").strip().split("\n")
+    return event[len("event: "):], json.loads(data[len("data: "):])
+
+
+class TestTaskEvents(unittest.IsolatedAsyncioTestCase):
+
+    async def test_publish_compact_events(self):
+        # 任务状态变化时发布精简的事件，不包含参数和结果
+        producer = MagicMock()
+        events = TaskEvents(channel="task_events", client_factory=lambda: producer)
+        task_manager = MongoTaskManager(mongo_client=MongoClient(), db="test_db", collection_name="test_tasks", events=events)
+
+        task_id = task_manager.add_task("upload_report", {"treatment_id": "t1", "file_oss_key": "key", "source": "patient"})
+        task_manager.add_task("summarize_history_data", {})
+        task_manager.claim_next_task("worker1")
+        task_manager.update_task(task_id, {"result": "报告全文"})
+        task_manager.release_lock(task_id, "worker1", TaskStatus.COMPLETED)
+
+        messages = [json.loads(call.args[1]) for call in producer.publish.call_args_list]
+        self.assertEqual([message["status"] for message in messages], ["pending", "processing", "completed"])
+        self.assertEqual(set(messages[-1]), {"task_id", "task_type", "status", "source", "treatment_id", "ts"})
+        self.assertEqual(messages[-1]["task_id"], task_id)
+        self.assertEqual(messages[-1]["source"], "patient")
+
+    async def test_local_fallback(self):
+        # Redis 不可用时在进程内分发，worker 线程中的状态变化也能送达
+        events = TaskEvents(client_factory=MagicMock(side_effect=ConnectionError("no redis")))
+        with patch("service.package.task_events.PubSubClient", side_effect=ConnectionError("no redis")):
+            await events.start()
+        queue = events.subscribe("t1")
+        other = events.subscribe("t2")
+
+        thread = threading.Thread(target=events.publish, args=({"_id": "task_1", "task_type": "upload_report", "status": "completed", "params": {"treatment_id": "t1"}},))
+        thread.start()
+        thread.join()
+        event = await asyncio.wait_for(queue.get(), timeout=1)
+        self.assertEqual(event["task_id"], "task_1")
+        self.assertTrue(other.empty())
+
+        events.unsubscribe("t1", queue)
+        events.unsubscribe("t2", other)
+        self.assertEqual(events._subscribers, {})
+        await events.close()
+
+
+class TestStreamExecutionProgress(unittest.IsolatedAsyncioTestCase):
+
+    async def test_snapshot_then_deltas(self):
+        from service.api.ai_doctor import doctor_console
+        events = TaskEvents(client_factory=MagicMock(side_effect=ConnectionError("no redis")))
+        with patch("service.package.task_events.PubSubClient", side_effect=ConnectionError("no redis")):
+            await events.start()
+
+        snapshot = [
+            {"_id": "diagnosis", "task_type": "generate_diagnosis_and_treatment_plan", "status": "waiting", "params": {"source": "generate_first_electronic_report"}},
+            {"_id": "report", "task_type": "generate_first_electronic_report", "status": "processing", "params": {}},
+        ]
+        request = MagicMock()
+        request.query_params = {"treatment_id": "t1"}
+        with patch.object(doctor_console, "task_events", events), patch.object(doctor_console, "task_manager") as mock_task_manager:
+            mock_task_manager.find_task_by_treatment_id.return_value = snapshot
+            response = await doctor_console.stream_execution_progress(request)
+            packets = response.body_iterator
+
+            event, data = parse_packet(await packets.__anext__())
+            self.assertEqual(event, "snapshot")
+            self.assertEqual(data["stage"], "emr_generation")
+            self.assertEqual([task["task_id"] for task in data["tasks"]], ["diagnosis", "report"])
+
+            def publish(task_id, task_type, status, source=""):
+                events.publish({"_id": task_id, "task_type": task_type, "status": status,
+                                "params": {"treatment_id": "t1", "source": source}})
+
+            # 状态没有变化的事件不推送
+            publish("report", "generate_first_electronic_report", "processing")
+            publish("report", "generate_first_electronic_report", "completed")
+            self.assertEqual(parse_packet(await packets.__anext__()), ("task", {
+                "task_id": "report", "task_type": "generate_first_electronic_report", "status": "completed", "source": ""
+            }))
+            event, data = parse_packet(await packets.__anext__())
+            self.assertEqual((event, data["stage"]), ("stage", "diagnose_generation"))
+
+            publish("diagnosis", "generate_diagnosis_and_treatment_plan", "completed", "generate_first_electronic_report")
+            self.assertEqual(parse_packet(await packets.__anext__())[0], "task")
+            event, data = parse_packet(await packets.__anext__())
+            self.assertEqual((event, data["stage"]), ("stage", "completed"))
+            await packets.aclose()
+
+        self.assertEqual(events._subscribers, {})
+        await events.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
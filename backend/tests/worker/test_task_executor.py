@@ -0,0 +1,83 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import threading
+import time
+import unittest
+from worker.task_executor import TaskExecutor
+
+
+class TestTaskExecutor(unittest.TestCase):
+
+    def test_limit_per_task_type(self):
+        release = threading.Event()
+        started = []
+        executor = TaskExecutor(concurrency={"upload_report": 2}, default_concurrency=1)
+
+        def job(task_id):
+            started.append(task_id)
+            release.wait(2)
+
+        for i in range(2):
+            self.assertTrue(executor.reserve("upload_report"))
+            executor.submit("upload_report", f"ocr_{i}", job, f"ocr_{i}")
+        # OCR 名额用完，不影响其他类型的任务
+        self.assertFalse(executor.reserve("upload_report"))
+        self.assertTrue(executor.reserve("summarize_history_data"))
+        executor.submit("summarize_history_data", "summary", job, "summary")
+        self.assertFalse(executor.reserve("summarize_history_data"))
+
+        time.sleep(0.1)
+        self.assertEqual(sorted(started), ["ocr_0", "ocr_1", "summary"])
+        self.assertEqual(executor.stats()["upload_report"], {"queued": 0, "running": 2, "limit": 2})
+
+        release.set()
+        self.assertTrue(executor.join(2))
+        self.assertEqual(executor.stats()["upload_report"]["running"], 0)
+        executor.shutdown(1)
+
+    def test_available_after_backlog(self):
+        available = []
+        release = threading.Event()
+        executor = TaskExecutor(concurrency={}, default_concurrency=1, on_available=available.append)
+
+        self.assertTrue(executor.reserve("generate_treatment"))
+        executor.submit("generate_treatment", "t1", release.wait, 2)
+        self.assertFalse(executor.reserve("generate_treatment"))
+        release.set()
+        self.assertTrue(executor.join(2))
+        time.sleep(0.05)
+        self.assertEqual(available, ["generate_treatment"])
+
+        # 没有放弃过任务时不触发
+        self.assertTrue(executor.reserve("generate_treatment"))
+        executor.submit("generate_treatment", "t2", lambda: None)
+        self.assertTrue(executor.join(2))
+        time.sleep(0.05)
+        self.assertEqual(available, ["generate_treatment"])
+        executor.shutdown(1)
+
+    def test_shutdown(self):
+        cancelled = []
+        release = threading.Event()
+        executor = TaskExecutor(concurrency={}, default_concurrency=1, on_cancel=cancelled.append)
+
+        def failing_job():
+            release.wait(2)
+            raise RuntimeError("upstream error")
+
+        self.assertTrue(executor.reserve("generate_treatment"))
+        executor.submit("generate_treatment", "t1", failing_job)
+        threading.Timer(0.1, release.set).start()
+        executor.shutdown(2)
+        # 关闭后不再接收新任务，任务异常不影响关闭
+        self.assertFalse(executor.reserve("generate_treatment"))
+        self.assertEqual(executor.stats()["generate_treatment"]["running"], 0)
+        self.assertEqual(cancelled, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+import os
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import queue
+import threading
+import unittest
+from unittest.mock import patch
+from mongomock import MongoClient
+from service.package.task_wakeup import TaskWakeup
+from service.repository.mongo_task_manager import MongoTaskManager, TaskStatus
+import worker.process_task as process_task
+
+
+class FakeMessageClient:
+    """模拟 Redis Streams 消费组：所有客户端共享同一个队列"""
+    messages = queue.Queue()
+
+    def __init__(self, in_channel=None, consumer_id=None, read_pending=False):
+        pass
+
+    def send(self, msg, maxlen=None):
+        FakeMessageClient.messages.put(("1-0", {key: str(value) for key, value in msg.items()}))
+
+    def receive(self, block=10):
+        try:
+            return FakeMessageClient.messages.get(timeout=block / 1000)
+        except queue.Empty:
+            return None
+
+    def ack(self, id):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestTaskWakeup(unittest.TestCase):
+
+    def setUp(self):
+        self.wakeup = TaskWakeup(client_factory=FakeMessageClient)
+        self.task_manager = MongoTaskManager(mongo_client=MongoClient(), db="test_db", collection_name="test_tasks", notifier=self.wakeup)
+        self.started = queue.Queue()
+
+        def job(task_id, params):
+            self.started.put(task_id)
+            return TaskStatus.COMPLETED
+
+        self.patches = [patch.object(process_task, "task_manager", self.task_manager),
+                        patch.dict(process_task.job_map, {"test_type": job})]
+        for p in self.patches:
+            p.start()
+        self.wakeup.listen(process_task.process_task_by_id, process_task.worker_id)
+
+    def tearDown(self):
+        self.wakeup.stop()
+        for p in self.patches:
+            p.stop()
+
+    def test_task_started_without_polling(self):
+        task_id = self.task_manager.add_task("test_type", {"param": "value"})
+        self.assertEqual(self.started.get(timeout=2), task_id)
+        self.assertTrue(self.wait_status(task_id, TaskStatus.COMPLETED))
+
+    def test_delayed_task(self):
+        task_id = self.task_manager.add_task("test_type", {"param": "value"}, delay=0.2)
+        with self.assertRaises(queue.Empty):
+            self.started.get(timeout=0.1)
+        self.assertEqual(self.started.get(timeout=2), task_id)
+
+    def test_task_taken_by_other_worker(self):
+        task_id = self.task_manager.add_task("test_type", {"param": "value"}, delay=0.2)
+        self.assertTrue(self.task_manager.acquire_lock(task_id, "other_worker"))
+        with self.assertRaises(queue.Empty):
+            self.started.get(timeout=0.5)
+
+    def wait_status(self, task_id, status):
+        done = threading.Event()
+        for _ in range(20):
+            if self.task_manager.get_by_task_id(task_id)["status"] == status.value:
+                return True
+            done.wait(0.05)
+        return False
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,16 +5,14 @@
 # 
 #import sys, os
 #sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import re
 import aiohttp
 import asyncio
 import json
-from typing import List, Dict, Optional, AsyncGenerator, Final
+from typing import List, Dict, Optional, AsyncGenerator
 
+from util.http_pool import http_pool
 from util.logger import algo_logger
 
-_SSE_LINE_PATTERN: Final[re.Pattern] = re.compile('(?P<name>[^:]*):?( ?(?P<value>.*))?')
-
 # Good parts of the below class is adopted from:
 #   https://github.com/btubbs/sseclient/blob/db38dc6/sseclient.py
 class Event:
@@ -59,39 +57,36 @@ class Event:
         return self.dump().encode('utf-8')
 
     @classmethod
-    def parse(cls, raw_lines: list):
+    def from_bytes(cls, block: bytes) -> Optional['Event']:
         '''
-        Given a possibly-multiline string representing an SSE message, parse it
-        and return a Event object.
+        Given the raw bytes of one SSE message (without the trailing blank
+        line), parse it and return an Event object, or None if it carries no
+        data (e.g. comment-only keepalives such as ":ok").
         '''
         msg = cls()
-        for line in raw_lines:
-            m = _SSE_LINE_PATTERN.match(line)
-            if m is None:
-                # Malformed line.  Discard but warn.
-                algo_logger.warning('Invalid SSE line: %s', line)
-                continue
-
-            name = m.group('name')
-            if name == '':
-                # line began with a ':', so is a comment.  Ignore
+        data_lines = []
+        for line in block.split(b'\n'):
+            if not line or line[0] == 0x3A:
+                # empty line, or line began with a ':', so is a comment.  Ignore
                 continue
-            value = m.group('value')
-
-            if name == 'data':
-                # If we already have some data, then join to it with a newline.
-                # Else this is it.
-                if msg.data:
-                    msg.data = f'{msg.data}\n{value}'
-                else:
-                    msg.data = value
-            elif name == 'event':
-                msg.event = value
-            elif name == 'id':
-                msg.id = value
-            elif name == 'retry':
+            name, _, value = line.partition(b':')
+            if value[:1] == b' ':
+                value = value[1:]
+
+            if name == b'data':
+                data_lines.append(value)
+            elif name == b'event':
+                msg.event = value.decode('utf-8')
+            elif name == b'id':
+                msg.id = value.decode('utf-8')
+            elif name == b'retry':
                 msg.retry = int(value)
 
+        if not data_lines:
+            return None
+        # multi-line data is joined with a newline, only once per message
+        data = data_lines[0] if len(data_lines) == 1 else b'\n'.join(data_lines)
+        msg.data = data.decode('utf-8')
         msg.data_json = json.loads(msg.data)
         return msg
 
@@ -99,6 +94,50 @@ class Event:
         return self.data
 
 
+class SSEParser:
+    '''
+    Incremental SSE parser working on the raw byte stream.
+    Chunks may split messages anywhere; complete messages are returned as
+    soon as their terminating blank line arrives, with no limit on the size
+    of a single data payload.
+    '''
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # where to resume searching for a message boundary, so a large
+        # payload arriving in many chunks is not rescanned from the start
+        self._scan_from = 0
+        self._pending_cr = False
+
+    def feed(self, chunk: bytes) -> List[Event]:
+        if self._pending_cr:
+            chunk = b'\r' + chunk
+            self._pending_cr = False
+        if b'\r' in chunk:
+            # normalize CRLF / CR line endings; a trailing CR may be the first
+            # half of a CRLF split across chunks
+            if chunk.endswith(b'\r'):
+                chunk = chunk[:-1]
+                self._pending_cr = True
+            chunk = chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+        buffer = self._buffer
+        buffer += chunk
+        events = []
+        start = 0
+        end = buffer.find(b'\n\n', self._scan_from)
+        while end >= 0:
+            event = Event.from_bytes(bytes(buffer[start:end]))
+            if event is not None:
+                events.append(event)
+            start = end + 2
+            end = buffer.find(b'\n\n', start)
+        if start:
+            del buffer[:start]
+        self._scan_from = max(len(buffer) - 1, 0)
+        return events
+
+
 async def aiosseclient(
     url: str,
     data: dict,
@@ -118,29 +157,27 @@ async def aiosseclient(
 
     # Override default timeout of 5 minutes
     timeout = aiohttp.ClientTimeout(total=timeout_total, connect=2*60, sock_connect=2*60, sock_read=2*60)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        response = await session.post(url, headers=headers, json=data)
-        if response.status not in valid_http_codes:
-            algo_logger.error('Invalid HTTP response.status: %s', response.status)
-            raise RuntimeError("Invalid HTTP response.status")
-        ## Fix Bug: "ValueError: Chunk too big"
-        response.content._high_water = response.content._low_water * 10240
-        lines = []
-        async for line in response.content:
-            line = line.decode('utf8')
-            if line in {'\n', '\r', '\r\n'}:
-                if lines[0] == ':ok\n':
-                    lines = []
-                    continue
-
-                current_event = Event.parse(lines)
-                yield current_event
-                if current_event.event in exit_events:
-                    algo_logger.info("final_lines|lines=%s, current_event=%s", ''.join(lines), current_event)
-                    await session.close()
-                lines = []
-            else:
-                lines.append(line)
+    # 复用进程级连接池，不再每次请求新建 session
+    async with http_pool.session() as session:
+        async with session.post(url, headers=headers, json=data, timeout=timeout) as response:
+            if response.status not in valid_http_codes:
+                algo_logger.error('Invalid HTTP response.status: %s', response.status)
+                raise RuntimeError("Invalid HTTP response.status")
+            # 直接处理原始字节流，按消息边界切分，不受单行长度限制
+            parser = SSEParser()
+            try:
+                async for chunk in response.content.iter_any():
+                    for current_event in parser.feed(chunk):
+                        yield current_event
+                        if current_event.event in exit_events:
+                            algo_logger.info("final event|current_event=%s", current_event)
+                            # 共享 session 不能关闭，只关闭当前连接
+                            response.close()
+                            return
+            except (asyncio.CancelledError, GeneratorExit):
+                # 请求被取消（例如客户端断开），关闭连接而不是放回连接池，让算法服务尽快停止生成
+                response.close()
+                raise
 
 
 # 测试
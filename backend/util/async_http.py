@@ -7,6 +7,7 @@ from metrics.meters import record_latency
 from metrics.metrics import FIRST_TOKEN_LATENCY_FROM_LLM
 from service.config.config import service_config
 from service.config.config import config
+from util.http_pool import http_pool
 from util.logger import service_logger
 from util.timer import Timer
 from util.model_types import ServiceException, StatusCode
@@ -19,9 +20,9 @@ async def async_get(url, json, timeout=default_request_timeout, auth: tuple[str,
                     json_format: bool = True, headers=None):
     timer = Timer()
     timeout = aiohttp.ClientTimeout(total=timeout)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
+    async with http_pool.session() as session:
         auth = aiohttp.BasicAuth(auth[0], auth[1]) if auth else None
-        async with session.get(url, json=json, auth=auth, headers=headers) as rsp:
+        async with session.get(url, json=json, auth=auth, headers=headers, timeout=timeout) as rsp:
             if json_format:
                 ret = await rsp.json()
             else:
@@ -39,9 +40,9 @@ async def async_post(url, timeout=default_request_timeout, auth: tuple[str, str]
         headers = {}
     timer = Timer()
     timeout = aiohttp.ClientTimeout(total=timeout)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
+    async with http_pool.session() as session:
         auth = aiohttp.BasicAuth(auth[0], auth[1]) if auth else None
-        async with session.post(url, json=json, auth=auth, headers=headers, data=data) as rsp:
+        async with session.post(url, json=json, auth=auth, headers=headers, data=data, timeout=timeout) as rsp:
             if is_proto:
                 ret = await rsp.read()
             else:
@@ -57,9 +58,9 @@ async def async_proto_get(url, proto_data, headers, timeout=default_request_time
     timer = Timer()
     url_with_params = build_url_proto(url, proto_data)
     timeout = aiohttp.ClientTimeout(total=timeout)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
+    async with http_pool.session() as session:
         auth = aiohttp.BasicAuth(auth[0], auth[1]) if auth else None
-        async with session.get(url_with_params, auth=auth, headers=headers) as rsp:
+        async with session.get(url_with_params, auth=auth, headers=headers, timeout=timeout) as rsp:
             ret = await rsp.read()
             service_logger.info(f"Proto get {url_with_params} [status:{rsp.status} duration:{timer.duration()}s]")
             return ret
@@ -68,8 +69,8 @@ async def async_proto_get(url, proto_data, headers, timeout=default_request_time
 async def async_proto_delete(url, headers, timeout=default_request_timeout, auth: tuple[str, str] = None):
     timer = Timer()
     timeout = aiohttp.ClientTimeout(total=timeout)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.delete(url, auth=auth, headers=headers) as rsp:
+    async with http_pool.session() as session:
+        async with session.delete(url, auth=auth, headers=headers, timeout=timeout) as rsp:
             ret = await rsp.read()
             service_logger.info(f"proto delete {url} [status:{rsp.status} duration:{timer.duration()}s]")
             return ret
@@ -79,8 +80,8 @@ async def async_stream_post(url, json, timeout=default_request_timeout, auth: tu
     timer = Timer()
     timeout = aiohttp.ClientTimeout(total=timeout)
     first_chunk = True
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.post(url, headers=headers, auth=auth, json=json) as response:
+    async with http_pool.session() as session:
+        async with session.post(url, headers=headers, auth=auth, json=json, timeout=timeout) as response:
             #service_logger.info(f"url = {url}, headers = {headers}, auth = {auth}, json = {json}")
             if response.status != 200:
                 service_logger.error(f'STREAM POST {url} [status:{response.status} duration:{timer.duration()}s] ')
@@ -113,8 +114,6 @@ async def async_stream_post(url, json, timeout=default_request_timeout, auth: tu
                     yield output[len(llm_spliter):].decode()
             except Exception as e:
                 service_logger.error(f'async_stream_post exception: {e}, {traceback.format_exc()}') 
-            finally:
-                await session.close()
 
 
 def build_url_proto(url: str, proto_data) -> str:
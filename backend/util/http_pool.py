@@ -0,0 +1,111 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from metrics.meter_key import MeterKey
+from metrics.meters import record_gauge
+from metrics.metrics import HTTP_POOL_ACQUIRED, HTTP_POOL_IDLE, HTTP_POOL_LIMIT
+from service.config.config import service_config
+from util.logger import service_logger
+
+
+class HttpSessionPool:
+    """
+    进程级共享的 aiohttp 连接池，跟随 FastAPI lifespan 启动和关闭。
+    aiohttp 的 session 绑定在创建它的事件循环上，只有在该事件循环中才复用连接池，
+    其他事件循环（例如后台任务线程里 asyncio.run 创建的）使用临时 session。
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 32, keepalive_timeout: float = 30, ttl_dns_cache: int = 300):
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._ttl_dns_cache = ttl_dns_cache
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._meter_key = MeterKey(path="http_pool", method="all")
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        self._loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(
+            limit=self._limit,
+            limit_per_host=self._limit_per_host,
+            keepalive_timeout=self._keepalive_timeout,
+            ttl_dns_cache=self._ttl_dns_cache,
+            use_dns_cache=True,
+        )
+        # 超时在每次请求时单独指定
+        self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None))
+        service_logger.info(f"http session pool started, limit: {self._limit}, limit_per_host: {self._limit_per_host}")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            service_logger.info("http session pool closed")
+        self._session = None
+        self._loop = None
+
+    def shared_session(self) -> Optional[aiohttp.ClientSession]:
+        """当前事件循环可以复用的共享 session，没有则返回 None"""
+        if self._session is None or self._session.closed:
+            return None
+        try:
+            if asyncio.get_running_loop() is not self._loop:
+                return None
+        except RuntimeError:
+            return None
+        return self._session
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[aiohttp.ClientSession]:
+        """
+        获取 session：优先复用连接池，退出时不关闭；
+        不在连接池所属的事件循环中时，创建临时 session，退出时关闭
+        """
+        shared = self.shared_session()
+        if shared is not None:
+            try:
+                yield shared
+            finally:
+                self.record_stats()
+            return
+
+        async with aiohttp.ClientSession() as session:
+            yield session
+
+    def stats(self) -> dict:
+        if self._session is None or self._session.closed:
+            return {"acquired": 0, "idle": 0, "limit": self._limit}
+        connector = self._session.connector
+        # aiohttp 没有公开连接数，只能读取内部状态
+        acquired = len(getattr(connector, "_acquired", ()))
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return {"acquired": acquired, "idle": idle, "limit": connector.limit}
+
+    def record_stats(self):
+        try:
+            stats = self.stats()
+            record_gauge(self._meter_key, HTTP_POOL_ACQUIRED, stats["acquired"])
+            record_gauge(self._meter_key, HTTP_POOL_IDLE, stats["idle"])
+            record_gauge(self._meter_key, HTTP_POOL_LIMIT, stats["limit"])
+        except Exception as e:
+            service_logger.warning(f"record http pool stats failed: {e}")
+
+
+def _build_pool() -> HttpSessionPool:
+    pool_config = getattr(service_config, "http_pool", None)
+    if pool_config is None:
+        return HttpSessionPool()
+    return HttpSessionPool(
+        limit=getattr(pool_config, "limit", 100),
+        limit_per_host=getattr(pool_config, "limit_per_host", 32),
+        keepalive_timeout=getattr(pool_config, "keepalive_timeout", 30),
+        ttl_dns_cache=getattr(pool_config, "ttl_dns_cache", 300),
+    )
+
+
+http_pool = _build_pool()
@@ -55,6 +55,20 @@ class TaskCollectionModel:
     check_time = "check_time"
     created_at = "created_at"
     updated_at = "updated_at"
+    ready_at = "ready_at" # 可以开始执行的时间戳（秒），用于统计从写入到开始执行的延迟
+    priority = "priority" # 任务优先级，数值越小越先执行
+    lease_expires_at = "lease_expires_at" # 执行租约到期的时间戳（秒），worker 定期续约，过期后任务被回收
+    attempts = "attempts" # 已经被获取执行的次数
+    last_error = "last_error" # 最近一次失败的原因，等待重试时记录
+    pipeline = "pipeline" # 依赖图（TaskGraph）的名称
+    pipeline_id = "pipeline_id" # 同一次提交的依赖图中的任务共享
+    pipeline_started_at = "pipeline_started_at" # 依赖图提交的时间戳（秒）
+    depends_on = "depends_on" # 依赖的任务ID
+    pending_dependencies = "pending_dependencies" # 尚未完成的依赖数，为 0 时任务放入队列
+    downstream = "downstream" # 依赖本任务的任务ID
+    waiters = "waiters" # 等待本任务结束的任务ID（wait_for_tasks），不论结果都会被放入队列
+    dedupe_key = "dedupe_key" # 去重键，见 task_dedupe_key
+    active_dedupe_key = "active_dedupe_key" # 任务未结束时等于 dedupe_key，结束时删除；唯一的部分索引保证同一时间只有一个未结束的任务
 
 
 class StatusCode:
@@ -0,0 +1,190 @@
+import asyncio
+import copy
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from metrics.meter_key import MeterKey
+from metrics.meters import record_count, record_gauge
+from metrics.metrics import ANSWER_CACHE_HIT_COUNT, ANSWER_CACHE_MISS_COUNT, ANSWER_CACHE_ENTRIES
+from service.config.config import ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_REPLAY_SPEED, ANSWER_CACHE_REPLAY_MAX_INTERVAL, ANSWER_CACHE_CHANNEL
+from service.package.redis_client import PubSubClient
+from util.logger import service_logger
+from util.stream.stream_search_model import StreamSearchData
+
+# 录制的事件：(距离开始的秒数, 事件)
+CachedEvents = List[Tuple[float, StreamSearchData]]
+
+
+def _copy_item(item: StreamSearchData) -> StreamSearchData:
+    # ResponseQueue 消费时会修改事件（添加引用标记、参考资料标题等），录制和回放都需要复制
+    if item.is_answer_event() and not item.trace:
+        return StreamSearchData.build_answer(item.event, item.answer)
+    return copy.deepcopy(item)
+
+
+def _normalize_query(query: str) -> str:
+    query = unicodedata.normalize("NFKC", query)
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?!。.").lower()
+
+
+class AnswerCacheRecorder:
+    """录制一次算法请求写入 ResponseQueue 的事件，正常结束后存入缓存"""
+
+    def __init__(self, cache: "AnswerCache", key: str):
+        self._cache = cache
+        self._key = key
+        self._events: CachedEvents = []
+        self._start = time.monotonic()
+        self._failed = False
+
+    def record(self, item: StreamSearchData):
+        if item is None:
+            return
+        if item.event == StreamSearchData.SearchEvent.Error:
+            self._failed = True
+            return
+        if item.event == StreamSearchData.SearchEvent.Received:
+            # received 带有 dialog_id、message_id，由接口每次生成
+            return
+        self._events.append((time.monotonic() - self._start, _copy_item(item)))
+
+    def commit(self):
+        if self._failed:
+            return
+        if not any(item.event == StreamSearchData.SearchEvent.Finished for _, item in self._events):
+            return
+        self._cache.set(self._key, self._events)
+
+
+class AnswerCache:
+    """
+    知识问答首轮问题的答案缓存，进程内 LRU + TTL
+    缓存完整的事件序列（参考资料、溯源、回答、推荐问题），命中时按录制的节奏回放到 ResponseQueue
+    知识库重建索引后通过 Redis pub/sub 通知所有 worker 清空
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: float = ANSWER_CACHE_TTL, channel: str = ANSWER_CACHE_CHANNEL):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._channel = channel
+        self._entries: "OrderedDict[str, Tuple[float, CachedEvents]]" = OrderedDict()
+        self._meter_key = MeterKey(path="/search/stream", method="answer_cache")
+        self._client = None
+        self._listener = None
+
+    @staticmethod
+    def fingerprint(model_query: dict, enable_think, mode) -> Optional[str]:
+        """只缓存没有历史对话、不依赖外网搜索和附加信息的请求，不可缓存时返回 None"""
+        chat_history = model_query.get("chat_history", [])
+        if len(chat_history) != 1:
+            return None
+        for key in ("physical_choice", "auxiliary_choice", "previous_auxiliary_upload", "diagnose_finished"):
+            if key in model_query:
+                return None
+        for source in model_query.get("sources", []):
+            if source.get("type") == "private":
+                # 个人知识库随时上传文档，不走重建索引的失效通知
+                return None
+        config = model_query.get("config", {})
+        if config.get("bing_searcher_config", {}).get("enabled"):
+            # 外网搜索的结果随时间变化
+            return None
+        payload = json.dumps({
+            "query": _normalize_query(chat_history[0]["content"]),
+            "sources": model_query.get("sources", []),
+            "config": config,
+            "enable_think": bool(enable_think),
+            "mode": mode,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedEvents]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            record_count(self._meter_key, ANSWER_CACHE_MISS_COUNT, 1)
+            return None
+        self._entries.move_to_end(key)
+        record_count(self._meter_key, ANSWER_CACHE_HIT_COUNT, 1)
+        return entry[1]
+
+    def set(self, key: str, events: CachedEvents):
+        self._entries[key] = (time.monotonic() + self._ttl, events)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        record_gauge(self._meter_key, ANSWER_CACHE_ENTRIES, len(self._entries))
+
+    def recorder(self, key: str) -> AnswerCacheRecorder:
+        return AnswerCacheRecorder(self, key)
+
+    async def replay(self, events: CachedEvents, response_queue,
+                     speed: float = ANSWER_CACHE_REPLAY_SPEED, max_interval: float = ANSWER_CACHE_REPLAY_MAX_INTERVAL):
+        """按录制时的事件间隔（加速、限制最大间隔）写入 ResponseQueue，保持逐字输出的效果"""
+        previous = 0.0
+        for offset, item in events:
+            delay = min((offset - previous) / speed, max_interval)
+            previous = offset
+            if delay > 0:
+                await asyncio.sleep(delay)
+            response_queue.put(_copy_item(item))
+            await response_queue.drain()
+        response_queue.put(None)
+
+    def clear(self):
+        count = len(self._entries)
+        self._entries.clear()
+        record_gauge(self._meter_key, ANSWER_CACHE_ENTRIES, 0)
+        service_logger.info(f"answer cache cleared, {count} entries")
+
+    async def start(self):
+        if self._listener is not None:
+            return
+        try:
+            client = PubSubClient()
+            await client.ping()
+        except Exception as e:
+            service_logger.warning(f"redis unavailable, answer cache invalidation only works in current worker: {e}")
+            return
+        self._client = client
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def invalidate(self):
+        """通知所有 worker 清空缓存"""
+        if self._client is not None:
+            try:
+                await self._client.publish(self._channel, "all")
+                return
+            except Exception as e:
+                service_logger.warning(f"publish answer cache invalidation failed: {e}")
+        self.clear()
+
+    async def _listen(self):
+        while True:
+            try:
+                async for _ in self._client.subscribe(self._channel):
+                    self.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                service_logger.warning(f"answer cache subscription broken, retry in 1s: {e}")
+                await asyncio.sleep(1)
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,64 @@
+import time
+from typing import List, Optional
+
+from util.stream.stream_search_model import StreamSearchData
+
+
+class AnswerCoalescer:
+    """
+    将连续的回答增量合并为一个 SSE 帧，减少小包写入次数
+    - 只合并同一种回答事件（answering / answer_thinking），且不带溯源信息的增量
+    - 第一个增量到达后 window_ms 内的增量合并在一起，累计超过 max_bytes 时立即输出
+    - 其他事件到达前需要先 flush，保证顺序
+    """
+
+    COALESCE_EVENTS = frozenset([StreamSearchData.SearchEvent.Answering, StreamSearchData.SearchEvent.Answer_Thinking])
+
+    def __init__(self, window_ms: float = 0, max_bytes: int = 1024):
+        self._window = window_ms / 1000
+        self._max_bytes = max_bytes
+        self._head: Optional[StreamSearchData] = None
+        self._parts = []
+        self._size = 0
+        self._deadline = 0.0
+        self.frames = 0
+        self.tokens = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._window > 0
+
+    def can_merge(self, item: Optional[StreamSearchData]) -> bool:
+        return self.enabled and item is not None and item.event in self.COALESCE_EVENTS and not item.trace
+
+    def remaining(self) -> Optional[float]:
+        """距离本次窗口结束的秒数，没有缓存的增量时返回 None"""
+        if self._head is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def add(self, element: StreamSearchData) -> List[bytes]:
+        """缓存一个回答增量，返回需要立即输出的帧"""
+        packets = []
+        if self._head is not None and element.event != self._head.event:
+            packets.append(self.flush())
+        if self._head is None:
+            self._head = element
+            self._deadline = time.monotonic() + self._window
+        self._parts.append(element.answer)
+        self._size += len(element.answer.encode('utf-8'))
+        self.tokens += 1
+        if self._size >= self._max_bytes:
+            packets.append(self.flush())
+        return packets
+
+    def flush(self) -> Optional[bytes]:
+        if self._head is None:
+            return None
+        head = self._head
+        head.answer = "".join(self._parts)
+        self._head = None
+        self._parts = []
+        self._size = 0
+        self.frames += 1
+        return head.to_packet()
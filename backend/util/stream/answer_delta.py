@@ -0,0 +1,24 @@
+class AnswerDelta:
+    """
+    将算法服务返回的回答转换为增量，每个 token 只处理一次新增部分
+    - 算法服务支持增量时，直接使用事件中的 delta 字段
+    - 否则根据累计回答的长度切出新增部分
+    所有回答类事件（answering / answer_thinking / answer_content）共用同一个累计长度
+    """
+
+    DELTA_KEY = "delta"
+
+    def __init__(self):
+        self._length = 0
+
+    def next(self, event: dict, answer=None) -> str:
+        if self.DELTA_KEY in event:
+            delta = event[self.DELTA_KEY] or ""
+            self._length += len(delta)
+            return delta
+        if answer is None:
+            return ""
+        # 回答被重写（长度变短）时，与之前的处理一致：本次不输出
+        delta = answer[self._length:]
+        self._length = len(answer)
+        return delta
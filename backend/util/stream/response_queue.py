@@ -1,60 +1,368 @@
 import asyncio
 import re
 import json
-from typing import Any, Callable
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
 from util.stream.stream_search_model import StreamSearchData
 from util.tracker.stream_search_tracker import StreamingSearchTracker
 from util.logger import service_logger
 from metrics.meter_key import MeterKey
-from metrics.meters import record_latency
-from metrics.metrics import QUERY_UNDERSTAND_LATENCY, CHUNK_RETRIEVE_LATENCY, RE_RANK_LATENCY, ANSWER_FUSION_FIRST_TOKEN_LATENCY, ANSWER_FUSION_TOTAL_LATENCY, EXTRACT_INFO_LATENCY
+from metrics.meters import record_latency, record_gauge, record_count
+from metrics.metrics import QUERY_UNDERSTAND_LATENCY, CHUNK_RETRIEVE_LATENCY, RE_RANK_LATENCY, ANSWER_FUSION_FIRST_TOKEN_LATENCY, ANSWER_FUSION_TOTAL_LATENCY, EXTRACT_INFO_LATENCY, FIRST_TOKEN_LATENCY_FROM_BEGINNING, RESPONSE_QUEUE_LATENCY, RESPONSE_QUEUE_DEPTH, RESPONSE_QUEUE_BYTES, RESPONSE_QUEUE_OVERFLOW_COUNT, STREAM_CANCELLED_COUNT, STREAM_CANCELLED_TOKENS_SAVED_ESTIMATE
+from service.config.config import STREAM_ENGINE, STREAM_COALESCE_WINDOW_MS, STREAM_COALESCE_MAX_BYTES, STREAM_QUEUE_MAXSIZE, STREAM_QUEUE_MAX_BYTES, STREAM_QUEUE_POLICY, STREAM_QUEUE_OVERFLOW_FALLBACK, STREAM_QUEUE_BLOCK_TIMEOUT, STREAM_DISCONNECT_CHECK_INTERVAL
+from util.stream.answer_coalescer import AnswerCoalescer
+from util.timer import Timer
 
-class ResponseQueue:
-
-    class __Differ:
-        def __init__(self):
-            self.pre_answer = ""
+# 合并窗口结束，需要输出缓存的回答
+_FLUSH = object()
+# 客户端断开或停止生成，停止消费
+_CANCELLED = object()
 
-        def __str_subtract(self, str1, str2):
-            len2 = len(str2)
-            result = str1[len2:]
-            return result
+class ResponseQueue:
+    # 队列满时的处理策略
+    POLICY_BLOCK = "block"
+    POLICY_COALESCE = "coalesce"
+    POLICY_DROP_DEBUG = "drop_debug"
+    # coalesce / drop_debug 无法处理的数据：POLICY_BLOCK 等待消费，或者断开流
+    FALLBACK_DISCONNECT = "disconnect"
 
-        def diff(self, current_stream_data: StreamSearchData):
-            if (current_stream_data.answer is not None and current_stream_data.is_answer_event()):
-                current_answer = current_stream_data.answer
-                current_stream_data.answer = self.__str_subtract(current_stream_data.answer, self.pre_answer)
-                self.pre_answer = current_answer
+    # 进程内所有流式响应队列缓存的数据条数和字节数
+    _total_depth = 0
+    _total_bytes = 0
+    # 正常结束的回答平均 token（增量）数，用于估算客户端断开后节省的 token
+    # executor 方式下在多个线程中更新，需要加锁
+    _avg_answer_tokens = 0.0
+    _avg_answer_tokens_lock = threading.Lock()
 
     def __init__(self,
                  next_action: Callable[[StreamSearchData], StreamSearchData],
                  error_action: Callable[[Any], StreamSearchData],
                  complete_action: Callable[[], None],
-                 tracker: StreamingSearchTracker):
+                 tracker: StreamingSearchTracker,
+                 coalesce_window_ms: float = STREAM_COALESCE_WINDOW_MS,
+                 coalesce_max_bytes: int = STREAM_COALESCE_MAX_BYTES,
+                 maxsize: int = STREAM_QUEUE_MAXSIZE,
+                 max_bytes: int = STREAM_QUEUE_MAX_BYTES,
+                 policy: str = STREAM_QUEUE_POLICY,
+                 overflow_fallback: str = STREAM_QUEUE_OVERFLOW_FALLBACK,
+                 is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
         self._queue = asyncio.Queue()
+        # 队列所属的事件循环，subscribe() 在该事件循环中消费
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = asyncio.get_event_loop()
+        # 其他线程写入的数据先缓存在这里，由所属事件循环批量取走，减少唤醒次数
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_lock = threading.Lock()
+        self._drain_scheduled = False
         self._done = False
-        self._differ = ResponseQueue.__Differ()
         self._next_action = next_action
         self._error_action = error_action
         self._complete_action = complete_action
         self._references_info = []
         self._traces_info = {} # {"0":{"0.0":{}}, "1":{}, "2":{}}
-        self._answer_with_cite = '' # SDK返回的 answer 不带引用信息，_answer_with_cite 是处理之后加了引用信息，用于保存到 DB 中
-        self._answer_thinking = '' # 回答思考
+        # 回答都是增量，先收集片段，结束时再拼接，避免字符串反复拷贝
+        self._answer_with_cite = [] # SDK返回的 answer 不带引用信息，_answer_with_cite 是处理之后加了引用信息，用于保存到 DB 中
+        self._answer_thinking = [] # 回答思考
         self._tracker = tracker
         self._debug = {}
         self._meterKey = MeterKey(path="/search/stream", method="post")
+        # 首 token 耗时按执行方式（async / executor）区分，便于 A/B 对比
+        self._first_token_meterKey = MeterKey(path="/search/stream", method=STREAM_ENGINE)
+        self._first_token_sent = False
+        self._timer = Timer()
+        self._coalescer = AnswerCoalescer(coalesce_window_ms, coalesce_max_bytes)
+        # 合并窗口结束时向队列写入 _FLUSH，每个合并帧只需要一个定时器
+        self._flush_timer = None
+        # 队列上限：asyncio.Queue 本身不限制大小，条数和字节数在写入时统计
+        self._maxsize = maxsize
+        self._max_bytes = max_bytes
+        self._policy = policy
+        self._overflow_fallback = overflow_fallback
+        self._depth = 0
+        self._bytes = 0
+        self._tail = None # 最后写入、尚未被消费的数据，coalesce 策略合并到这里
+        # 队列满时放不下的数据，不计入队列，客户端消费后按顺序移入队列，写入方在 drain() 中等待
+        self._waiting = deque()
+        self._closed = False
+        # block 策略下写入方等待队列可写：同一事件循环用 asyncio.Event，其他线程用 threading.Event
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._writable_threadsafe = threading.Event()
+        self._writable_threadsafe.set()
+        self._overflow_meterKey = MeterKey(path="/search/stream", method=policy)
+        # 客户端断开检测，通常传入 request.is_disconnected
+        self._is_disconnected = is_disconnected
+        self._disconnect_watcher = None
+        self._cancelled = False
+        self._answer_tokens = 0
+        # 答案缓存的录制器，写入的每个事件都交给它，正常结束后存入缓存
+        self._recorder = None
+
+    def record_to(self, recorder):
+        self._recorder = recorder
 
     def put(self, item: Any):
-        self._queue.put_nowait(item)
+        if self._recorder is not None:
+            self._recorder.record(item)
+        entry = [item, time.monotonic(), self._estimate_size(item)]
+        if self._in_owner_loop():
+            self._enqueue(entry)
+        else:
+            self._put_threadsafe(entry)
+
+    async def drain(self):
+        """
+        队列满时等待客户端消费，参考 asyncio.StreamWriter.drain()
+        写入方（request_work）每处理完一个事件调用一次，不需要等待时立即返回；
+        block 策略下队列满就等待，coalesce / drop_debug 策略下只在有数据放不进队列时等待
+        超时说明客户端长时间不消费，断开流，避免放不进队列的数据继续堆积
+        """
+        if not self._must_wait():
+            return
+        timeout = STREAM_QUEUE_BLOCK_TIMEOUT
+        try:
+            if self._in_owner_loop():
+                self._writable.clear()
+                if self._must_wait():
+                    await asyncio.wait_for(self._writable.wait(), timeout)
+            else:
+                # 其他线程（executor 方式）的事件循环只服务于当前请求，直接阻塞该线程
+                self._writable_threadsafe.clear()
+                if self._must_wait() and not self._writable_threadsafe.wait(timeout):
+                    raise asyncio.TimeoutError()
+        except asyncio.TimeoutError:
+            service_logger.warning(f"response queue still full after {timeout}s, depth: {self._depth}, bytes: {self._bytes}, waiting: {len(self._waiting)}, cancel stream")
+            self.cancel()
+
+    def _put_threadsafe(self, entry: list):
+        """
+        跨线程写入：asyncio.Queue 不是线程安全的，需要交给所属事件循环来写入，
+        同一批次内的多条数据只唤醒一次事件循环
+        """
+        with self._pending_lock:
+            self._pending.append(entry)
+            self._pending_bytes += entry[2]
+            if self._drain_scheduled:
+                return
+            self._drain_scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._drain_pending)
+        except RuntimeError as e:
+            # 事件循环已经关闭，数据不会再被消费
+            service_logger.warning(f"response queue loop closed, drop item: {e}")
+
+    def _drain_pending(self):
+        with self._pending_lock:
+            entries = self._pending
+            self._pending = []
+            self._pending_bytes = 0
+            self._drain_scheduled = False
+        for entry in entries:
+            self._enqueue(entry)
+        self._update_writable()
+
+    def _enqueue(self, entry: list):
+        """在所属事件循环中写入队列，队列满时按策略处理，队列中的数据不超过上限"""
+        if self._closed or self._cancelled:
+            # 已经停止消费（客户端断开），算法请求取消前写入的数据直接丢弃
+            return
+        if not self._waiting and self._has_room():
+            self._push(entry)
+            return
+        if self._overflow(entry):
+            return
+        if self._policy != self.POLICY_BLOCK and self._overflow_fallback == self.FALLBACK_DISCONNECT:
+            service_logger.warning(f"response queue full, depth: {self._depth}, bytes: {self._bytes}, disconnect stream")
+            record_count(self._overflow_meterKey, RESPONSE_QUEUE_OVERFLOW_COUNT, 1)
+            self.cancel()
+            return
+        self._waiting.append(entry)
+
+    def _push(self, entry: list):
+        self._queue.put_nowait(entry)
+        self._tail = entry
+        self._account(1, entry[2])
+
+    def _overflow(self, entry: list) -> bool:
+        """队列满时的处理，返回 True 表示数据已经处理（合并或丢弃），不需要再写入队列"""
+        item = entry[0]
+        if self._policy == self.POLICY_DROP_DEBUG and isinstance(item, StreamSearchData) and item.event == StreamSearchData.SearchEvent.Debug:
+            record_count(self._overflow_meterKey, RESPONSE_QUEUE_OVERFLOW_COUNT, 1)
+            return True
+        # 已有数据在等待时不能合并到队尾，否则顺序错乱；合并后也不能超过字节上限
+        if (self._policy == self.POLICY_COALESCE and not self._waiting and self._tail is not None
+                and self._bytes + entry[2] <= self._max_bytes and self._mergeable(self._tail[0], item)):
+            self._tail[0].answer += item.answer
+            self._tail[2] += entry[2]
+            self._account(0, entry[2])
+            record_count(self._overflow_meterKey, RESPONSE_QUEUE_OVERFLOW_COUNT, 1)
+            return True
+        return False
+
+    @staticmethod
+    def _mergeable(tail: Any, item: Any) -> bool:
+        return (isinstance(tail, StreamSearchData) and isinstance(item, StreamSearchData)
+                and tail.event == item.event and tail.is_answer_event()
+                and not tail.trace and not item.trace
+                and tail.answer is not None and item.answer is not None)
+
+    def _has_room(self) -> bool:
+        """队列中还能否再放入一条，只看已经进入队列的数据"""
+        return self._maxsize <= 0 or (self._depth < self._maxsize and self._bytes < self._max_bytes)
+
+    def _must_wait(self) -> bool:
+        """写入方是否需要在 drain() 中等待"""
+        if self._closed or self._cancelled:
+            return False
+        if self._waiting:
+            return True
+        if self._policy == self.POLICY_BLOCK:
+            return self._is_full()
+        # 队列满时其他线程写入的数据可能放不进队列，等所属事件循环处理完再判断
+        return bool(self._pending) and self._is_full()
+
+    def _update_writable(self):
+        if not self._must_wait():
+            self._writable.set()
+            self._writable_threadsafe.set()
+
+    def _is_full(self) -> bool:
+        if self._maxsize <= 0 or self._closed:
+            return False
+        # 其他线程写入、尚未进入队列的数据也计算在内
+        return (self._depth + len(self._pending) >= self._maxsize
+                or self._bytes + self._pending_bytes >= self._max_bytes)
+
+    @staticmethod
+    def _estimate_size(item: Any) -> int:
+        """估算数据输出后的字节数：回答只统计 answer，其他事件很少，直接序列化"""
+        if not isinstance(item, StreamSearchData):
+            return 0
+        if item.is_answer_event() and not item.trace:
+            return len(item.answer.encode('utf-8')) if item.answer else 0
+        try:
+            return len(item.to_packet())
+        except Exception:
+            return 0
+
+    def _account(self, depth: int, size: int):
+        self._depth += depth
+        self._bytes += size
+        ResponseQueue._total_depth += depth
+        ResponseQueue._total_bytes += size
+        record_gauge(self._meterKey, RESPONSE_QUEUE_DEPTH, ResponseQueue._total_depth)
+        record_gauge(self._meterKey, RESPONSE_QUEUE_BYTES, ResponseQueue._total_bytes)
+
+    def _release(self):
+        """停止消费后，释放统计并唤醒等待的写入方"""
+        self._closed = True
+        self._account(-self._depth, -self._bytes)
+        self._tail = None
+        self._waiting.clear()
+        self._writable.set()
+        self._writable_threadsafe.set()
+
+    def _in_owner_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
 
     async def __await_get(self) -> Any:
-        item = await self._queue.get()
+        entry = await self._queue.get()
         self._queue.task_done()
+        item, put_time, size = entry
+        if item is _FLUSH or item is _CANCELLED:
+            return item
+        if entry is self._tail:
+            self._tail = None
+        self._account(-1, -size)
+        # 腾出空间后，等待中的数据按顺序移入队列
+        while self._waiting and self._has_room():
+            self._push(self._waiting.popleft())
+        self._update_writable()
+        # 记录从 put 到被消费的耗时
+        record_latency(self._meterKey, RESPONSE_QUEUE_LATENCY, time.monotonic() - put_time)
         if item is None:
             self._done = True
         return item
-    
+
+    def cancel(self):
+        """
+        取消输出（客户端断开、停止生成）：立即取消算法请求，并唤醒 subscribe 结束消费，
+        已生成的部分回答在 subscribe 结束时保存
+        """
+        if self._done or self._closed or self._cancelled:
+            return
+        self._cancelled = True
+        self._tracker.untrack()
+        entry = (_CANCELLED, 0.0, 0)
+        # 唤醒在 drain() 中等待的写入方
+        self._writable_threadsafe.set()
+        if self._in_owner_loop():
+            self._writable.set()
+            self._queue.put_nowait(entry)
+        else:
+            self._loop.call_soon_threadsafe(self._writable.set)
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, entry)
+
+    async def __watch_disconnect(self):
+        """定期检查客户端是否断开，断开后唤醒 subscribe 结束消费"""
+        try:
+            while not self._done:
+                await asyncio.sleep(STREAM_DISCONNECT_CHECK_INTERVAL)
+                if await self._is_disconnected():
+                    service_logger.info("client disconnected, cancel stream")
+                    self.cancel()
+                    return
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            service_logger.warning(f"watch disconnect failed: {e}")
+
+    def __on_interrupted(self):
+        """未收到结束标记就停止消费（客户端断开、出错），保存已生成的部分回答，客户端断开时记录节省的 token"""
+        self._tracker._streaming_search_data["answer_with_cite"] = "".join(self._answer_with_cite)
+        self._tracker._streaming_search_data["answer_thinking"] = "".join(self._answer_thinking)
+        if self._debug:
+            self._tracker._streaming_search_data["debug"] = self._debug
+        if not self._cancelled:
+            return
+        # 按平均回答长度估算，不是上游实际取消的 token 数
+        with ResponseQueue._avg_answer_tokens_lock:
+            avg_answer_tokens = ResponseQueue._avg_answer_tokens
+        tokens_saved = max(0, round(avg_answer_tokens - self._answer_tokens))
+        record_count(self._first_token_meterKey, STREAM_CANCELLED_COUNT, 1)
+        record_count(self._first_token_meterKey, STREAM_CANCELLED_TOKENS_SAVED_ESTIMATE, tokens_saved)
+        service_logger.info(f"stream interrupted, answer tokens: {self._answer_tokens}, estimated tokens saved: {tokens_saved}")
+
+    def __on_finished(self):
+        if self._recorder is not None:
+            self._recorder.commit()
+        if self._answer_tokens > 0:
+            # 指数移动平均
+            with ResponseQueue._avg_answer_tokens_lock:
+                if ResponseQueue._avg_answer_tokens == 0:
+                    ResponseQueue._avg_answer_tokens = self._answer_tokens
+                else:
+                    ResponseQueue._avg_answer_tokens = 0.9 * ResponseQueue._avg_answer_tokens + 0.1 * self._answer_tokens
+
+    def __flush_coalesced(self):
+        """输出缓存的回答，取消尚未触发的定时器"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        return self._coalescer.flush()
+
+    def __schedule_flush(self):
+        if self._flush_timer is None and self._coalescer.remaining() is not None:
+            self._flush_timer = self._loop.call_later(self._coalescer.remaining(), self._queue.put_nowait, (_FLUSH, 0.0, 0))
+
     def first_line(self, content: str) -> str:
         lines = content.split('\n', -1)
         for line in lines:
@@ -112,9 +420,29 @@ class ResponseQueue:
 
 
     async def subscribe(self):
+        if self._is_disconnected is not None:
+            self._disconnect_watcher = asyncio.ensure_future(self.__watch_disconnect())
         try:
             while True:
                 item = await self.__await_get()
+                if item is _CANCELLED:
+                    # 输出已经合并缓存的回答，与保存的部分回答保持一致
+                    packet = self.__flush_coalesced()
+                    if packet is not None:
+                        yield packet
+                    break
+                if item is _FLUSH:
+                    # 定时器可能在缓存已经输出之后才被消费，此时没有数据
+                    self._flush_timer = None
+                    packet = self._coalescer.flush()
+                    if packet is not None:
+                        yield packet
+                    continue
+                # 其他事件先输出缓存的回答，保证顺序
+                if not self._coalescer.can_merge(item):
+                    packet = self.__flush_coalesced()
+                    if packet is not None:
+                        yield packet
                 # 收集 debug 信息，debug event 可能多次返回
                 if item and item.event == StreamSearchData.SearchEvent.Debug:
                     for key in item.debug:
@@ -166,28 +494,55 @@ class ResponseQueue:
 
                 element = self._next_action(item)
                 if element is not None:
-                    self._differ.diff(element)
                     if element.is_answer_event() == False or element.answer_length() != 0:
                         # 收集引用信息
                         self.add_cite_info(element)
+                        if element.is_answer_event():
+                            self._answer_tokens += 1
                         if element.event == StreamSearchData.SearchEvent.Answer_Thinking:
                             # 收集回答思考内容
-                            self._answer_thinking += element.answer
+                            self._answer_thinking.append(element.answer)
                         elif element.answer_length() != 0:
                             # 收集正式回答内容
-                            self._answer_with_cite += element.answer
-                        yield element.to_packet()
+                            self._answer_with_cite.append(element.answer)
+                        if self._first_token_sent and self._coalescer.can_merge(element):
+                            # 首 token 之后的回答增量合并输出
+                            for packet in self._coalescer.add(element):
+                                yield packet
+                            if self._coalescer.remaining() is None:
+                                # 达到 max_bytes 已经输出
+                                self.__flush_coalesced()
+                            else:
+                                self.__schedule_flush()
+                        else:
+                            if not self._first_token_sent and element.is_answer_event():
+                                self._first_token_sent = True
+                                record_latency(self._first_token_meterKey, FIRST_TOKEN_LATENCY_FROM_BEGINNING, self._timer.duration())
+                            yield element.to_packet()
 
                 # 结束之前，用带有引用信息的答案保存到数据库中，用于前端展示历史会话
                 if self._done:
-                    self._tracker._streaming_search_data["answer_with_cite"] = self._answer_with_cite
-                    self._tracker._streaming_search_data["answer_thinking"] = self._answer_thinking
+                    self._tracker._streaming_search_data["answer_with_cite"] = "".join(self._answer_with_cite)
+                    self._tracker._streaming_search_data["answer_thinking"] = "".join(self._answer_thinking)
+                    self.__on_finished()
                     break
         
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开时 Starlette 取消响应
+            self._cancelled = True
+            raise
         except Exception as consume_ex:
             service_logger.warning(f"subscribe error: {consume_ex}")
             yield self._error_action(consume_ex).to_packet()
         finally:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            if self._disconnect_watcher is not None:
+                self._disconnect_watcher.cancel()
+            if not self._done:
+                self.__on_interrupted()
+            self._release()
+            # complete_action 中 tracker.untrack() 取消仍在运行的算法请求
             self._complete_action()
 
     # 当回答过程中出现溯源信息，添加进 answer 里面，便于前端实时渲染溯源
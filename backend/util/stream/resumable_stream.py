@@ -0,0 +1,246 @@
+import asyncio
+import math
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from service.config.config import STREAM_RESUME_GRACE, STREAM_REPLAY_TTL, STREAM_REPLAY_MAXLEN
+from service.package.redis_client import create_async_redis
+from util.logger import service_logger
+from util.stream.response_queue import ResponseQueue
+from util.stream.stream_search_model import StreamSearchData
+
+
+class LocalReplayBuffer:
+    """进程内的数据帧缓存，Redis 不可用时使用，只能在同一个 worker 中续传"""
+
+    # 客户端接收时刷新心跳的间隔
+    TOUCH_INTERVAL = 1.0
+
+    def __init__(self, maxlen: int = STREAM_REPLAY_MAXLEN):
+        self._maxlen = maxlen
+        self._frames = []
+        self._base_seq = 1 # self._frames[0] 的序号
+        self._seq = 0
+        self._finished = False
+        self._changed = asyncio.Event()
+        self._last_seen = time.monotonic()
+
+    async def append(self, packet: bytes) -> int:
+        self._seq += 1
+        self._frames.append(StreamSearchData.add_event_id(packet, self._seq))
+        if len(self._frames) > self._maxlen * 2:
+            # 超过上限时批量丢弃最早的数据帧
+            dropped = len(self._frames) - self._maxlen
+            del self._frames[:dropped]
+            self._base_seq += dropped
+        self._notify()
+        return self._seq
+
+    async def finish(self):
+        self._finished = True
+        self._notify()
+
+    async def touch(self):
+        self._last_seen = time.monotonic()
+
+    async def idle_seconds(self) -> float:
+        return time.monotonic() - self._last_seen
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, last_event_id: int = 0) -> AsyncIterator[bytes]:
+        last = last_event_id
+        while True:
+            self._last_seen = time.monotonic()
+            if last + 1 < self._base_seq:
+                service_logger.warning(f"replay frames {last + 1}~{self._base_seq - 1} are dropped")
+                last = self._base_seq - 1
+            for frame in self._frames[last + 1 - self._base_seq:]:
+                last += 1
+                yield frame
+            if last >= self._seq:
+                if self._finished:
+                    return
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.TOUCH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+
+class RedisReplayBuffer:
+    """
+    基于 Redis stream 的数据帧缓存，任意 worker 都可以续传
+    stream 的 entry id 使用数据帧序号（<seq>-0），结束时写入 end 标记
+    重新生成回答时 message_id 不变，开始写入前需要 reset 删除上一次生成的数据帧
+    """
+
+    TOUCH_INTERVAL = 1.0
+
+    def __init__(self, redis, dialog_id: str, message_id: str, maxlen: int = STREAM_REPLAY_MAXLEN, ttl: int = STREAM_REPLAY_TTL):
+        self._redis = redis
+        self._key = f"sse_replay:{dialog_id}:{message_id}"
+        self._seen_key = f"{self._key}:seen"
+        self._maxlen = maxlen
+        self._ttl = ttl
+        self._seq = 0
+        self._last_touch = 0.0
+
+    async def reset(self):
+        """删除同一个 message_id 上一次生成的数据帧和心跳，否则序号从 1 开始的 xadd 会失败"""
+        await self._redis.delete(self._key, self._seen_key)
+        self._seq = 0
+
+    async def append(self, packet: bytes) -> int:
+        self._seq += 1
+        frame = StreamSearchData.add_event_id(packet, self._seq)
+        await self._redis.xadd(self._key, {"data": frame.decode("utf-8")}, id=f"{self._seq}-0", maxlen=self._maxlen, approximate=True)
+        if self._seq == 1:
+            await self._redis.expire(self._key, self._ttl)
+        return self._seq
+
+    async def finish(self):
+        await self._redis.xadd(self._key, {"end": "1"}, id=f"{self._seq + 1}-0")
+        await self._redis.expire(self._key, self._ttl)
+
+    async def exists(self) -> bool:
+        return await self._redis.exists(self._key) > 0
+
+    async def touch(self):
+        now = time.time()
+        if now - self._last_touch < self.TOUCH_INTERVAL:
+            return
+        self._last_touch = now
+        await self._redis.set(self._seen_key, now, ex=self._ttl)
+
+    async def idle_seconds(self) -> float:
+        last_seen = await self._redis.get(self._seen_key)
+        if last_seen is None:
+            return math.inf
+        return time.time() - float(last_seen)
+
+    async def follow(self, last_event_id: int = 0) -> AsyncIterator[bytes]:
+        last = f"{last_event_id}-0"
+        while True:
+            await self.touch()
+            resp = await self._redis.xread({self._key: last}, count=100, block=int(self.TOUCH_INTERVAL * 1000))
+            if not resp:
+                if not await self.exists():
+                    # 缓存已经过期
+                    return
+                continue
+            for entry_id, fields in resp[0][1]:
+                last = entry_id
+                if "end" in fields:
+                    return
+                yield fields["data"].encode("utf-8")
+
+
+class ReplayStore:
+    """按 dialog_id + message_id 创建和查找数据帧缓存，Redis 可用时使用 Redis stream"""
+
+    def __init__(self):
+        self._redis = None
+        self._local: Dict[str, LocalReplayBuffer] = {}
+
+    async def start(self):
+        try:
+            client = create_async_redis()
+            await client.ping()
+            self._redis = client
+            service_logger.info("replay store uses redis stream")
+        except Exception as e:
+            service_logger.warning(f"redis unavailable, replay store falls back to local memory: {e}")
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def create(self, dialog_id: str, message_id: str):
+        """创建新的缓存，重新生成回答时替换同一个 message_id 的旧缓存"""
+        if self._redis is not None:
+            buffer = RedisReplayBuffer(self._redis, dialog_id, message_id)
+            await buffer.reset()
+            return buffer
+        key = f"{dialog_id}:{message_id}"
+        buffer = LocalReplayBuffer()
+        self._local[key] = buffer
+        # 到期后删除，与 Redis 的 ttl 一致
+        asyncio.get_running_loop().call_later(STREAM_REPLAY_TTL, self._expire, key, buffer)
+        return buffer
+
+    async def open(self, dialog_id: str, message_id: str):
+        local = self._local.get(f"{dialog_id}:{message_id}")
+        if local is not None:
+            return local
+        if self._redis is not None:
+            buffer = RedisReplayBuffer(self._redis, dialog_id, message_id)
+            if await buffer.exists():
+                return buffer
+        return None
+
+    def _expire(self, key: str, buffer: LocalReplayBuffer):
+        if self._local.get(key) is buffer:
+            del self._local[key]
+
+
+class ResumableStream:
+    """
+    可续传的流式响应：后台任务消费 ResponseQueue，把数据帧写入缓存，
+    HTTP 响应只从缓存中读取，客户端断开不影响生成，重连后从 Last-Event-ID 继续；
+    超过 grace 秒没有客户端接收时取消算法请求
+    """
+
+    # 持有后台任务的引用，避免被 GC 回收
+    _running_tasks = set()
+
+    def __init__(self, response_queue: ResponseQueue, buffer, grace: float = STREAM_RESUME_GRACE):
+        self._response_queue = response_queue
+        self._buffer = buffer
+        self._grace = grace
+
+    def start(self):
+        task = asyncio.create_task(self._pump())
+        ResumableStream._running_tasks.add(task)
+        task.add_done_callback(ResumableStream._running_tasks.discard)
+        return self
+
+    def follow(self, last_event_id: int = 0) -> AsyncIterator[bytes]:
+        return self._buffer.follow(last_event_id)
+
+    async def _pump(self):
+        watcher = None
+        try:
+            # 从开始输出时计算客户端空闲时间
+            await self._buffer.touch()
+            watcher = asyncio.create_task(self._watch_followers())
+            async for packet in self._response_queue.subscribe():
+                await self._buffer.append(packet)
+        except Exception as e:
+            service_logger.error(f"resumable stream pump failed: {e}")
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            try:
+                await self._buffer.finish()
+            except Exception as e:
+                service_logger.warning(f"finish replay buffer failed: {e}")
+
+    async def _watch_followers(self):
+        interval = min(1.0, self._grace)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                idle = await self._buffer.idle_seconds()
+            except Exception as e:
+                service_logger.warning(f"check replay followers failed: {e}")
+                continue
+            if idle > self._grace:
+                service_logger.info(f"no client for {idle:.1f}s, cancel stream")
+                self._response_queue.cancel()
+                return
+
+
+replay_store = ReplayStore()
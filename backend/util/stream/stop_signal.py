@@ -0,0 +1,81 @@
+import asyncio
+from typing import Callable, Dict
+
+from service.config.config import STOP_GENERATING_CHANNEL
+from service.package.redis_client import PubSubClient
+from util.logger import service_logger
+
+
+class StopSignal:
+    """
+    停止生成的跨 worker 通知，按 message_id 找到正在输出该消息的流式响应并取消
+    - 每个 worker 订阅 Redis 频道，stop_generating 请求可能落在任意 worker 上
+    - Redis 不可用时退化为进程内通知，只能停止当前 worker 中的流式响应
+    """
+
+    def __init__(self, channel: str = STOP_GENERATING_CHANNEL):
+        self._channel = channel
+        self._handlers: Dict[str, Callable[[], None]] = {}
+        self._client = None
+        self._listener = None
+
+    async def start(self):
+        if self._listener is not None:
+            return
+        try:
+            client = PubSubClient()
+            await client.ping()
+        except Exception as e:
+            service_logger.warning(f"redis unavailable, stop generating only works in current worker: {e}")
+            return
+        self._client = client
+        self._listener = asyncio.create_task(self._listen())
+        service_logger.info(f"stop signal subscribed to channel: {self._channel}")
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def register(self, message_id: str, handler: Callable[[], None]):
+        self._handlers[message_id] = handler
+
+    def unregister(self, message_id: str):
+        self._handlers.pop(message_id, None)
+
+    async def publish(self, message_id: str):
+        if self._client is not None:
+            try:
+                await self._client.publish(self._channel, message_id)
+                return
+            except Exception as e:
+                service_logger.warning(f"publish stop signal failed, message_id: {message_id}, error: {e}")
+        self._dispatch(message_id)
+
+    def _dispatch(self, message_id: str):
+        handler = self._handlers.pop(message_id, None)
+        if handler is None:
+            # 该消息不在当前 worker 中输出
+            return
+        service_logger.info(f"stop generating, message_id: {message_id}")
+        try:
+            handler()
+        except Exception as e:
+            service_logger.warning(f"stop generating failed, message_id: {message_id}, error: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message_id in self._client.subscribe(self._channel):
+                    self._dispatch(message_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                service_logger.warning(f"stop signal subscription broken, retry in 1s: {e}")
+                await asyncio.sleep(1)
+
+
+stop_signal = StopSignal()
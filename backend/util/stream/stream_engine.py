@@ -0,0 +1,29 @@
+import asyncio
+from typing import Callable, Coroutine
+
+from service.config.config import STREAM_ENGINE
+from util.logger import service_logger
+
+STREAM_ENGINE_ASYNC = "async"
+STREAM_ENGINE_EXECUTOR = "executor"
+
+# 持有正在运行的 task 的引用，避免 task 在运行过程中被 GC 回收
+_running_tasks = set()
+
+
+def start_stream(executor_func: Callable, async_func: Callable[..., Coroutine], *args):
+    """
+    启动算法流式请求，结果通过 ResponseQueue 返回
+    - async: 在服务自身的事件循环中以 task 方式运行 async_func，直接写入 ResponseQueue
+    - executor: 在线程池中运行 executor_func，每个请求新建一个事件循环（旧方式）
+    """
+    loop = asyncio.get_running_loop()
+    if STREAM_ENGINE == STREAM_ENGINE_ASYNC:
+        task = loop.create_task(async_func(*args))
+        _running_tasks.add(task)
+        task.add_done_callback(_running_tasks.discard)
+        return task
+
+    if STREAM_ENGINE != STREAM_ENGINE_EXECUTOR:
+        service_logger.warning(f"unknown stream engine: {STREAM_ENGINE}, fallback to {STREAM_ENGINE_EXECUTOR}")
+    return loop.run_in_executor(None, executor_func, *args)
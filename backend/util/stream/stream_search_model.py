@@ -3,11 +3,16 @@ from enum import Enum
 
 from util.decorators.class_builder import builder
 
+# 与 json.dumps(ensure_ascii=False) 的输出保持一致
+_encode_str = json.encoder.encode_basestring
+_encode_value = json.JSONEncoder(ensure_ascii=False).encode
+
 
 @builder
 class StreamSearchData:
-    __PREFIX = "data: "
-    __SUFFIX = "\n\n"
+    # 每个 token 都会创建一个对象，用 __slots__ 避免为每个对象分配 __dict__
+    __slots__ = ("event", "query", "answer", "debug", "dialog_id", "message_id",
+                 "reference", "trace", "prompt", "meta", "question_recommend", "info")
 
     class SearchEvent(Enum):
         Init = 0
@@ -58,7 +63,7 @@ class StreamSearchData:
 
 
     def is_answer_event(self):
-        return self.event in [self.SearchEvent.Answering, self.SearchEvent.Answer_Thinking, self.SearchEvent.Answer_Content]
+        return self.event in _ANSWER_EVENTS
 
     def __init__(self):
         self.event = None
@@ -80,20 +85,53 @@ class StreamSearchData:
         else:
             return 0
 
-    def to_packet(self):
-        packet_dict = self.dict()
-        return (self.__PREFIX + json.dumps(packet_dict, ensure_ascii=False) + self.__SUFFIX).encode('utf-8')
+    def to_packet(self, event_id: int = None):
+        """
+        直接拼接 SSE 数据帧，不构建中间的 dict，输出与 json.dumps(self.dict(), ensure_ascii=False) 一致
+        事件名和字段名的片段已经预先编码；event_id 为 SSE 的 id 字段，用于断线续传
+        """
+        parts = []
+        if self.event is not None:
+            parts.append(_EVENT_FRAGMENTS[self.event])
+        for field_name, field_prefix in _FIELD_PREFIXES:
+            field_value = getattr(self, field_name)
+            if field_value is None:
+                continue
+            parts.append(field_prefix if parts else field_prefix[2:])
+            if isinstance(field_value, str):
+                parts.append(_encode_str(field_value).encode('utf-8'))
+            else:
+                parts.append(_encode_value(field_value).encode('utf-8'))
+        packet = _PACKET_PREFIX + b"".join(parts) + _PACKET_SUFFIX
+        if event_id is not None:
+            return StreamSearchData.add_event_id(packet, event_id)
+        return packet
+
+    @staticmethod
+    def add_event_id(packet: bytes, event_id: int) -> bytes:
+        """给已经序列化的数据帧加上 SSE id 字段"""
+        return b"id: %d\n" % event_id + packet
 
     def dict(self):
         packet_dict = {}
-        for field_name, field_value in vars(self).items():
+        for field_name in self.__slots__:
+            field_value = getattr(self, field_name)
             if field_value is not None:
                 if isinstance(field_value, StreamSearchData.SearchEvent):
-                    packet_dict.update({field_name: field_value.name.lower()})
+                    packet_dict[field_name] = field_value.name.lower()
                 else:
-                    packet_dict.update({field_name: field_value})
+                    packet_dict[field_name] = field_value
         return packet_dict
 
+    @staticmethod
+    def build_answer(event: SearchEvent, answer: str, trace=None):
+        """回答事件每个 token 都会创建，不经过 Builder 直接构建"""
+        data = StreamSearchData()
+        data.event = event
+        data.answer = answer
+        data.trace = trace
+        return data
+
 
     @staticmethod
     def build_from_error(dialog_id: str, meta: dict):
@@ -110,3 +148,14 @@ class StreamSearchData:
                 .event(event)
                 .meta(meta)
                 .build())
+
+
+_ANSWER_EVENTS = frozenset([StreamSearchData.SearchEvent.Answering,
+                            StreamSearchData.SearchEvent.Answer_Thinking,
+                            StreamSearchData.SearchEvent.Answer_Content])
+
+# 预编码的 SSE 片段：event 总是第一个字段；其余字段以 ', "name": ' 开头，作为第一个字段时去掉前面的 ', '
+_PACKET_PREFIX = b"data: {"
+_PACKET_SUFFIX = b"}\n\n"
+_EVENT_FRAGMENTS = {event: f'"event": "{event}"'.encode('utf-8') for event in StreamSearchData.SearchEvent}
+_FIELD_PREFIXES = tuple((name, f', "{name}": '.encode('utf-8')) for name in StreamSearchData.__slots__ if name != "event")
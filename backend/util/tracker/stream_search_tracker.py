@@ -15,24 +15,46 @@ class StreamingSearchTracker:
         # 需要保存到数据库的字段，可能散落在不同的 event 中，无法在 event 中统一处理
         # "answer" 不能删除，在获取历史对话中需要用到
         self._fields_to_save = ["query", "answer", "debug", "dialog_id", "prompt", "question_recommend"]
+        # 回答事件中的 answer 是增量，先收集片段，保存时再拼接
+        self._answer_parts = []
 
     # 跟踪数据: 将 data 中需要保存的字段数据保存到 self._streaming_search_data 中
     def track(self, data: StreamSearchData):
+        if data is None:
+            return
         for field_name in self._fields_to_save:
+            if field_name == "answer" and data.is_answer_event():
+                if data.answer:
+                    self._answer_parts.append(data.answer)
+                continue
             if hasattr(data, field_name) and getattr(data, field_name) is not None:
                 #service_logger.info(f"track field_name: {field_name}, value: {getattr(data, field_name)}")
                 self._streaming_search_data[field_name] = getattr(data, field_name)
 
 
-    def untrack(self):
+    def untrack(self) -> bool:
+        """取消仍在运行的算法请求，返回是否发起了取消"""
         try:
             if self._task is not None and not self._task.done():
-                self._task.cancel()
+                task_loop = self._task.get_loop()
+                try:
+                    current_loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    current_loop = None
+                if task_loop is current_loop:
+                    self._task.cancel()
+                else:
+                    # executor 方式下 task 运行在线程池中的事件循环上，需要交给该事件循环取消
+                    task_loop.call_soon_threadsafe(self._task.cancel)
+                return True
         except Exception as ex:
-            service_logger.warn(f"cancel task failed: {ex}")  # The error is originated from cross-threads cancellation
+            service_logger.warning(f"cancel task failed: {ex}")
+        return False
 
 
     def store_message(self, dialog_id, message_id, sources, domain):
+        if self._answer_parts:
+            self._streaming_search_data["answer"] = "".join(self._answer_parts)
         #service_logger.info(f"store message dialog_id: {dialog_id}, message_id: {message_id}, content: {self._streaming_search_data}")
         self._dialog_manager.upsert_message(self._streaming_search_data,
                                                dialog_id,
@@ -0,0 +1,56 @@
+"""
+独立的任务进程，只运行任务引擎（轮询、唤醒通知、按类型并发执行），不提供 API
+
+运行方式::
+
+    python -m worker
+
+API 进程配置 task_scheduler_enabled: false（或环境变量 TASK_SCHEDULER_ENABLED=false）后，
+任务处理能力可以按任务积压单独扩容，CPU 密集的任务也不再占用流式响应的进程。
+扩缩容使用 TASK_WORKER_METRICS_PORT 上的 task_ready_depth（可以立即执行的积压）和
+task_oldest_pending_age（队列延迟），需要配置 task_queue_stats_interval
+"""
+import logging
+import signal
+import threading
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from prometheus_client import start_http_server
+
+from service.config.config import TASK_DISPATCH_ENABLED, TASK_POLL_INTERVAL, TASK_SHUTDOWN_TIMEOUT, TASK_WORKER_METRICS_PORT
+from service.package.task_wakeup import task_wakeup
+from util.logger import service_logger
+from worker.process_task import add_task_jobs, process_task_by_id, worker_id, task_executor
+
+
+def main():
+    logging.getLogger('apscheduler').setLevel(logging.WARNING)
+    stopped = threading.Event()
+
+    def on_signal(signum, frame):
+        service_logger.info(f"worker {worker_id} received signal {signum}, stopping")
+        stopped.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    start_http_server(port=TASK_WORKER_METRICS_PORT)
+    scheduler = BackgroundScheduler()
+    # 启动后立即回收过期任务、处理积压的任务，不等第一次轮询
+    add_task_jobs(scheduler, start_now=True)
+    scheduler.start()
+    if TASK_DISPATCH_ENABLED:
+        task_wakeup.listen(process_task_by_id, worker_id)
+    service_logger.info(f"task worker {worker_id} started, poll interval: {TASK_POLL_INTERVAL}s, dispatch: {TASK_DISPATCH_ENABLED}")
+
+    stopped.wait()
+
+    task_wakeup.stop()
+    scheduler.shutdown()
+    # 等待执行中的任务结束，尚未开始的任务放回队列
+    task_executor.shutdown(TASK_SHUTDOWN_TIMEOUT)
+    service_logger.info(f"task worker {worker_id} stopped")
+
+
+if __name__ == "__main__":
+    main()
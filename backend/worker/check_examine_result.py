@@ -7,6 +7,7 @@ from service.repository.mongo_medical_record_manager import medical_record_manag
 from agents.report_summary import report_summary
 from util.logger import service_logger
 from service.config.config import service_config, IS_DEMO_MODE
+from worker.pipelines import submit_diagnosis_pipeline
 
 def check_examine_result(task_id, task_params):
     treatment_id = task_params.get("treatment_id")
@@ -63,20 +64,8 @@ def check_examine_result(task_id, task_params):
     medical_record_manager.update_last_record(treatment_id, "辅助检查", summary_result)
 
     if IS_DEMO_MODE:
-        # 随机生成 diagnose_id 和 treatment_plan_id
-        diagnose_id = str(uuid.uuid4())
-        treatment_plan_id = str(uuid.uuid4())
-
         # 异步重新生成诊断和处置（加入了辅助检查）
-        task_manager.add_task(
-            task_type="generate_diagnosis_and_treatment_plan",
-            params={
-                "treatment_id": treatment_id,
-                "diagnose_id": diagnose_id,
-                "treatment_plan_id": treatment_plan_id,
-                "source": "check_examine_result"
-            }
-        )
+        submit_diagnosis_pipeline(treatment_id, "check_examine_result")
     return TaskStatus.COMPLETED
 
 
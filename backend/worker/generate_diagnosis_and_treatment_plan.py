@@ -1,5 +1,5 @@
 from datetime import datetime
-from service.repository.mongo_task_manager import TaskStatus, task_manager
+from service.repository.mongo_task_manager import TaskStatus
 from service.repository.mongo_treatment_info import treatment_info_manager
 from service.repository.mongo_medical_record_manager import medical_record_manager
 from agents.medical_diagnosis import generate_medical_diagnosis
@@ -69,17 +69,6 @@ def generate_diagnosis_and_treatment_plan(task_id, task_params):
         service_logger.error(f"failed to update medical record, treatment_id: {treatment_id}, medical_diagnosis: {medical_diagnosis}, error: {e}")
         return TaskStatus.FAIL
 
-    # 生产完成电子病历，触发一个异步任务，用于生成总结，并保存到数据库
-    if not IS_DEMO_MODE and source == "generate_first_electronic_report":
-        # 总结历史病历
-        task_manager.add_task(
-            task_type="summarize_history_data",
-            params={
-                "treatment_id": treatment_id,
-                "with_diagnosis_info": True
-            }   
-        )
-
     # 演示模式下，生成数字虚拟人台词，自然语言的诊断信息
     if IS_DEMO_MODE and source == "generate_first_electronic_report":
         service_logger.info(f"generate diagnosis text in demo mode, treatment_id: {treatment_id}")
@@ -92,17 +81,7 @@ def generate_diagnosis_and_treatment_plan(task_id, task_params):
     else:
         service_logger.info(f"skip generating diagnosis text in real mode, treatment_id: {treatment_id}")
 
-    # 异步生成治疗方案
-    task_manager.add_task(
-        task_type="generate_treatment",
-        params={
-            "treatment_id": treatment_id,
-            "diagnose_id": diagnose_id,
-            "treatment_plan_id": treatment_plan_id,
-            "source": source
-        }
-    )
-
+    # 治疗方案和历史总结在依赖图中（worker/pipelines.py），诊断完成后自动放入队列
     return TaskStatus.COMPLETED
 
 
@@ -1,10 +1,8 @@
 import asyncio
-import time
-import uuid
 import nest_asyncio
 
 from service.repository.mongo_dialog_manager import get_ai_doctor_chat_history
-from service.repository.mongo_task_manager import task_manager, TaskStatus
+from service.repository.mongo_task_manager import task_manager, TaskStatus, WaitForTasks
 from service.repository.mongo_medical_record_manager import medical_record_manager
 from util.logger import service_logger
 from agents.electronic_report import electronic_report
@@ -22,8 +20,8 @@ def generate_first_electronic_report(task_id, task_params):
     chat_history_with_appendix, _ = get_ai_doctor_chat_history(dialog_id=dialog_id, show_appendix=True)
     service_logger.info(f"chat_history_with_appendix: {chat_history_with_appendix}")
 
-    # 检查图片报告是否完成解析
-    previous_auxiliary_report = []
+    # 图片报告和对话分开
+    report_task_ids = []
     chat_history = []
     for item in chat_history_with_appendix:
         content = item.get("content")
@@ -32,38 +30,36 @@ def generate_first_electronic_report(task_id, task_params):
         if isinstance(content, dict) and item.get("appendix"):
             # 目前只处理图片报告类型
             if content.get("type") == "report" and content.get("file_oss_key") is not None:
-                # 检查图片报告是否完成解析
-                report_task_id = content.get("task_id")
-                report_task = task_manager.get_by_task_id(report_task_id)
-                service_logger.info(f"report_task: {report_task}")
-                report_task_status = report_task.get("status")
-                if report_task_status == TaskStatus.COMPLETED.value:
-                    # 图片报告解析完成
-                    previous_auxiliary_report.append({
-                        "report_id": report_task_id,
-                        "content": report_task.get("result").get("result")
-                    })
-                elif report_task_status == TaskStatus.FAIL.value or report_task_status == TaskStatus.CANCEL.value:
-                    # 图片报告解析失败，或者被取消
-                    continue
-                elif report_task_status == TaskStatus.PROCESSING.value:
-                    # 图片报告解析未完成，等待
-                    while True:
-                        report_task = task_manager.get_by_task_id(report_task_id)
-                        report_task_status = report_task.get("status")
-                        if report_task_status == TaskStatus.COMPLETED.value:
-                            previous_auxiliary_report.append({
-                                "report_id": report_task_id,
-                                "content": report_task.get("result").get("result")
-                            })
-                            break
-                        time.sleep(5)
-                elif report_task_status == TaskStatus.PENDING.value:
-                    # 图片报告解析未开始，把该产生电子病历的任务重新加入队列
-                    task_manager.add_task(task_id, task_params)
-                    return TaskStatus.PENDING
+                report_task_ids.append(content.get("task_id"))
         else:
             chat_history.append(item)
+
+    # 检查图片报告是否完成解析，所有报告一次查询
+    previous_auxiliary_report = []
+    unfinished_report_task_ids = []
+    report_tasks = task_manager.get_by_task_ids(report_task_ids, projection={"status": 1, "result": 1})
+    for report_task_id, report_task in zip(report_task_ids, report_tasks):
+        service_logger.info(f"report_task: {report_task}")
+        if report_task is None:
+            continue
+        report_task_status = report_task.get("status")
+        if report_task_status == TaskStatus.COMPLETED.value:
+            # 图片报告解析完成
+            previous_auxiliary_report.append({
+                "report_id": report_task_id,
+                "content": report_task.get("result").get("result")
+            })
+        elif report_task_status == TaskStatus.FAIL.value or report_task_status == TaskStatus.CANCEL.value:
+            # 图片报告解析失败，或者被取消
+            continue
+        else:
+            # 图片报告解析未开始或未完成
+            unfinished_report_task_ids.append(report_task_id)
+
+    # 等待所有图片报告解析结束后重新执行，等待期间不占用 worker
+    if unfinished_report_task_ids:
+        service_logger.info(f"wait for report tasks: {unfinished_report_task_ids}, task_id: {task_id}, treatment_id: {treatment_id}")
+        return WaitForTasks(unfinished_report_task_ids)
     
     service_logger.info(f"task_id: {task_id}, treatment_id: {treatment_id}, dialog_id: {dialog_id}, chat_history: {chat_history}, previous_auxiliary_report: {previous_auxiliary_report}")
     # 生成电子病历
@@ -99,21 +95,7 @@ def generate_first_electronic_report(task_id, task_params):
     # 保存电子病历
     medical_record_manager.insert_medical_record(electronic_report_result)
 
-    # 随机生成 diagnose_id 和 treatment_plan_id
-    diagnose_id = str(uuid.uuid4())
-    treatment_plan_id = str(uuid.uuid4())
-
-    # 异步生成最初版本的诊断和治疗方案
-    task_manager.add_task(
-        task_type="generate_diagnosis_and_treatment_plan",
-        params={
-            "treatment_id": treatment_id,
-            "diagnose_id": diagnose_id,
-            "treatment_plan_id": treatment_plan_id,
-            "source": "generate_first_electronic_report"
-        }
-    )
-
+    # 诊断和治疗方案在依赖图中（worker/pipelines.py），电子病历完成后自动放入队列
     return TaskStatus.COMPLETED
 
 
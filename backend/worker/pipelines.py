@@ -0,0 +1,70 @@
+import uuid
+
+from service.config.config import IS_DEMO_MODE
+from service.repository.mongo_task_manager import task_manager, TaskGraph, task_dedupe_key
+
+
+# 患者提交候诊后的流程：电子病历 -> 诊断 -> 处置方案 + 历史总结
+FIRST_DIAGNOSIS_PIPELINE = "first_diagnosis"
+# 重新生成诊断的流程：诊断 -> 处置方案
+DIAGNOSIS_PIPELINE = "diagnosis"
+# 每次随机生成的结果ID，不参与去重
+GENERATED_ID_PARAMS = ("diagnose_id", "treatment_plan_id")
+
+
+def add_diagnosis_tasks(graph: TaskGraph, treatment_id: str, source: str, depends_on: list = None):
+    """
+    向依赖图中添加诊断和处置方案的任务，诊断完成后处置方案与历史总结并行生成
+    :return: (diagnose_id, treatment_plan_id)
+    """
+    # 随机生成 diagnose_id 和 treatment_plan_id
+    diagnose_id = str(uuid.uuid4())
+    treatment_plan_id = str(uuid.uuid4())
+    params = {
+        "treatment_id": treatment_id,
+        "diagnose_id": diagnose_id,
+        "treatment_plan_id": treatment_plan_id,
+        "source": source
+    }
+    diagnosis = graph.add("generate_diagnosis_and_treatment_plan", params, depends_on=depends_on)
+    graph.add("generate_treatment", dict(params), depends_on=[diagnosis])
+
+    # 第一次诊断后总结历史病历
+    if not IS_DEMO_MODE and source == "generate_first_electronic_report":
+        graph.add(
+            "summarize_history_data",
+            {
+                "treatment_id": treatment_id,
+                "with_diagnosis_info": True
+            },
+            depends_on=[diagnosis]
+        )
+    return diagnose_id, treatment_plan_id
+
+
+def submit_first_diagnosis_pipeline(dialog_id: str, treatment_id: str) -> str:
+    """提交候诊：生成电子病历，完成后生成诊断和处置方案，返回电子病历任务的ID"""
+    graph = TaskGraph(FIRST_DIAGNOSIS_PIPELINE)
+    params = {
+        "dialog_id": dialog_id,
+        "treatment_id": treatment_id,
+    }
+    report = graph.add("generate_first_electronic_report", params)
+    add_diagnosis_tasks(graph, treatment_id, "generate_first_electronic_report", depends_on=[report])
+    # 重复提交候诊时返回尚未完成的电子病历任务
+    task_ids = task_manager.submit_graph(graph, dedupe_key=task_dedupe_key("generate_first_electronic_report", params))
+    return task_ids[0]
+
+
+def submit_diagnosis_pipeline(treatment_id: str, source: str):
+    """重新生成诊断和处置方案，返回 (diagnose_id, treatment_plan_id)"""
+    graph = TaskGraph(DIAGNOSIS_PIPELINE)
+    diagnose_id, treatment_plan_id = add_diagnosis_tasks(graph, treatment_id, source)
+    diagnosis, task_type, params, _ = graph.nodes[0]
+    task_ids = task_manager.submit_graph(graph, dedupe_key=task_dedupe_key(task_type, params, ignore=GENERATED_ID_PARAMS))
+    if task_ids[0] != diagnosis:
+        # 同一个就诊的诊断尚未生成完，返回正在生成的诊断和处置方案
+        existing = task_manager.get_by_task_id(task_ids[0]) or {}
+        existing_params = existing.get("params") or {}
+        return existing_params.get("diagnose_id", diagnose_id), existing_params.get("treatment_plan_id", treatment_plan_id)
+    return diagnose_id, treatment_plan_id
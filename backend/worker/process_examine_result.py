@@ -1,11 +1,11 @@
-import uuid
 import traceback
 
-from service.repository.mongo_task_manager import TaskStatus, task_manager
+from service.repository.mongo_task_manager import TaskStatus
 from service.repository.mongo_treatment_info import treatment_info_manager
 from service.repository.mongo_medical_record_manager import medical_record_manager
 from agents.report_summary import report_summary
 from util.logger import service_logger
+from worker.pipelines import submit_diagnosis_pipeline
 from util.minio_client import minio_client
 from util.ocr_client import ocr_client
 from util.oss import oss_client
@@ -79,20 +79,8 @@ def process_examine_result(task_id, task_params):
             service_logger.error(f"failed to update last medical record, summary_result: {summary_result}, task_id: {task_id}, treatment_id: {treatment_id}, msg: {msg}")
             return TaskStatus.FAIL
 
-        # 随机生成 diagnose_id 和 treatment_plan_id
-        diagnose_id = str(uuid.uuid4())
-        treatment_plan_id = str(uuid.uuid4())
-
         # 因为加入了辅助检查，所以需要重新生成诊断和处置
-        task_manager.add_task(
-            task_type="generate_diagnosis_and_treatment_plan",
-            params={
-                "treatment_id": treatment_id,
-                "diagnose_id": diagnose_id,
-                "treatment_plan_id": treatment_plan_id,
-                "source": "upload_examine_result"
-            }
-        )
+        submit_diagnosis_pipeline(treatment_id, "upload_examine_result")
     return TaskStatus.COMPLETED
 
 
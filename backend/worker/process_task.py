@@ -1,9 +1,19 @@
 import socket
 import uuid
 import time
+import traceback
+from datetime import datetime
 
+from apscheduler.triggers.interval import IntervalTrigger
+
+from metrics.meter_key import MeterKey
+from metrics.meters import record_latency, record_count, record_gauge
+from metrics.metrics import TASK_START_LATENCY, TASK_LEASE_EXPIRED_COUNT, TASK_RECLAIMED_COUNT, TASK_RETRY_COUNT, TASK_PIPELINE_LATENCY, \
+    TASK_WAIT_LATENCY, TASK_RUN_LATENCY, TASK_PENDING_DEPTH, TASK_READY_DEPTH, TASK_PROCESSING_COUNT, TASK_OLDEST_PENDING_AGE
+from service.config.config import TASK_POLL_INTERVAL, TASK_HEARTBEAT_INTERVAL, TASK_REAP_INTERVAL, TASK_QUEUE_STATS_INTERVAL
 from util.logger import service_logger
-from service.repository.mongo_task_manager import task_manager, TaskStatus
+from util.model_types import TaskCollectionModel
+from service.repository.mongo_task_manager import task_manager, TaskStatus, WaitForTasks
 
 from worker.process_upload_report import process_upload_report
 from worker.summarize_history_data import summarize_history_data
@@ -12,6 +22,8 @@ from worker.generate_diagnosis_and_treatment_plan import generate_diagnosis_and_
 from worker.generate_treatment import generate_treatment
 from worker.check_examine_result import check_examine_result
 from worker.process_examine_result import process_examine_result
+from worker.task_executor import TaskExecutor
+from worker.retry_policy import get_retry_policy
 # 获取当前host的name作为worker的id
 worker_id = socket.gethostname()+"_"+str(uuid.uuid4())[:8]
 
@@ -25,59 +37,186 @@ job_map = {
     "process_examine_result": process_examine_result,
 }
 
+def requeue_task(task_id: str):
+    """已经获取锁但没有执行的任务（名额不足、服务停止）放回队列"""
+    task_manager.release_lock(task_id, worker_id, TaskStatus.PENDING)
+    service_logger.info(f"task requeued, task_id: {task_id}, worker_id: {worker_id}")
+
+
+# 按任务类型并发执行；任务结束、名额空出后继续获取待处理的任务
+task_executor = TaskExecutor(on_cancel=requeue_task, on_available=lambda task_type: process_pending_tasks())
+
+
+# 每次轮询最多获取的任务数，避免一直占用调度线程
+MAX_CLAIMS_PER_POLL = 64
+
+
 def process_pending_tasks():
-    # 从任务队列中获取任务
-    tasks = task_manager.find_pending_tasks()
-    for task in tasks:
-        # 获取任务状态
-        task_status = task.get("status")
-        if task_status != TaskStatus.PENDING.value:
-            continue
+    # 按 (priority, check_time) 逐个原子获取到期的任务，跳过本进程没有空闲名额的类型
+    for _ in range(MAX_CLAIMS_PER_POLL):
+        task = task_manager.claim_next_task(worker_id, exclude_types=task_executor.saturated_types())
+        if task is None:
+            break
 
         # 获取任务id
         task_id = task.get("task_id")
-        
-        success = task_manager.acquire_lock(task_id, worker_id)
-        if not success:
-            continue
+        task_type = task.get("task_type")
+
+        # 并发获取时名额可能已经被占用，放回队列留给其他进程
+        if not task_executor.reserve(task_type):
+            requeue_task(task_id)
+            break
+
+        task_executor.submit(task_type, task_id, run_task, task_id, task, "poll")
+
+
+def renew_leases():
+    """续约本进程正在执行的任务，续约失败说明任务已经被回收，由其他 worker 重新执行"""
+    task_ids = task_executor.running_task_ids()
+    if not task_ids:
+        return
+    renewed = task_manager.renew_leases(task_ids, worker_id)
+    if renewed < len(task_ids):
+        service_logger.warning(f"renew task leases, {len(task_ids) - renewed} of {len(task_ids)} tasks already reclaimed, worker_id: {worker_id}")
 
-        service_logger.info(f"acquire task lock, task_id: {task_id}, worker_id: {worker_id}")
 
-        # 获取任务类型
+def reap_expired_tasks():
+    """回收租约过期的任务（worker 退出、卡死），放回队列后立即获取"""
+    reaped = task_manager.reap_expired_tasks()
+    for task_type, task_status in reaped:
+        meter_key = MeterKey(path="task", method=task_type or "unknown")
+        record_count(meter_key, TASK_LEASE_EXPIRED_COUNT, 1)
+        if task_status is TaskStatus.PENDING:
+            record_count(meter_key, TASK_RECLAIMED_COUNT, 1)
+    if any(task_status is TaskStatus.PENDING for _, task_status in reaped):
+        process_pending_tasks()
+
+
+def record_queue_stats():
+    """按任务类型记录队列积压和延迟，没有积压的类型记为 0，避免保留上一次的值"""
+    stats = task_manager.queue_stats()
+    now = time.time()
+    for task_type in set(job_map) | set(stats):
+        entry = stats.get(task_type, {})
+        meter_key = MeterKey(path="task", method=task_type)
+        record_gauge(meter_key, TASK_PENDING_DEPTH, entry.get("pending", 0))
+        record_gauge(meter_key, TASK_READY_DEPTH, entry.get("ready", 0))
+        record_gauge(meter_key, TASK_PROCESSING_COUNT, entry.get("processing", 0))
+        oldest_ready_at = entry.get("oldest_ready_at")
+        record_gauge(meter_key, TASK_OLDEST_PENDING_AGE, max(0.0, now - oldest_ready_at) if oldest_ready_at else 0)
+
+
+def add_task_jobs(scheduler, start_now: bool = False):
+    """注册任务引擎的定时任务：轮询兜底、租约续约、回收过期任务、统计队列积压"""
+    # next_run_time 为 None 表示暂停，不立即执行时不传
+    first_run = {"next_run_time": datetime.now()} if start_now else {}
+    scheduler.add_job(process_pending_tasks, IntervalTrigger(seconds=TASK_POLL_INTERVAL), max_instances=1, **first_run)
+    scheduler.add_job(renew_leases, IntervalTrigger(seconds=TASK_HEARTBEAT_INTERVAL), max_instances=1)
+    scheduler.add_job(reap_expired_tasks, IntervalTrigger(seconds=TASK_REAP_INTERVAL), max_instances=1, **first_run)
+    if TASK_QUEUE_STATS_INTERVAL > 0:
+        scheduler.add_job(record_queue_stats, IntervalTrigger(seconds=TASK_QUEUE_STATS_INTERVAL), max_instances=1, **first_run)
+
+
+def process_task_by_id(task_id: str):
+    """收到新任务的唤醒通知后立即处理，其他进程已经抢到锁时直接返回"""
+    try:
+        task = task_manager.get_by_task_id(task_id)
+        if task is None or task.get("status") != TaskStatus.PENDING.value:
+            return
+        # 重复或过早的通知（例如等待重试的任务），到期后由延迟通知或轮询处理
+        if task.get(TaskCollectionModel.ready_at, 0) > time.time():
+            return
         task_type = task.get("task_type")
-        
-        # 任务计时开始
-        start_time = time.time()
-        
-        # 执行任务
-        task_result_status = None
-        if task_type in job_map:
-            # 获取任务参数
-            task_params = task.get("params")
-            service_logger.info(f"start task: {task_type}, id: {task_id}, params: {task_params}")
-            # TODO：临时取消重试，后续需要优化
-            for i in range(1):
-                task_result_status = job_map[task_type](task_id, task_params)
-                if task_result_status == TaskStatus.FAIL:
-                    service_logger.error(f"task failed, task_id: {task_id}, worker_id: {worker_id}, task_type: {task_type}, retry: {i}")
-                    time.sleep(1)
-                else:
-                    break
-        else:
-            # 未知任务类型
-            service_logger.error(f"unknown task type: {task_type}, task_id: {task_id}, worker_id: {worker_id}")
-            task_result_status = TaskStatus.FAIL
+        # 没有空闲名额时交给其他进程，或者等本进程名额空出后获取
+        if not task_executor.reserve(task_type):
+            return
+        if not task_manager.acquire_lock(task_id, worker_id):
+            task_executor.cancel_reservation(task_type)
+            return
+        task[TaskCollectionModel.attempts] = task.get(TaskCollectionModel.attempts, 0) + 1
+        task_executor.submit(task_type, task_id, run_task, task_id, task, "push")
+    except Exception as e:
+        service_logger.error(f"process task {task_id} failed: {e}, {traceback.format_exc()}")
+
+
+def schedule_retry(task_id: str, task: dict, error: Exception, time_cost: float) -> bool:
+    """按任务类型的重试策略延迟重新调度失败的任务，不重试时返回 False"""
+    task_type = task.get("task_type")
+    attempts = task.get(TaskCollectionModel.attempts, 1)
+    policy = get_retry_policy(task_type)
+    if not policy.should_retry(attempts, error):
+        service_logger.error(f"task failed, task_id: {task_id}, worker_id: {worker_id}, task_type: {task_type}, attempts: {attempts}")
+        return False
+    delay = policy.next_delay(attempts)
+    reason = repr(error) if error is not None else "task returned fail"
+    if not task_manager.retry_task(task_id, worker_id, delay, time_cost=time_cost, error=reason):
+        # 任务已经被回收，不再由本进程处理
+        service_logger.warning(f"retry task skipped, task no longer held, task_id: {task_id}, worker_id: {worker_id}")
+        return True
+    record_count(MeterKey(path="task", method=task_type), TASK_RETRY_COUNT, 1)
+    service_logger.warning(f"task failed, retry in {delay:.1f} seconds, task_id: {task_id}, worker_id: {worker_id}, "
+                           f"task_type: {task_type}, attempts: {attempts}, error: {reason}")
+    return True
 
-        # 任务计时结束
-        end_time = time.time()
 
-        # 释放任务锁
-        service_logger.info(f"release task lock, task_id: {task_id}, worker_id: {worker_id}, task_result_status: {task_result_status}, cost: {end_time - start_time} seconds")
-        task_manager.release_lock(
-            task_id=task_id, 
-            worker_id=worker_id, 
-            task_status=task_result_status, 
-            time_cost=end_time - start_time
-        )
+def run_task(task_id: str, task: dict, source: str):
+    """执行已经获取锁的任务，source 为任务来源（poll 轮询 / push 唤醒）"""
+    service_logger.info(f"acquire task lock, task_id: {task_id}, worker_id: {worker_id}")
+
+    # 获取任务类型
+    task_type = task.get("task_type")
+    
+    # 任务计时开始
+    start_time = time.time()
+    ready_at = task.get(TaskCollectionModel.ready_at)
+    type_meter_key = MeterKey(path="task", method=task_type or "unknown")
+    if ready_at:
+        record_latency(MeterKey(path="task", method=source), TASK_START_LATENCY, max(0.0, start_time - ready_at))
+        record_latency(type_meter_key, TASK_WAIT_LATENCY, max(0.0, start_time - ready_at))
+    
+    # 执行任务
+    task_result_status = None
+    task_error = None
+    if task_type in job_map:
+        # 获取任务参数
+        task_params = task.get("params")
+        service_logger.info(f"start task: {task_type}, id: {task_id}, params: {task_params}")
+        try:
+            task_result_status = job_map[task_type](task_id, task_params)
+        except Exception as e:
+            service_logger.error(f"task raised, task_id: {task_id}, worker_id: {worker_id}, task_type: {task_type}, error: {e}, {traceback.format_exc()}")
+            task_error = e
+            task_result_status = TaskStatus.FAIL
+        record_latency(type_meter_key, TASK_RUN_LATENCY, time.time() - start_time)
+        # 失败的任务按重试策略延迟重新调度，等待期间不占用 worker
+        if task_result_status == TaskStatus.FAIL and schedule_retry(task_id, task, task_error, time.time() - start_time):
+            return
+        # 需要等待其他任务结束，释放 worker，等待的任务全部结束时重新放入队列
+        if isinstance(task_result_status, WaitForTasks):
+            if task_manager.wait_for_tasks(task_id, worker_id, task_result_status.task_ids):
+                service_logger.info(f"task waiting for {task_result_status.task_ids}, task_id: {task_id}, worker_id: {worker_id}")
+            return
+    else:
+        # 未知任务类型
+        service_logger.error(f"unknown task type: {task_type}, task_id: {task_id}, worker_id: {worker_id}")
+        task_result_status = TaskStatus.FAIL
+
+    # 任务计时结束
+    end_time = time.time()
 
+    # 释放任务锁
+    service_logger.info(f"release task lock, task_id: {task_id}, worker_id: {worker_id}, task_result_status: {task_result_status}, cost: {end_time - start_time} seconds")
+    released = task_manager.release_lock(
+        task_id=task_id, 
+        worker_id=worker_id, 
+        task_status=task_result_status, 
+        time_cost=end_time - start_time
+    )
 
+    # 依赖图中的任务完成时，记录从提交依赖图到现在的耗时
+    pipeline = task.get(TaskCollectionModel.pipeline)
+    if released and pipeline and task_result_status == TaskStatus.COMPLETED:
+        pipeline_latency = end_time - task.get(TaskCollectionModel.pipeline_started_at, end_time)
+        record_latency(MeterKey(path=pipeline, method=task_type), TASK_PIPELINE_LATENCY, pipeline_latency)
+        service_logger.info(f"pipeline task completed, pipeline: {pipeline}, pipeline_id: {task.get(TaskCollectionModel.pipeline_id)}, "
+                            f"task_type: {task_type}, elapsed since submit: {pipeline_latency:.1f} seconds")
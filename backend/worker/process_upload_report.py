@@ -40,11 +40,20 @@ def process_upload_report(task_id, task_params):
     return TaskStatus.COMPLETED if result.get("status") == 0 else TaskStatus.FAIL
 
 
-def get_report_info_by_id(task_id: str):
-    task = task_manager.get_by_task_id(task_id)
-    if not task:
-        service_logger.error(f"report not found, report_id: {task_id}")
-        return None
+def get_report_info_by_ids(task_ids: list) -> list:
+    """批量获取报告的识别结果，一次查询，返回与 task_ids 顺序一致的列表，没有结果的为 None"""
+    tasks = task_manager.get_by_task_ids(task_ids, projection={"result": 1})
+    report_infos = []
+    for task_id, task in zip(task_ids, tasks):
+        if not task:
+            service_logger.error(f"report not found, report_id: {task_id}")
+            report_infos.append(None)
+        else:
+            report_infos.append(parse_report_info(task))
+    return report_infos
+
+
+def parse_report_info(task: dict):
     # task result 是 json string，当中嵌套 result
     task_result = task.get("result")
     if task_result is None:
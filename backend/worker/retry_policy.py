@@ -0,0 +1,69 @@
+import asyncio
+import random
+
+import aiohttp
+import requests
+
+from service.config.config import TASK_RETRY, TASK_DEFAULT_RETRY
+
+
+# 可以在配置中引用的异常类别，都是上游服务的临时错误
+RETRYABLE_ERRORS = {
+    "ConnectionError": (ConnectionError, requests.exceptions.ConnectionError, aiohttp.ClientConnectionError),
+    "TimeoutError": (TimeoutError, asyncio.TimeoutError, requests.exceptions.Timeout, aiohttp.ServerTimeoutError),
+    "HTTPError": (requests.exceptions.HTTPError, aiohttp.ClientResponseError),
+}
+
+
+class RetryPolicy:
+    """
+    任务失败后的重试策略：
+    - max_attempts：最多执行的次数（包含第一次），1 表示不重试
+    - base_delay / max_delay：第 n 次失败后等待 base_delay * 2^(n-1) 秒，不超过 max_delay
+    - jitter：等待时间在 [1 - jitter, 1] 倍之间随机，避免同一批失败的任务同时重试
+    - retry_on_fail：任务返回 FAIL 时是否重试（agent 遇到上游临时错误时返回 None，任务返回 FAIL）
+    - retry_on：抛出这些类别的异常时重试，见 RETRYABLE_ERRORS，其他异常直接失败
+    """
+
+    def __init__(self, max_attempts: int = 1, base_delay: float = 5, max_delay: float = 300, jitter: float = 0.5,
+                 retry_on_fail: bool = True, retry_on: list = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_on_fail = retry_on_fail
+        self.retry_on = list(RETRYABLE_ERRORS) if retry_on is None else retry_on
+        unknown = [name for name in self.retry_on if name not in RETRYABLE_ERRORS]
+        if unknown:
+            raise ValueError(f"unknown retryable errors: {unknown}, available: {list(RETRYABLE_ERRORS)}")
+        self._retryable_errors = tuple(error for name in self.retry_on for error in RETRYABLE_ERRORS[name])
+
+    def should_retry(self, attempts: int, error: BaseException = None) -> bool:
+        """attempts 为已经执行的次数；error 为 None 表示任务返回了 FAIL"""
+        if attempts >= self.max_attempts:
+            return False
+        if error is None:
+            return self.retry_on_fail
+        return isinstance(error, self._retryable_errors)
+
+    def next_delay(self, attempts: int) -> float:
+        """第 attempts 次执行失败后，距离下次执行的秒数"""
+        delay = min(self.max_delay, self.base_delay * (2 ** max(attempts - 1, 0)))
+        return delay * random.uniform(1 - self.jitter, 1)
+
+    @staticmethod
+    def from_config(config: dict, default: dict = None) -> "RetryPolicy":
+        """配置中未设置的字段使用 default"""
+        return RetryPolicy(**{**(default or {}), **config})
+
+
+def load_retry_policies(config: dict, default: dict = None) -> dict:
+    return {task_type: RetryPolicy.from_config(policy, default) for task_type, policy in config.items()}
+
+
+retry_policies = load_retry_policies(TASK_RETRY, TASK_DEFAULT_RETRY)
+default_retry_policy = RetryPolicy.from_config(TASK_DEFAULT_RETRY)
+
+
+def get_retry_policy(task_type: str) -> RetryPolicy:
+    return retry_policies.get(task_type, default_retry_policy)
@@ -0,0 +1,144 @@
+import threading
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from metrics.meter_key import MeterKey
+from metrics.meters import record_gauge
+from metrics.metrics import TASK_QUEUE_DEPTH, TASK_IN_FLIGHT
+from service.config.config import TASK_CONCURRENCY, TASK_DEFAULT_CONCURRENCY
+from util.logger import service_logger
+
+
+class TaskExecutor:
+    """
+    按任务类型分别限制并发的任务执行器，每种类型一个线程池，长任务不再阻塞其他类型的任务
+    - 获取任务时排除没有空闲名额的类型，获取之后 reserve 占用名额，没有空闲名额时不抢任务，留给其他进程
+    - 曾经因为没有名额而放弃任务的类型，名额释放后调用 on_available，继续获取待处理的任务
+    - shutdown 时不再接收新任务，尚未开始的任务通过 on_cancel 放回队列，等待执行中的任务结束
+    """
+
+    def __init__(self,
+                 concurrency: Optional[Dict[str, int]] = None,
+                 default_concurrency: int = TASK_DEFAULT_CONCURRENCY,
+                 on_cancel: Optional[Callable[[str], None]] = None,
+                 on_available: Optional[Callable[[str], None]] = None):
+        self._concurrency = TASK_CONCURRENCY if concurrency is None else concurrency
+        self._default_concurrency = default_concurrency
+        self._on_cancel = on_cancel
+        self._on_available = on_available
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        # 已占用名额、尚未开始执行的任务数，以及执行中的任务数
+        self._queued = defaultdict(int)
+        self._running = defaultdict(int)
+        # 尚未开始执行的任务，shutdown 时放回队列
+        self._waiting: Dict[str, tuple] = {}
+        # 因为没有名额而放弃过任务的类型
+        self._backlog = set()
+        # 执行中的任务，用于续约
+        self._running_ids = set()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def limit(self, task_type: str) -> int:
+        return max(1, int(self._concurrency.get(task_type, self._default_concurrency)))
+
+    def reserve(self, task_type: str) -> bool:
+        """占用一个执行名额，成功后必须调用 submit 或 cancel_reservation"""
+        with self._condition:
+            if self._closed:
+                return False
+            if self._queued[task_type] + self._running[task_type] >= self.limit(task_type):
+                self._backlog.add(task_type)
+                return False
+            self._queued[task_type] += 1
+        self._record(task_type)
+        return True
+
+    def saturated_types(self) -> list:
+        """没有空闲名额的任务类型，获取任务时排除；名额释放后通过 on_available 再次获取"""
+        with self._condition:
+            saturated = [task_type for task_type in set(self._queued) | set(self._running)
+                         if self._queued[task_type] + self._running[task_type] >= self.limit(task_type)]
+            self._backlog.update(saturated)
+            return saturated
+
+    def cancel_reservation(self, task_type: str):
+        with self._condition:
+            self._queued[task_type] -= 1
+            self._condition.notify_all()
+        self._record(task_type)
+
+    def submit(self, task_type: str, task_id: str, fn: Callable, *args):
+        with self._condition:
+            pool = self._pools.get(task_type)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=self.limit(task_type), thread_name_prefix=f"task-{task_type}")
+                self._pools[task_type] = pool
+            future = pool.submit(self._run, task_type, task_id, fn, args)
+            self._waiting[task_id] = (task_type, future)
+
+    def _run(self, task_type: str, task_id: str, fn: Callable, args: tuple):
+        with self._condition:
+            self._waiting.pop(task_id, None)
+            self._queued[task_type] -= 1
+            self._running[task_type] += 1
+            self._running_ids.add(task_id)
+        self._record(task_type)
+        try:
+            fn(*args)
+        except Exception as e:
+            service_logger.error(f"task {task_id} raised: {e}, {traceback.format_exc()}")
+        finally:
+            with self._condition:
+                self._running[task_type] -= 1
+                self._running_ids.discard(task_id)
+                available = not self._closed and task_type in self._backlog
+                self._backlog.discard(task_type)
+                self._condition.notify_all()
+            self._record(task_type)
+        if available and self._on_available is not None:
+            try:
+                self._on_available(task_type)
+            except Exception as e:
+                service_logger.warning(f"task executor on_available failed: {e}")
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """等待所有任务执行完，超时返回 False"""
+        with self._condition:
+            return self._condition.wait_for(lambda: sum(self._queued.values()) + sum(self._running.values()) == 0, timeout)
+
+    def shutdown(self, timeout: float):
+        with self._condition:
+            self._closed = True
+            waiting = list(self._waiting.items())
+        # 尚未开始的任务取消并放回队列
+        for task_id, (task_type, future) in waiting:
+            if future.cancel():
+                with self._condition:
+                    self._waiting.pop(task_id, None)
+                    self._queued[task_type] -= 1
+                    self._condition.notify_all()
+                self._record(task_type)
+                if self._on_cancel is not None:
+                    self._on_cancel(task_id)
+        if not self.join(timeout):
+            service_logger.warning(f"task executor shutdown timeout, still running: {dict(self._running)}")
+        for pool in self._pools.values():
+            pool.shutdown(wait=False)
+        service_logger.info("task executor stopped")
+
+    def running_task_ids(self) -> list:
+        with self._condition:
+            return list(self._running_ids)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._condition:
+            return {task_type: {"queued": self._queued[task_type], "running": self._running[task_type], "limit": self.limit(task_type)}
+                    for task_type in set(self._queued) | set(self._running)}
+
+    def _record(self, task_type: str):
+        meter_key = MeterKey(path="task", method=task_type)
+        record_gauge(meter_key, TASK_QUEUE_DEPTH, self._queued[task_type])
+        record_gauge(meter_key, TASK_IN_FLIGHT, self._running[task_type])